@@ -17,15 +17,15 @@ echo -n "" > $1
 #	echo -n "" > $FILE_FRAMES
 #fi
 
+# Gathers stats from the cli every TIME second over a single connection, the
+# cli serves every request sent on the same socket in order
 while [ true ]
 do
-	#Gathers stats from the cli and waits TIME second
-	echo "stats_bytes" | nc -U $CLI_PATH -w $TIME | tee -a $FILE
+	echo "stats_bytes"
 	#if [[ $FILE_FRAMES != "" ]]; then
-	#	echo "stats_frames" | nc -U $CLI_PATH -w 0 | tee -a $FILE_FRAMES
+	#	echo "stats_frames"
 	#fi
-	if [ ${PIPESTATUS[1]} -ne 0 ]; then
-	    echo "Fail / Terminated"
-	    break
-	fi
-done
+	sleep $TIME
+done | nc -U $CLI_PATH | tee -a $FILE
+
+echo "Fail / Terminated"
@@ -0,0 +1,261 @@
+#!/bin/python3
+"""Circuit and stream setup timing module
+
+The client Tor runs with __LeaveStreamsUnattached and
+__DisablePredictedCircuits: TorK builds the circuits and attaches the new
+streams itself through the control port, so a stream waits unattached until
+TorK handles it. This collector subscribes to the CIRC and STREAM events of
+the control port and times, from the arrival time of each event:
+
+* circuit build: LAUNCHED to BUILT;
+* stream pending: time spent unattached, from NEW (or a DETACHED) to the
+  SENTCONNECT/SENTRESOLVE that attaches it to a circuit;
+* stream connect: last attach to SUCCEEDED (connection of the exit);
+* stream attach: NEW to SUCCEEDED, the setup delay paid before the first
+  byte of a request.
+
+The number of streams pending is recorded after every stream event.
+"""
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+import stem
+from stem.control import Controller, EventType
+from results_store import load_results
+
+# Duration metrics of the series, in seconds
+DURATIONS = ("circuit_build", "stream_pending", "stream_connect", "stream_attach")
+
+# Percentiles of each duration in the reports
+PERCENTILES = (50, 90, 99)
+
+class CircuitEventCollector:
+    """Times circuit builds and stream attachments from control port events.
+
+    Args:
+        port (int, optional): Tor control port. Defaults to 9061.
+        password (str, optional): Control port password. Defaults to None
+            (cookie or no authentication).
+        host (str, optional): Control port address. Defaults to "127.0.0.1".
+    """
+    def __init__(self, port=9061, password=None, host="127.0.0.1"):
+        self.port = port
+        self.password = password
+        self.host = host
+        self.controller = None
+        self._lock = threading.Lock()
+        self._launched = {}
+        self._new = {}
+        self._pending_since = {}
+        self._pending = {}
+        self._sent = {}
+        self._detaches = {}
+        # Finished circuits and streams, with the time they completed
+        self.circuits = []
+        self.streams = []
+        self.pending = []
+        self.circuits_failed = 0
+        self.streams_failed = 0
+
+    def start(self):
+        """Connects to the control port and subscribes to the events.
+
+        Raises:
+            stem.SocketError: The control port is unreachable.
+        """
+        self.controller = Controller.from_port(address=self.host, port=self.port)
+        try:
+            self.controller.authenticate(password=self.password)
+            self.controller.add_event_listener(self._on_circuit, EventType.CIRC)
+            self.controller.add_event_listener(self._on_stream, EventType.STREAM)
+        except Exception:
+            self.controller.close()
+            self.controller = None
+            raise
+
+    def stop(self):
+        """Unsubscribes and closes the control connection."""
+        if self.controller is None:
+            return
+        try:
+            self.controller.remove_event_listener(self._on_circuit)
+            self.controller.remove_event_listener(self._on_stream)
+        except stem.ControllerError:
+            pass
+        self.controller.close()
+        self.controller = None
+
+    def run(self, duration):
+        """Collects events for `duration` seconds.
+
+        Returns:
+            dict: See `series`.
+        """
+        self.start()
+        try:
+            time.sleep(duration)
+        finally:
+            self.stop()
+        return self.series()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _on_circuit(self, event):
+        """Handles a CIRC event."""
+        arrived = event.arrived_at
+        with self._lock:
+            if event.status == stem.CircStatus.LAUNCHED:
+                self._launched[event.id] = arrived
+            elif event.status == stem.CircStatus.BUILT:
+                launched = self._launched.pop(event.id, None)
+                if launched is not None:
+                    self.circuits.append((arrived, arrived - launched))
+            elif event.status in (stem.CircStatus.FAILED, stem.CircStatus.CLOSED):
+                # Circuits closed once built were already accounted
+                if self._launched.pop(event.id, None) is not None:
+                    self.circuits_failed += 1
+
+    def _on_stream(self, event):
+        """Handles a STREAM event."""
+        arrived = event.arrived_at
+        stream = event.id
+        status = event.status
+        with self._lock:
+            if status in (stem.StreamStatus.NEW, stem.StreamStatus.NEWRESOLVE):
+                self._new[stream] = arrived
+                self._pending_since[stream] = arrived
+                self._pending[stream] = 0.0
+                self._detaches[stream] = 0
+            elif stream not in self._new:
+                # Stream opened before the subscription
+                return
+            elif status == stem.StreamStatus.DETACHED:
+                self._pending_since[stream] = arrived
+                self._detaches[stream] += 1
+            elif status in (stem.StreamStatus.SENTCONNECT, stem.StreamStatus.SENTRESOLVE):
+                since = self._pending_since.pop(stream, None)
+                if since is not None:
+                    self._pending[stream] += arrived - since
+                self._sent[stream] = arrived
+            elif status == stem.StreamStatus.SUCCEEDED:
+                new = self._new.pop(stream)
+                sent = self._sent.pop(stream, new)
+                self._pending_since.pop(stream, None)
+                self.streams.append((arrived, self._pending.pop(stream), arrived - sent,
+                                     arrived - new, self._detaches.pop(stream)))
+            elif status in (stem.StreamStatus.FAILED, stem.StreamStatus.CLOSED):
+                self.streams_failed += 1
+                for state in (self._new, self._sent, self._pending_since, self._pending,
+                              self._detaches):
+                    state.pop(stream, None)
+            else:
+                return
+            self.pending.append((arrived, len(self._pending_since)))
+
+    def series(self):
+        """Timings collected so far.
+
+        Returns:
+            dict: "circuit_build" durations with the wall-clock time each
+                circuit was built ("circuit_times"), the "stream_pending",
+                "stream_connect" and "stream_attach" durations of every
+                stream that succeeded with its "stream_detaches" and
+                completion time ("stream_times"), the number of streams
+                pending ("pending_count") after each stream event
+                ("pending_times"), and the "circuits_failed" and
+                "streams_failed" counts.
+        """
+        with self._lock:
+            circuits = np.array(self.circuits, dtype=np.float64).reshape(-1, 2)
+            streams = np.array(self.streams, dtype=np.float64).reshape(-1, 5)
+            pending = np.array(self.pending, dtype=np.float64).reshape(-1, 2)
+            return {"circuit_times": circuits[:, 0], "circuit_build": circuits[:, 1],
+                    "stream_times": streams[:, 0], "stream_pending": streams[:, 1],
+                    "stream_connect": streams[:, 2], "stream_attach": streams[:, 3],
+                    "stream_detaches": streams[:, 4].astype(np.int64),
+                    "pending_times": pending[:, 0],
+                    "pending_count": pending[:, 1].astype(np.int64),
+                    "circuits_failed": np.array(self.circuits_failed),
+                    "streams_failed": np.array(self.streams_failed)}
+
+def distribution(values):
+    """Count, mean, percentiles and maximum of a duration series."""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {"count": 0}
+    summary = {"count": len(values), "mean": float(values.mean()),
+               "max": float(values.max())}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = float(value)
+    return summary
+
+def report(series):
+    """Distribution of every duration of a collection (see `series`)."""
+    return {name: distribution(series[name]) for name in DURATIONS}
+
+def summarize(path, mode=0, experiment="circuit_events"):
+    """Pools the collections of a results store by k_min.
+
+    Args:
+        path (str): Path of the results store.
+        mode (int, optional): Experiment mode. Defaults to 0 (TorK).
+        experiment (str, optional): Experiment name of the collections.
+            Defaults to "circuit_events".
+
+    Returns:
+        dict: Distribution of every duration (see `report`) plus the failed
+            circuits and streams, by k_min.
+    """
+    pooled = {}
+    for tags, series in load_results(path, experiment=experiment, mode=mode):
+        runs = pooled.setdefault(tags["k_min"], [])
+        runs.append(series)
+    summary = {}
+    for k_min, runs in sorted(pooled.items()):
+        merged = {name: np.concatenate([run[name] for run in runs]) for name in DURATIONS}
+        summary[k_min] = report(merged)
+        summary[k_min]["circuits_failed"] = int(sum(run["circuits_failed"] for run in runs))
+        summary[k_min]["streams_failed"] = int(sum(run["streams_failed"] for run in runs))
+    return summary
+
+def print_report(durations, prefix=""):
+    """Prints the distributions of a report."""
+    for name in DURATIONS:
+        summary = durations[name]
+        if not summary["count"]:
+            print(f"{prefix}{name}: no samples")
+            continue
+        print(f"{prefix}{name}: {summary['count']} samples, "
+              + ", ".join(f"p{percentile} {summary[f'p{percentile}'] * 1000:.1f} ms"
+                          for percentile in PERCENTILES)
+              + f", max {summary['max'] * 1000:.1f} ms")
+
+def main():
+    """Parses the collector arguments and times the events of a running Tor,
+    or summarizes the collections of a results store by k_min.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=9061)
+    parser.add_argument("--password", type=str, default=None)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--results", type=str, default=None)
+    parser.add_argument("--mode", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.results:
+        for k_min, summary in summarize(args.results, args.mode).items():
+            print(f"K {k_min}: {summary['circuits_failed']} circuits and "
+                  f"{summary['streams_failed']} streams failed")
+            print_report(summary, prefix="  ")
+        return
+    collector = CircuitEventCollector(args.port, args.password)
+    print_report(report(collector.run(args.duration)))
+
+if __name__ == '__main__':
+    main()
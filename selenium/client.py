@@ -7,6 +7,9 @@ import socket
 import subprocess
 from argparse import ArgumentParser
 from performance import Performance
+from sweep import SweepScheduler, load_grid
+from sequential import SequentialStopper
+from tor_pool import TorPool
 from tbselenium.utils import start_xvfb, stop_xvfb
 
 def get_dict_subconfig(config, section, prefix):
@@ -14,6 +17,64 @@ def get_dict_subconfig(config, section, prefix):
     return {option.split()[1]: config.get(section, option)
             for option in config.options(section) if option.startswith(prefix)}
 
+def torrc_settings(point, config_file, config_name):
+    """Builds the Tor configuration of a sweep point.
+
+    Args:
+        point (dict): Experiment parameters (mode, k_min and, for TorK,
+            max_chunks, chunk, ts_min, ts_max and ch_active).
+        config_file (str): Path of the configuration file.
+        config_name (str): Configuration section.
+
+    Returns:
+        (str, dict): Bridge IP and torrc options.
+    """
+    if point["mode"] == 2:
+        return "", {"socksport": "0", "controlport": "0"}
+    if point["mode"] not in (0, 1):
+        raise ValueError("Invalid mode.")
+
+    bridge_ip = socket.gethostbyname("bridge")
+    config = configparser.RawConfigParser()
+    config.read(config_file)
+    torrc_config = get_dict_subconfig(config, config_name, "torrc")
+    if point["mode"] == 1:
+        torrc_config["bridge"] = f"{bridge_ip}:9090"
+    else:
+        torrc_config["bridge"] = f"tork {bridge_ip}:8081"
+        torrc_config["ClientTransportPlugin"] = f"tork exec \
+            {os.getenv('TORK_BIN_PATH')} -m client -p 1088 -A 1 \
+            --max_chunks {point['max_chunks']} --chunk {point['chunk']} \
+            --ts_min {point['ts_min']} --ts_max {point['ts_max']} \
+            --k_min {point['k_min']} --ch_active {point['ch_active']}"
+    return bridge_ip, torrc_config
+
+def scale_tor_clients(k_min):
+    """Scales the vanilla Tor clients sharing the bridge to `k_min` - 1.
+
+    Raises:
+        ValueError: The scaling took too long.
+    """
+    host1 = os.getenv("HOST_1")
+    stdout_f = open(f"/results/docker_tor_k_{k_min}.log",
+                    "w", encoding="utf8")
+    cmd = f"ssh vagrant@{host1} -t \
+        docker service scale tork_tor_client=" + str(k_min - 1)
+
+    tor_setup = subprocess.Popen(cmd.split(" "),
+                        stdout=stdout_f,
+                        stderr=stdout_f)
+
+    try:
+        tor_setup.wait(timeout=60)
+    except subprocess.TimeoutExpired as exp:
+        raise ValueError("Scaling services took too long") from exp
+
+def exclusive_resource(point):
+    """Global resource of a sweep point: the number of vanilla Tor clients is
+    shared by every slot, so mode 1 points run one at a time."""
+    return "tor_client_scale" if point["mode"] == 1 else None
+
 def main():
     """Loads the performance experiment configuration and validates the values
     """
@@ -34,6 +95,30 @@ def main():
     parser.add_argument("--ts_max", type=int, default=5001)
     parser.add_argument("--k_min", type=int, default=3)
     parser.add_argument("--ch_active", type=int, default=1)
+    # Sweep:
+    # JSON grid of lists of values by parameter (mode, k_min, max_chunks,
+    # chunk, ts_min, ts_max, ch_active), or list of points, missing
+    # parameters taken from the arguments
+    parser.add_argument("--sweep", type=str, default=os.getenv("SWEEP_GRID"))
+    parser.add_argument("--journal", type=str, default="/results/sweep_journal.jsonl")
+    parser.add_argument("--iterations", type=int, default=10)
+    # Adaptive iteration count: a point stops once the confidence interval
+    # of its goodput and p99 latency is narrower than this fraction of the
+    # mean, after --min_iterations and at most --iterations (unset runs
+    # --iterations)
+    parser.add_argument("--adaptive_width", type=float, default=os.getenv("ADAPTIVE_WIDTH"))
+    parser.add_argument("--min_iterations", type=int,
+                        default=int(os.getenv("MIN_ITERATIONS", "3")))
+    parser.add_argument("--lease", type=float, default=os.getenv("SWEEP_LEASE"))
+    # Warm Tor pool: number of Tor processes kept running between sweep
+    # points (0 launches a new Tor for every point)
+    parser.add_argument("--tor_pool", type=int, default=int(os.getenv("TOR_POOL", "0")))
+    parser.add_argument("--tor_pool_dir", type=str, default="/results/tor_pool")
+    # Load generator: number of synthetic clients run from this process
+    # (see loadgen.py, LOADGEN_* for the workloads) instead of the
+    # throughput iterations, or of the endless download of a single
+    # configuration (0 disables it)
+    parser.add_argument("--loadgen", type=int, default=int(os.getenv("LOADGEN_CLIENTS", "0")))
     args = parser.parse_args()
 
     print("ARGS: ", args)
@@ -44,74 +129,68 @@ def main():
     xvfb_w = int(args.virtual_display.split('x')[1])
     xvfb_display = start_xvfb(xvfb_w, xvfb_h)
 
-    while True:
-        if args.mode == 1:
-            bridge_ip = socket.gethostbyname("bridge")
-            config = configparser.RawConfigParser()
-            config.read(args.config_file)
-            torrc_config = get_dict_subconfig(config, args.config, "torrc")
-            torrc_config["bridge"] = f"{bridge_ip}:9090"
-
-            # Get last k_min value from saved settings
-            if os.path.isfile("/results/settings.txt"):
-                with open("/results/settings.txt") as settings:
-                    k_min, state = settings.readline().split(",")
-
-                    k_min = int(k_min)
-
-                    if state == "COMPLETED":
-                        if k_min + 1 <= 25:
-                            k_min, state = (k_min + 1, "NOT_PROCESSED")
-                        else:
-                            print("K_min is already at maximum value!")
-                            return 0
-            else:
-                k_min, state = (1, "NOT_PROCESSED")
-
-            # Save current settings
-            with open("/results/settings.txt", "w") as settings:
-                settings.write(f"{k_min},{state}")
-
-            host1 = os.getenv("HOST_1")
-            stdout_f = open(f"/results/docker_tor_k_{k_min}.log",
-                            "w", encoding="utf8")
-            cmd = f"ssh vagrant@{host1} -t \
-                docker service scale tork_tor_client=" + str(k_min - 1)
-
-            tor_setup = subprocess.Popen(cmd.split(" "),
-                                stdout=stdout_f,
-                                stderr=stdout_f)
-
-            try:
-                tor_setup.wait(timeout=60)
-            except subprocess.TimeoutExpired as exp:
-                raise ValueError("Scaling services took too long") from exp
-
-        elif args.mode == 0:
-            bridge_ip = socket.gethostbyname("bridge")
-            config = configparser.RawConfigParser()
-            config.read(args.config_file)
-            torrc_config = get_dict_subconfig(config, args.config, "torrc")
-            torrc_config["bridge"] = f"tork {bridge_ip}:8081"
-
-            torrc_config["ClientTransportPlugin"] = f"tork exec \
-                {os.getenv('TORK_BIN_PATH')} -m client -p 1088 -A 1 \
-                --max_chunks {args.max_chunks} --chunk {args.chunk} \
-                --ts_min {args.ts_min} --ts_max {args.ts_max} \
-                --k_min {args.k_min} --ch_active {args.ch_active}"
-
-        elif args.mode == 2:
-            bridge_ip = ""
-            torrc_config = {"socksport": "0", "controlport": "0"}
-            k_min = 0
+    defaults = {"mode": args.mode, "k_min": args.k_min, "max_chunks": args.max_chunks,
+                "chunk": args.chunk, "ts_min": args.ts_min, "ts_max": args.ts_max,
+                "ch_active": args.ch_active}
+    if args.sweep:
+        grid = load_grid(args.sweep)
+        if isinstance(grid, list):
+            grid = [{**defaults, **point} for point in grid]
         else:
-            raise ValueError("Invalid mode.")
-
+            grid = {**defaults, **grid}
+    elif args.mode == 1:
+        # Vanilla Tor is measured for every K_min
+        grid = {**defaults, "k_min": list(range(1, 26))}
+    else:
+        # Single configuration, keeps generating load
+        bridge_ip, torrc_config = torrc_settings(defaults, args.config_file, args.config)
         print("Starting experiment")
-
         performance = Performance((args.clientid, torrc_config), bridge_ip,
                                 args.mode, args.tor_channel, args.k_min)
-        performance.run(iterations=10)
+        if args.loadgen:
+            performance.run_load(args.loadgen, iterations=args.iterations)
+        else:
+            performance.run(iterations=args.iterations)
+        return 0
+
+    tor_pool = None
+    if args.tor_pool:
+        tor_pool = TorPool(os.path.join(args.tor_pool_dir, f"client_{args.clientid}"),
+                           size=args.tor_pool)
+
+    def run_point(point, iterations, done, checkpoint):
+        bridge_ip, torrc_config = torrc_settings(point, args.config_file, args.config)
+        if point["mode"] == 1:
+            scale_tor_clients(point["k_min"])
+        print("Starting experiment")
+        performance = Performance((args.clientid, torrc_config), bridge_ip,
+                                point["mode"], args.tor_channel, point["k_min"],
+                                tor_pool=tor_pool)
+        if args.loadgen:
+            performance.run_load(args.loadgen, iterations, done, checkpoint)
+            return
+        stopper = None
+        if args.adaptive_width:
+            stopper = SequentialStopper(min_iterations=args.min_iterations,
+                                        max_iterations=iterations,
+                                        width=args.adaptive_width)
+        performance.run_iterations(iterations, done, checkpoint, stopper=stopper)
+
+    scheduler = SweepScheduler(grid, args.journal, args.clientid,
+                               iterations=args.iterations,
+                               exclusive=exclusive_resource, lease=args.lease)
+    if tor_pool is not None:
+        # Bootstrap the pool while the first point is being prepared
+        first = next((point for point in scheduler.points if point["mode"] != 2), None)
+        if first is not None:
+            tor_pool.warm(torrc_settings(first, args.config_file, args.config)[1])
+    try:
+        scheduler.run(run_point)
+    finally:
+        if tor_pool is not None:
+            tor_pool.close()
+    stop_xvfb(xvfb_display)
+    return 0
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,297 @@
+#!/bin/python3
+"""Cross-mode comparison module
+
+Compares the runs of a sweep between TorK (mode 0), vanilla Tor (mode 1) and
+the direct connection (mode 2), by k_min, from the results stores of every
+client instead of the iperf, httping and tshark text outputs.
+
+Every store is read in a single pass: the tags of all the runs, then only
+the members of the metrics used here, for the last run of each iteration
+(a retried iteration was stored once per attempt). Each run is reduced to a few scalars
+(mean goodput in steady state or after the first second, p50 and p99 of the
+request latency, chaff overhead of TorK), computed at once for all the runs
+of an experiment on NaN-padded matrices. The runs of each (mode, k_min) group are then
+resampled together: the bootstrap draws all the groups and resamples in one
+vectorized operation, giving the confidence interval of every mean and of
+the TorK over Tor slowdown (ratio of the resampled means).
+"""
+import glob
+import json
+import os
+import zipfile
+from argparse import ArgumentParser
+import numpy as np
+from results_store import TAGS_MEMBER
+from steady_state import STEADY
+
+MODES = {0: "tork", 1: "tor", 2: "direct"}
+
+# Metrics read from the store, by experiment
+EXPERIMENTS = {"goodput": ("time", "rx", "state"),
+               "latency": ("ttfb", "total"),
+               "throughput": ("data_bytes_received", "data_bytes_sent",
+                              "other_bytes_received", "other_bytes_sent")}
+
+def run_key(record):
+    """Identity of a run: an iteration retried after a failure stores its
+    series again under the same key."""
+    return (record["client_id"], record["mode"], record["k_min"], record["iteration"],
+            record["resolution"])
+
+def load_sweep(paths, experiments=EXPERIMENTS):
+    """Reads the runs of several results stores in one pass per store.
+
+    Iterations retried after a failure were stored once per attempt, only
+    the last run of each (client_id, mode, k_min, iteration) is kept.
+
+    Args:
+        paths (list): Paths of the npz results stores.
+        experiments (dict, optional): Metrics to load, by experiment.
+            Defaults to EXPERIMENTS.
+
+    Returns:
+        dict: By experiment, "tags" (structured array, one record per run)
+            and "series" (list of dicts of arrays, in the same order).
+    """
+    runs = {experiment: {} for experiment in experiments}
+    for path in paths:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            tags = {}
+            for name in names:
+                prefix, metric = name[:-len(".npy")].split(".", 1)
+                if metric == TAGS_MEMBER:
+                    with archive.open(name) as member:
+                        tags[prefix] = np.lib.format.read_array(member)[0]
+            # Runs are numbered in the order they were appended
+            latest = {}
+            for prefix in sorted(tags):
+                if tags[prefix]["experiment"] in experiments:
+                    latest[(tags[prefix]["experiment"], run_key(tags[prefix]))] = prefix
+            kept = set(latest.values())
+            members = {}
+            for name in names:
+                prefix, metric = name[:-len(".npy")].split(".", 1)
+                if prefix in kept and metric in experiments[tags[prefix]["experiment"]]:
+                    with archive.open(name) as member:
+                        members.setdefault(prefix, {})[metric] = \
+                            np.lib.format.read_array(member)
+            for (experiment, key), prefix in latest.items():
+                runs[experiment].pop(key, None)
+                runs[experiment][key] = (tags[prefix], members.get(prefix, {}))
+    loaded = {}
+    for experiment, latest in runs.items():
+        records = [record for record, _ in latest.values()]
+        loaded[experiment] = {"tags": np.array(records, dtype=records[0].dtype)
+                              if records else None,
+                              "series": [series for _, series in latest.values()]}
+    return loaded
+
+def padded(series, metric):
+    """Stacks a metric of several runs into a NaN-padded matrix (runs, samples)."""
+    lengths = [len(np.atleast_1d(run.get(metric, ()))) for run in series]
+    matrix = np.full((len(series), max(lengths, default=0)), np.nan)
+    for row, (run, length) in enumerate(zip(series, lengths)):
+        if length:
+            matrix[row, :length] = np.asarray(run[metric], dtype=np.float64)
+    return matrix
+
+def run_metrics(sweep, omit=1.0):
+    """Reduces every run to its scalar metrics.
+
+    Args:
+        sweep (dict): See `load_sweep`.
+        omit (float, optional): Seconds left out at the start of the
+            goodput series, unless its steady intervals were labelled.
+            Defaults to 1.
+
+    Returns:
+        dict: By metric ("goodput" in bit/s, "latency_p50" and
+            "latency_p99" in seconds, "chaff_overhead" as no-data bytes per
+            data byte), the "mode", "k_min" and "value" arrays of its runs.
+    """
+    metrics = {}
+
+    def add(name, tags, values):
+        valid = np.isfinite(values)
+        metrics[name] = {"mode": tags["mode"][valid], "k_min": tags["k_min"][valid],
+                         "value": values[valid]}
+
+    goodput = sweep.get("goodput")
+    if goodput and goodput["tags"] is not None:
+        rx = padded(goodput["series"], "rx")
+        times = padded(goodput["series"], "time")
+        # Steady intervals when detected, else everything after the omit
+        states = padded(goodput["series"], "state")
+        if not states.shape[1]:
+            states = np.full(rx.shape, np.nan)
+        labelled = (states == STEADY).any(axis=1, keepdims=True)
+        kept = np.where(np.where(labelled, states == STEADY, times >= omit), rx, np.nan)
+        with np.errstate(invalid="ignore"):
+            add("goodput", goodput["tags"], np.nanmean(kept, axis=1)
+                if kept.shape[1] else np.full(len(kept), np.nan))
+    latency = sweep.get("latency")
+    if latency and latency["tags"] is not None:
+        total = padded(latency["series"], "total")
+        measured = np.isfinite(total).any(axis=1) if total.shape[1] else \
+                   np.zeros(len(total), dtype=bool)
+        percentiles = np.full((len(total), 2), np.nan)
+        if measured.any():
+            percentiles[measured] = np.nanpercentile(total[measured], (50, 99), axis=1).T
+        add("latency_p50", latency["tags"], percentiles[:, 0])
+        add("latency_p99", latency["tags"], percentiles[:, 1])
+    insights = sweep.get("throughput")
+    if insights and insights["tags"] is not None:
+        # Each sample holds the bytes since the previous one, the first
+        # covers an unknown period
+        data = sum(np.nansum(padded(insights["series"], name)[:, 1:], axis=1)
+                   for name in ("data_bytes_received", "data_bytes_sent"))
+        chaff = sum(np.nansum(padded(insights["series"], name)[:, 1:], axis=1)
+                    for name in ("other_bytes_received", "other_bytes_sent"))
+        tork = insights["tags"]["mode"] == 0
+        overhead = np.divide(chaff, data, out=np.full(len(data), np.nan),
+                             where=tork & (data > 0))
+        add("chaff_overhead", insights["tags"], overhead)
+    return metrics
+
+def bootstrap_means(groups, resamples=2000, seed=0):
+    """Bootstrap distribution of the mean of several groups at once.
+
+    Args:
+        groups (list): Samples (1D arrays) of each group, at least one value
+            each.
+        resamples (int, optional): Bootstrap resamples. Defaults to 2000.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: Resampled means (groups, resamples).
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.array([len(group) for group in groups])
+    width = counts.max()
+    values = np.zeros((len(groups), width))
+    for row, group in enumerate(groups):
+        values[row, :len(group)] = group
+    # Uniform draws scaled to the size of each group, every column beyond it
+    # masked out
+    draws = (rng.random((len(groups), resamples, width)) * counts[:, None, None]).astype(np.int64)
+    resampled = values[np.arange(len(groups))[:, None, None], draws]
+    mask = np.arange(width)[None, None, :] < counts[:, None, None]
+    return (resampled * mask).sum(axis=2) / counts[:, None]
+
+def interval(distribution, confidence=0.95):
+    """Percentile confidence interval of bootstrap distributions (last axis)."""
+    tail = (1 - confidence) / 2 * 100
+    return np.percentile(distribution, (tail, 100 - tail), axis=-1)
+
+def compare(metrics, resamples=2000, confidence=0.95, seed=0):
+    """Compares the modes by k_min.
+
+    The direct connection does not depend on k_min: when a k_min has no
+    direct run, the direct runs of every k_min are pooled.
+
+    Args:
+        metrics (dict): See `run_metrics`.
+        resamples (int, optional): Bootstrap resamples. Defaults to 2000.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: By k_min and metric, for each mode name its "runs", "mean",
+            "low" and "high" bounds, and the TorK over Tor "slowdown" (goodput
+            of Tor over TorK, latency of TorK over Tor) with its bounds.
+    """
+    keys, groups = [], []
+    for name, runs in metrics.items():
+        for k_min in np.unique(runs["k_min"]):
+            for mode in MODES:
+                selected = (runs["mode"] == mode) & (runs["k_min"] == k_min)
+                if mode == 2 and not selected.any():
+                    selected = runs["mode"] == mode
+                if selected.any():
+                    keys.append((name, int(k_min), mode))
+                    groups.append(runs["value"][selected])
+    if not groups:
+        return {}
+    distribution = bootstrap_means(groups, resamples, seed)
+    low, high = interval(distribution, confidence)
+    index = {key: position for position, key in enumerate(keys)}
+
+    report = {}
+    for (name, k_min, mode), position in index.items():
+        entry = report.setdefault(k_min, {}).setdefault(name, {})
+        entry[MODES[mode]] = {"runs": len(groups[position]),
+                              "mean": float(groups[position].mean()),
+                              "low": float(low[position]), "high": float(high[position])}
+    for k_min, entries in report.items():
+        for name, entry in entries.items():
+            tork, tor = index.get((name, k_min, 0)), index.get((name, k_min, 1))
+            if tork is None or tor is None:
+                continue
+            # Times slower: less goodput, more latency
+            if name == "goodput":
+                numerator, denominator = distribution[tor], distribution[tork]
+            else:
+                numerator, denominator = distribution[tork], distribution[tor]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = numerator / denominator
+                point = groups[tor].mean() / groups[tork].mean() if name == "goodput" \
+                        else groups[tork].mean() / groups[tor].mean()
+            bounds = interval(ratio[np.isfinite(ratio)], confidence) \
+                     if np.isfinite(ratio).any() else (np.nan, np.nan)
+            entry["slowdown"] = {"mean": float(point), "low": float(bounds[0]),
+                                 "high": float(bounds[1])}
+    return dict(sorted(report.items()))
+
+def analyze(paths, resamples=2000, confidence=0.95, seed=0):
+    """Loads a sweep and compares its modes. See `compare`."""
+    return compare(run_metrics(load_sweep(paths)), resamples, confidence, seed)
+
+# Unit and scale of each metric in the printed report
+UNITS = {"goodput": ("kbit/s", 1e-3), "latency_p50": ("ms", 1e3),
+         "latency_p99": ("ms", 1e3), "chaff_overhead": ("x", 1)}
+
+def print_report(report, confidence=0.95):
+    """Prints a comparison, one line per k_min and metric."""
+    print("K\tmetric\t" + "\t".join(MODES.values()) + f"\tslowdown ({confidence:.0%} CI)")
+    for k_min, entries in report.items():
+        for name, entry in entries.items():
+            unit, scale = UNITS[name]
+            cells = []
+            for mode in MODES.values():
+                if mode in entry:
+                    value = entry[mode]
+                    cells.append(f"{value['mean'] * scale:.1f} [{value['low'] * scale:.1f}, "
+                                 f"{value['high'] * scale:.1f}] {unit} (n={value['runs']})")
+                else:
+                    cells.append("-")
+            slowdown = entry.get("slowdown")
+            cells.append(f"{slowdown['mean']:.2f}x [{slowdown['low']:.2f}, "
+                         f"{slowdown['high']:.2f}]" if slowdown else "-")
+            print(f"{k_min}\t{name}\t" + "\t".join(cells))
+
+def main():
+    """Parses the comparison arguments and prints the report of a sweep.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--results", type=str, nargs="+", default=["/results"],
+                        help="Results stores, or directories of results_*.npz")
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.results:
+        paths += sorted(glob.glob(os.path.join(path, "results_*.npz"))) \
+                 if os.path.isdir(path) else [path]
+    report = analyze(paths, args.resamples, args.confidence, args.seed)
+    print_report(report, args.confidence)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output:
+            json.dump({str(k_min): entries for k_min, entries in report.items()},
+                      output, indent=1)
+
+if __name__ == '__main__':
+    main()
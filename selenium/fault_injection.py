@@ -0,0 +1,443 @@
+#!/bin/python3
+"""Fault injection module
+
+Runs fault scenarios against the members of a K-group while they carry a
+workload, through the CLI of the TorK clients:
+
+* `drop on (all|ctrl|data|chaff)` / `drop off all`: the client stops sending
+  the given frame types to the bridge (clients built with DEBUG_TOOLS). The
+  CLI only accepts 3 tokens, a bare `drop off` gets the usage text back;
+* `shut`: the client disconnects from the bridge, for good: nothing
+  reconnects it, so a shut scenario runs a single trial unless a `restart`
+  hook brings the member back (e.g. restarting its Tor and TorK).
+
+A scenario is a list of timed commands, each sent to one member at its
+offset from the start of the trial, on a dedicated connection and a
+monotonic-clock deadline. Meanwhile the data byte counters of every member
+are sampled, so each trial tells:
+
+* the throughput dip of every member (deepest drop of the smoothed rate below
+  its pre-fault baseline, and the bytes missing compared to the baseline);
+* the time to recover, from the end of the fault (last command sent) until
+  the smoothed rate of the member stays above a fraction of its baseline.
+
+Members other than the faulted one show how the rest of the anonymity set is
+held back by a stalled or departed member. Trials run back-to-back, each
+after checking that every member is connected to the bridge, and are stored
+in the results store, one run per trial.
+"""
+import json
+import subprocess
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+from sampler import Sampler
+from results_store import ResultsStore
+from tork_cli import TorkCliClient
+from throughput import ThroughputTest
+from targets import BULK_PORT
+
+# Frame types of the `drop on` command
+DROP_TYPES = ("all", "ctrl", "data", "chaff")
+
+# Turns dropping off, whatever the type
+DROP_OFF = "drop off all"
+
+# Client states (last `stats_bytes` field, see Client.hh) of a member
+# connected to the bridge, from CLIENT_STATE_CONNECTED to CLIENT_STATE_INACTIVE
+CONNECTED_STATES = range(2, 7)
+
+def drop_scenario(member, kind="all", at=10.0, length=5.0):
+    """Scenario dropping the `kind` frames of a member for `length` seconds.
+
+    Returns:
+        list: Timed commands (see `FaultRunner`).
+    """
+    if kind not in DROP_TYPES:
+        raise ValueError(f"Invalid drop type {kind}")
+    return [{"at": at, "member": member, "command": f"drop on {kind}"},
+            {"at": at + length, "member": member, "command": DROP_OFF}]
+
+def check_drop_reply(command, reply):
+    """Checks the reply of a `drop` command.
+
+    Raises:
+        RuntimeError: The member did not acknowledge the command (usage text,
+            or a client built without DEBUG_TOOLS).
+    """
+    expected = "OFF." if command == DROP_OFF else "ON."
+    if not (reply.startswith("Drop ") and reply.strip().endswith(expected)):
+        raise RuntimeError(f"Unexpected reply to {command!r}: {reply.strip()!r}")
+
+def shut_scenario(member, at=10.0):
+    """Scenario disconnecting a member from the bridge.
+
+    Returns:
+        list: Timed commands (see `FaultRunner`).
+    """
+    return [{"at": at, "member": member, "command": "shut"}]
+
+def recovery_metrics(times, rates, fault_start, fault_end, window=1.0, fraction=0.9,
+                     hold=2.0):
+    """Throughput dip and recovery time of every member.
+
+    Args:
+        times (np.ndarray): Sample times in seconds since the trial start.
+        rates (np.ndarray): Data rate of each member (members, samples).
+        fault_start (float): Time the first command was sent.
+        fault_end (float): Time the last command was sent.
+        window (float, optional): Smoothing window in seconds. Defaults to 1.
+        fraction (float, optional): Fraction of the baseline a member must
+            get back to. Defaults to 0.9.
+        hold (float, optional): Seconds the member must stay above it.
+            Defaults to 2.
+
+    Returns:
+        dict: By metric, one value per member: "baseline" (mean rate before
+            the fault), "dip" (relative drop of the smoothed rate, 0 to 1),
+            "deficit" (bytes missing compared to the baseline after the
+            fault started) and "recovery" (seconds after the end of the
+            fault, NaN if the member never recovered).
+    """
+    step = np.median(np.diff(times)) if len(times) > 1 else 1.0
+    width = max(int(round(window / step)), 1)
+    # Trailing moving average, so the end of the series is not pulled down
+    cumulative = np.cumsum(rates, axis=1)
+    lagged = np.zeros_like(cumulative)
+    lagged[:, width:] = cumulative[:, :-width]
+    smooth = (cumulative - lagged) / np.minimum(np.arange(1, rates.shape[1] + 1), width)
+    before = times < fault_start
+    after = times >= fault_start
+    baseline = rates[:, before].mean(axis=1) if before.any() \
+               else np.full(len(rates), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dip = 1 - smooth[:, after].min(axis=1, initial=np.inf) / baseline
+        deficit = (np.clip(baseline[:, None] - rates[:, after], 0, None) * step).sum(axis=1)
+    # Recovered at the first sample after the fault starting `hold` seconds
+    # above the threshold
+    above = smooth >= fraction * baseline[:, None]
+    span = max(int(round(hold / step)), 1)
+    held = np.lib.stride_tricks.sliding_window_view(
+        np.pad(above, ((0, 0), (0, span - 1))), span, axis=1).all(axis=2)
+    # Samples past the end of the series cannot confirm a recovery
+    held[:, len(times) - span + 1:] = False
+    candidates = held & (times >= fault_end)[None, :]
+    recovered = candidates.any(axis=1)
+    first = np.argmax(candidates, axis=1)
+    recovery = np.where(recovered, times[first] - fault_end, np.nan)
+    return {"baseline": baseline, "dip": np.clip(dip, 0, 1), "deficit": deficit,
+            "recovery": recovery}
+
+class FaultRunner:
+    """Injects timed faults into K-group members and measures their effect.
+
+    Args:
+        members (dict): CLI address (host, port) of every member, by name.
+        duration (float, optional): Length of a trial in seconds.
+            Defaults to 40.
+        resolution (float, optional): Sampling interval in seconds.
+            Defaults to 0.1.
+        counter (str, optional): stats_bytes counter of the workload.
+            Defaults to "data_bytes_received".
+        store (str, optional): Path of the results store. Defaults to None.
+        k_min (int, optional): K_min of the group, to tag the results.
+            Defaults to 0.
+        workload (callable, optional): Workload run by this host during each
+            trial (e.g. `ThroughputTest(...).run`), its result is kept with
+            the trial. Defaults to None (the members carry their own load).
+        restart (callable, optional): Called with the name of a shut member
+            after each trial to bring it back. Defaults to None (shut
+            scenarios run a single trial).
+        connect_timeout (float, optional): Seconds the members have to be
+            connected before a trial. Defaults to 60.
+    """
+    def __init__(self, members, duration=40.0, resolution=0.1,
+                 counter="data_bytes_received", store=None, k_min=0, workload=None,
+                 restart=None, connect_timeout=60.0):
+        self.members = dict(members)
+        self.names = list(self.members)
+        self.duration = duration
+        self.resolution = resolution
+        self.counter = counter
+        self.store = ResultsStore(store) if store else None
+        self.k_min = k_min
+        self.workload = workload
+        self.restart = restart
+        self.connect_timeout = connect_timeout
+        self.trials = []
+
+    def wait_connected(self):
+        """Waits until every member is connected to the bridge.
+
+        Raises:
+            RuntimeError: A member was still not connected after
+                `connect_timeout` seconds.
+        """
+        deadline = time.monotonic() + self.connect_timeout
+        for name in self.names:
+            while True:
+                try:
+                    with TorkCliClient(*self.members[name]) as client:
+                        state = client.stats_bytes()["extra"][0]
+                except (OSError, IndexError) as exception:
+                    state = f"unreachable ({exception})"
+                if state in CONNECTED_STATES:
+                    break
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} is not connected to the bridge, "
+                                       f"state: {state}")
+                time.sleep(1)
+
+    def _inject(self, scenario, origin, log, stop):
+        """Sends the commands of a scenario at their offsets from `origin`."""
+        clients = {}
+        try:
+            for event in sorted(scenario, key=lambda event: event["at"]):
+                delay = origin + event["at"] - time.monotonic()
+                if delay > 0 and stop.wait(delay):
+                    break
+                member = event["member"]
+                if member not in clients:
+                    clients[member] = TorkCliClient(*self.members[member])
+                sent = time.monotonic() - origin
+                error = None
+                try:
+                    reply = clients[member].query(event["command"])
+                    if event["command"].startswith("drop"):
+                        check_drop_reply(event["command"], reply)
+                except ConnectionError as exception:
+                    reply = error = f"error: {exception}"
+                except RuntimeError as exception:
+                    error = str(exception)
+                    # Unknown replies may span several lines, resynchronize
+                    clients.pop(member).close()
+                log.append({"at": event["at"], "sent": sent, "member": member,
+                            "command": event["command"], "reply": reply.strip(),
+                            "error": error})
+                print(f"[{sent:7.3f}s] {member}: {event['command']} -> {reply.strip()}")
+        finally:
+            for client in clients.values():
+                client.close()
+
+    def _restore(self, scenario):
+        """Turns dropping off on every member of a scenario, and restarts the
+        shut ones if a `restart` hook was provided.
+
+        Raises:
+            RuntimeError: A member did not turn dropping off, the following
+                trials would run against it still dropping frames.
+        """
+        if self.restart is not None:
+            for member in {event["member"] for event in scenario
+                           if event["command"] == "shut"}:
+                self.restart(member)
+        for member in {event["member"] for event in scenario
+                       if event["command"].startswith("drop")}:
+            try:
+                with TorkCliClient(*self.members[member]) as client:
+                    reply = client.query(DROP_OFF)
+            except OSError as exception:
+                raise RuntimeError(f"Unable to turn dropping off on {member}: "
+                                   f"{exception}") from exception
+            check_drop_reply(DROP_OFF, reply)
+
+    def trial(self, scenario, index=1):
+        """Runs a trial of a scenario.
+
+        Args:
+            scenario (list): Timed commands, dicts with the offset "at" in
+                seconds, the "member" name and the CLI "command".
+            index (int, optional): Trial index. Defaults to 1.
+
+        Returns:
+            dict: Per member metrics (see `recovery_metrics`), the commands
+                sent and the result of the workload.
+
+        Raises:
+            RuntimeError: A `drop` command was not acknowledged.
+        """
+        clients = [TorkCliClient(*self.members[name]) for name in self.names]
+        times, counters = [], []
+
+        def sample():
+            row = []
+            for client in clients:
+                try:
+                    row.append(client.stats_bytes()[self.counter])
+                except ConnectionError:
+                    # The member process died or was restarted
+                    row.append(np.nan)
+            times.append(time.monotonic())
+            counters.append(row)
+
+        log, stop = [], threading.Event()
+        outcome = {}
+        worker = None
+        if self.workload is not None:
+            worker = threading.Thread(target=lambda: outcome.update(result=self.workload()))
+            worker.start()
+        origin = time.monotonic()
+        injector = threading.Thread(target=self._inject, args=(scenario, origin, log, stop))
+        injector.start()
+        try:
+            Sampler(sample, resolution=self.resolution, duration=self.duration).run()
+        finally:
+            stop.set()
+            injector.join()
+            if worker is not None:
+                worker.join()
+            self._restore(scenario)
+            for client in clients:
+                client.close()
+        for event in log:
+            if event["error"] and event["command"].startswith("drop"):
+                raise RuntimeError(f"{event['member']}: {event['error']}")
+
+        times = np.array(times) - origin
+        # Every read returns the bytes since the previous one (TorK resets
+        # its counters), the first read covers an unknown period
+        counters = np.array(counters, dtype=np.float64).T
+        rates = counters[:, 1:] / np.diff(times)[None, :]
+        mid = times[1:]
+        sent = [event["sent"] for event in log]
+        metrics = recovery_metrics(mid, np.nan_to_num(rates), min(sent, default=np.inf),
+                                   max(sent, default=np.inf))
+        result = {"trial": index, "members": self.names, "commands": log,
+                  "workload": outcome.get("result"),
+                  **{name: values.tolist() for name, values in metrics.items()}}
+        for name, dip, recovery in zip(self.names, metrics["dip"], metrics["recovery"]):
+            print(f"Trial {index}\t{name}: dip {dip * 100:.0f}%, "
+                  f"recovery {recovery:.2f} s")
+        if self.store is not None:
+            series = {"time": mid, "rates": rates, "commands_at": np.array(sent),
+                      **metrics}
+            self.store.append(series, "fault", 0, self.k_min, index)
+        self.trials.append(result)
+        return result
+
+    def run(self, scenario, trials=10, gap=10.0):
+        """Runs trials of a scenario back-to-back.
+
+        Args:
+            scenario (list): Timed commands (see `trial`).
+            trials (int, optional): Number of trials. Defaults to 10.
+            gap (float, optional): Seconds between trials, for the group to
+                settle. Defaults to 10.
+
+        Returns:
+            dict: Median and 90th percentile of the dip and of the recovery
+                time of every member over the trials.
+
+        Raises:
+            ValueError: Several trials of a shut scenario without a `restart`
+                hook, the shut member would stay disconnected.
+            RuntimeError: A member was not connected before a trial.
+        """
+        if trials > 1 and self.restart is None \
+                and any(event["command"] == "shut" for event in scenario):
+            raise ValueError("A shut member is not reconnected, run a single trial "
+                             "or provide a restart hook")
+        for index in range(1, trials + 1):
+            self.wait_connected()
+            self.trial(scenario, index)
+            if index < trials:
+                time.sleep(gap)
+        return self.summary()
+
+    def summary(self):
+        """Summarizes the trials run so far.
+
+        Returns:
+            dict: By member, "dip" and "recovery" medians and 90th
+                percentiles, and the share of trials it "recovered" in.
+        """
+        dips = np.array([trial["dip"] for trial in self.trials], dtype=np.float64)
+        recoveries = np.array([trial["recovery"] for trial in self.trials],
+                              dtype=np.float64)
+        summary = {}
+        for column, name in enumerate(self.names):
+            recovered = recoveries[:, column][~np.isnan(recoveries[:, column])]
+            summary[name] = {
+                "dip_p50": float(np.median(dips[:, column])),
+                "dip_p90": float(np.percentile(dips[:, column], 90)),
+                "recovery_p50": float(np.median(recovered)) if len(recovered) else np.nan,
+                "recovery_p90": float(np.percentile(recovered, 90))
+                                if len(recovered) else np.nan,
+                "recovered": len(recovered) / len(self.trials)}
+        return summary
+
+def parse_members(members):
+    """Parses a "name=host[:port],..." list of members.
+
+    Returns:
+        dict: (host, port) by member name.
+    """
+    parsed = {}
+    for member in filter(None, members.split(",")):
+        name, _, address = member.partition("=")
+        host, _, port = address.partition(":")
+        parsed[name] = (host, int(port or 9091))
+    return parsed
+
+def main():
+    """Parses the scenario arguments and runs the trials.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--members", type=str, required=True)
+    parser.add_argument("--target", type=str, required=True)
+    parser.add_argument("--fault", type=str, default="drop",
+                        choices=("drop", "shut"))
+    parser.add_argument("--kind", type=str, default="all", choices=DROP_TYPES)
+    parser.add_argument("--at", type=float, default=10.0)
+    parser.add_argument("--length", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=40.0)
+    parser.add_argument("--resolution", type=float, default=0.1)
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=10.0)
+    parser.add_argument("--k_min", type=int, default=0)
+    parser.add_argument("--results", type=str, default="/results/results_faults.npz")
+    parser.add_argument("--log", type=str, default="/results/faults.jsonl")
+    # Bulk target ("host[:port]") downloaded through the local SOCKS port
+    # during each trial, if this host is a member without its own load
+    parser.add_argument("--bulk", type=str, default=None)
+    parser.add_argument("--socks_port", type=int, default=9050)
+    # Shell command bringing a shut member back between trials, formatted
+    # with its {name} and CLI {host}, e.g. "ssh {host} docker restart tork"
+    parser.add_argument("--restart", type=str, default=None)
+    args = parser.parse_args()
+
+    members = parse_members(args.members)
+    if args.target not in members:
+        parser.error(f"Unknown member {args.target}")
+    scenario = drop_scenario(args.target, args.kind, args.at, args.length) \
+               if args.fault == "drop" else shut_scenario(args.target, args.at)
+    if args.fault == "shut" and args.trials > 1 and not args.restart:
+        parser.error("--fault shut needs --restart to run more than one trial")
+    restart = None
+    if args.restart:
+        restart = lambda name: subprocess.run(
+            args.restart.format(name=name, host=members[name][0]), shell=True,
+            check=True)
+    workload = None
+    if args.bulk:
+        bulk_host, _, bulk_port = args.bulk.partition(":")
+        workload = lambda: ThroughputTest(bulk_host, int(bulk_port or BULK_PORT),
+                                          socks_port=args.socks_port,
+                                          duration=args.duration).run()
+    runner = FaultRunner(members, args.duration, args.resolution, store=args.results,
+                         k_min=args.k_min, workload=workload, restart=restart)
+    try:
+        summary = runner.run(scenario, args.trials, args.gap)
+    finally:
+        with open(args.log, "a", encoding="utf8") as log:
+            for trial in runner.trials:
+                log.write(json.dumps(trial) + "\n")
+    print("member\tdip p50\tdip p90\trecovery p50\trecovery p90\trecovered")
+    for name, values in summary.items():
+        print(f"{name}\t{values['dip_p50'] * 100:.0f}%\t{values['dip_p90'] * 100:.0f}%\t"
+              f"{values['recovery_p50']:.2f} s\t{values['recovery_p90']:.2f} s\t"
+              f"{values['recovered'] * 100:.0f}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/bin/python3
+"""Frame pool pressure module
+
+Every frame queued by a TorK client or bridge (ctrl, data, reception) is
+taken from its FramePool. The pool doubles when it runs dry, up to
+FRAME_POOL_MAX_FRAMES; past that, allocations fail and frames are lost. This
+monitor polls `stats_fp`, its samples carrying their wall-clock time to be
+aligned with the throughput series (`stats_bytes` is not read here: every
+read resets its counters, which belong to the insights sampler), and keeps
+incremental trends of the occupancy:
+
+* allocation rate: exponentially weighted growth of the frames in use
+  (frames/s), with a time constant of `window` seconds;
+* headroom: frames that can still be allocated before the cap;
+* time to exhaustion: headroom over the allocation rate, while growing.
+
+A warning is printed, and marked in the series, when the time to exhaustion
+drops below `horizon` or the occupancy of the cap exceeds `threshold`. It is
+re-armed once the pressure has clearly gone (hysteresis), so a sustained
+episode is reported once.
+"""
+import math
+import time
+from argparse import ArgumentParser
+import numpy as np
+from sampler import Sampler
+from tork_cli import TorkCliClient
+
+# Cap of the frame pool, see FramePool.hh
+FRAME_POOL_MAX_FRAMES = 30000
+
+class FramePoolMonitor:
+    """Samples the frame pool of a TorK client or bridge.
+
+    Args:
+        cli (TorkCliClient): Client of the TorK CLI.
+        max_frames (int, optional): Cap of the pool.
+            Defaults to FRAME_POOL_MAX_FRAMES.
+        resolution (float, optional): Sampling interval in seconds.
+            Defaults to 0.05.
+        window (float, optional): Time constant of the allocation rate in
+            seconds. Defaults to 1.
+        horizon (float, optional): Time to exhaustion (s) raising a warning.
+            Defaults to 5.
+        threshold (float, optional): Occupancy of the cap raising a warning.
+            Defaults to 0.9.
+        name (str, optional): Name of the monitored process in the messages.
+            Defaults to "TorK".
+    """
+    def __init__(self, cli, max_frames=FRAME_POOL_MAX_FRAMES, resolution=0.05,
+                 window=1.0, horizon=5.0, threshold=0.9, name="TorK"):
+        self.cli = cli
+        self.max_frames = max_frames
+        self.resolution = resolution
+        self.window = window
+        self.horizon = horizon
+        self.threshold = threshold
+        self.name = name
+        self.rows = []
+        self.warnings = []
+        self.growths = 0
+        self.exhausted = 0
+        self.rate = 0.0
+        self.warning = False
+        self._previous = None
+        self._start = None
+        self._sampler = None
+
+    def poll(self):
+        """Takes a sample and updates the trends.
+
+        Returns:
+            bool: Whether the pool is under pressure (warning raised).
+        """
+        pool = self.cli.stats_fp()
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+        allocated = pool["allocated"]
+        if self._previous is not None:
+            elapsed = now - self._previous[0]
+            if elapsed > 0:
+                # Exponentially weighted rate, whatever the sampling jitter
+                weight = 1 - math.exp(-elapsed / self.window)
+                self.rate += weight * ((allocated - self._previous[1]) / elapsed - self.rate)
+            if pool["total"] > self._previous[2]:
+                self.growths += 1
+                print(f"{self.name} frame pool grew to {pool['total']} frames")
+        self._previous = (now, allocated, pool["total"])
+
+        headroom = self.max_frames - allocated
+        eta = headroom / self.rate if self.rate > 0 else math.inf
+        occupancy = allocated / self.max_frames
+        if headroom <= 0 and pool["unallocated"] == 0:
+            self.exhausted += 1
+        if not self.warning and (eta < self.horizon or occupancy >= self.threshold):
+            self.warning = True
+            self.warnings.append(now - self._start)
+            message = f"WARNING: {self.name} frame pool {allocated}/{self.max_frames} " \
+                      "frames in use"
+            if math.isfinite(eta):
+                message += f", growing {self.rate:.0f} frames/s, exhausted in {eta:.1f} s"
+            print(message)
+        elif self.warning and eta > 2 * self.horizon \
+                and occupancy < self.threshold * 0.9:
+            self.warning = False
+
+        self.rows.append((now - self._start, time.time(), allocated, pool["unallocated"],
+                          pool["total"], self.rate, headroom, eta, self.warning))
+        return self.warning
+
+    def series(self):
+        """Sampled series.
+
+        Returns:
+            dict: "time" since the first sample and "wall_times", the pool
+                "allocated", "unallocated" and "total" frames, the
+                "alloc_rate" (frames/s), "headroom" (frames) and
+                "exhaustion_eta" (s, inf while not growing) trends, the
+                "warning" state of each sample, plus the "warning_times"
+                markers and the number of "growths" of the pool and of
+                samples with the pool "exhausted".
+        """
+        columns = np.array(self.rows, dtype=np.float64).reshape(-1, 9)
+        series = {"time": columns[:, 0], "wall_times": columns[:, 1]}
+        for index, name in enumerate(("allocated", "unallocated", "total"), 2):
+            series[name] = columns[:, index].astype(np.int64)
+        series.update(alloc_rate=columns[:, 5], headroom=columns[:, 6].astype(np.int64),
+                      exhaustion_eta=columns[:, 7], warning=columns[:, 8].astype(np.int8),
+                      warning_times=np.array(self.warnings, dtype=np.float64),
+                      growths=np.array(self.growths), exhausted=np.array(self.exhausted))
+        return series
+
+    def stop(self):
+        """Stops `run` after the current sample."""
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def run(self, duration=None):
+        """Samples the pool every `resolution`.
+
+        Args:
+            duration (float, optional): Seconds to run. Defaults to None
+                (until `stop` is called).
+
+        Returns:
+            dict: See `series`.
+        """
+        self._sampler = Sampler(self.poll, resolution=self.resolution, duration=duration)
+        self._sampler.run()
+        return self.series()
+
+def main():
+    """Parses the monitor arguments and samples a TorK frame pool.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9091)
+    parser.add_argument("--resolution", type=float, default=0.05)
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument("--horizon", type=float, default=5.0)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--max_frames", type=int, default=FRAME_POOL_MAX_FRAMES)
+    args = parser.parse_args()
+
+    with TorkCliClient(args.host, args.port) as cli:
+        monitor = FramePoolMonitor(cli, args.max_frames, args.resolution,
+                                   horizon=args.horizon, threshold=args.threshold)
+        try:
+            monitor.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+    series = monitor.series()
+    if len(series["time"]):
+        print(f"Peak {series['allocated'].max()}/{args.max_frames} frames in use, "
+              f"pool grew {monitor.growths} times, {len(monitor.warnings)} warnings, "
+              f"{monitor.exhausted} samples exhausted")
+
+if __name__ == '__main__':
+    main()
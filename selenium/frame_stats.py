@@ -0,0 +1,232 @@
+#!/bin/python3
+"""Per-client frame accounting module
+
+Polls the bridge CLI `stats_frames` (depth of the ctrl, data and reception
+queues and reception mark of every client) and `stats_clients_detail` (state
+and K_min of every client) in one pipelined round trip, and keeps the series
+of every client in fixed-size ring buffers, so memory stays bounded however
+long the bridge is observed.
+
+Queue depths are turned into per-second growth rates with a vectorized diff
+over every client at once. Synchronized delivery pops one reception frame of
+every client of a K-group at the same time, so the differences between the
+reception queues of a group come from their arrival rates: a client whose
+reception queue stays below the group's median is a straggler, holding back
+the delivery of the whole anonymity set.
+"""
+import time
+import warnings
+from argparse import ArgumentParser
+import numpy as np
+from sampler import Sampler
+from tork_cli import (TorkCliClient, BRIDGE_CLI_PORT, parse_stats_frames,
+                      parse_clients_detail)
+
+# Queue depths of a client, in the order of `stats_frames`
+QUEUES = ("ctrl", "data", "reception")
+
+class FrameStatsCollector:
+    """Collects per-client frame statistics from the bridge CLI.
+
+    Args:
+        cli (TorkCliClient): Client of the bridge CLI.
+        capacity (int, optional): Samples kept in the ring buffers.
+            Defaults to 3600.
+        max_clients (int, optional): Clients tracked at the same time.
+            Defaults to 64.
+        interval (float, optional): Polling interval in seconds.
+            Defaults to 1.
+        window (int, optional): Samples considered to flag stragglers.
+            Defaults to 10.
+        min_backlog (float, optional): Mean reception frames below the
+            group's median for a client to be flagged. Defaults to 5.
+    """
+    def __init__(self, cli, capacity=3600, max_clients=64, interval=1.0, window=10,
+                 min_backlog=5.0):
+        self.cli = cli
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self.interval = interval
+        self.window = window
+        self.min_backlog = min_backlog
+        # Ring buffers, one row per sample and one column per client slot
+        self.times = np.full(capacity, np.nan)
+        self.fds = np.full((capacity, max_clients), -1, dtype=np.int32)
+        self.k_min = np.full((capacity, max_clients), -1, dtype=np.int32)
+        self.depths = np.full((capacity, max_clients, len(QUEUES)), np.nan)
+        self.rates = np.full((capacity, max_clients, len(QUEUES)), np.nan)
+        self.marks = np.zeros((capacity, max_clients), dtype=np.int8)
+        self.count = 0
+        self.flagged = set()
+        self._columns = {}
+        self._previous = np.full((max_clients, len(QUEUES)), np.nan)
+        self._previous_time = None
+        self._start = None
+        self._sampler = None
+
+    def _assign(self, fds):
+        """Maps client fds to columns, releasing those of gone clients.
+
+        Returns:
+            np.ndarray: Column of each fd (-1 if no column is free).
+        """
+        for fd in set(self._columns) - set(fds):
+            # The fd may be reused by a new client, whose queues are unrelated
+            self._previous[self._columns.pop(fd)] = np.nan
+        free = sorted(set(range(self.max_clients)) - set(self._columns.values()))
+        columns = []
+        for fd in fds:
+            if fd not in self._columns and free:
+                self._columns[fd] = free.pop(0)
+            columns.append(self._columns.get(fd, -1))
+        return np.array(columns, dtype=np.int64)
+
+    def poll(self):
+        """Takes a sample of every client.
+
+        Returns:
+            int: Number of clients sampled.
+        """
+        frames_reply, detail_reply = self.cli.execute("stats_frames",
+                                                      "stats_clients_detail")
+        frames = np.array(parse_stats_frames(frames_reply), dtype=np.int64).reshape(-1, 6)
+        details = parse_clients_detail(detail_reply)
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+        columns = self._assign(frames[:, 1].tolist())
+        tracked = columns >= 0
+        columns, frames = columns[tracked], frames[tracked]
+
+        current = np.full((self.max_clients, len(QUEUES)), np.nan)
+        current[columns] = frames[:, 2:5]
+        row = self.count % self.capacity
+        self.times[row] = now - self._start
+        elapsed = self.times[row] - self._previous_time \
+                  if self._previous_time is not None else np.nan
+        self.rates[row] = (current - self._previous) / elapsed
+        self.depths[row] = current
+        self.fds[row] = -1
+        self.fds[row, columns] = frames[:, 1]
+        self.k_min[row] = -1
+        self.k_min[row, columns] = [details.get(fd, {}).get("k_min", -1)
+                                    for fd in frames[:, 1]]
+        self.marks[row] = 0
+        self.marks[row, columns] = frames[:, 5]
+        self._previous = current
+        self._previous_time = self.times[row]
+        self.count += 1
+        return len(columns)
+
+    def _order(self, last=None):
+        """Row indices of the buffered samples, oldest first."""
+        size = min(self.count, self.capacity)
+        if last is not None:
+            size = min(size, last)
+        return (np.arange(self.count - size, self.count)) % self.capacity
+
+    def stragglers(self):
+        """Flags the clients lagging behind their K-group over the last
+        `window` samples.
+
+        Returns:
+            list: One dict per straggler with its "fd", "k_min", mean reception
+                "backlog" below the group median (frames) and reception rate
+                "lag" behind the group median (frames/s).
+        """
+        rows = self._order(self.window)
+        if not len(rows):
+            return []
+        last = rows[-1]
+        reception = self.depths[rows, :, 2]
+        rates = self.rates[rows, :, 2]
+        k_min = self.k_min[last]
+        stragglers = []
+        for group in np.unique(k_min[(self.fds[last] >= 0) & (k_min >= 0)]):
+            members = np.flatnonzero((k_min == group) & (self.fds[last] >= 0))
+            if len(members) < 2:
+                continue
+            with warnings.catch_warnings():
+                # Rates are NaN on the first sample of a client
+                warnings.simplefilter("ignore", RuntimeWarning)
+                backlog = np.nanmean(np.nanmedian(reception[:, members], axis=1)[:, None]
+                                     - reception[:, members], axis=0)
+                lag = np.nanmean(np.nanmedian(rates[:, members], axis=1)[:, None]
+                                 - rates[:, members], axis=0)
+            for member, gap, behind in zip(members, backlog, lag):
+                if gap >= self.min_backlog:
+                    stragglers.append({"fd": int(self.fds[last, member]),
+                                       "k_min": int(group),
+                                       "backlog": float(gap), "lag": float(behind)})
+        return stragglers
+
+    def tick(self):
+        """Polls the bridge and reports the clients that became stragglers."""
+        self.poll()
+        stragglers = self.stragglers()
+        flagged = {straggler["fd"] for straggler in stragglers}
+        for straggler in stragglers:
+            if straggler["fd"] not in self.flagged:
+                print(f"Straggler: client {straggler['fd']} (K {straggler['k_min']}) "
+                      f"{straggler['backlog']:.1f} frames behind its group")
+        self.flagged = flagged
+        return stragglers
+
+    def series(self):
+        """Buffered series, oldest sample first.
+
+        Returns:
+            dict: "time" (T,) since the first sample, client "fd" and "k_min" (T, clients), the depth
+                ("<queue>_depth") and growth rate ("<queue>_rate") of every
+                queue and the "reception_mark" (T, clients). Absent clients
+                have fd -1 and NaN values.
+        """
+        rows = self._order()
+        series = {"time": self.times[rows], "fd": self.fds[rows],
+                  "k_min": self.k_min[rows], "reception_mark": self.marks[rows]}
+        for index, queue in enumerate(QUEUES):
+            series[f"{queue}_depth"] = self.depths[rows, :, index]
+            series[f"{queue}_rate"] = self.rates[rows, :, index]
+        return series
+
+    def stop(self):
+        """Stops `run` after the current sample."""
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def run(self, duration=None):
+        """Polls the bridge every `interval`.
+
+        Args:
+            duration (float, optional): Seconds to run. Defaults to None
+                (until `stop` is called).
+
+        Returns:
+            dict: See `series`.
+        """
+        self._sampler = Sampler(self.tick, resolution=self.interval, duration=duration)
+        self._sampler.run()
+        return self.series()
+
+def main():
+    """Parses the collector arguments and polls the bridge.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="bridge")
+    parser.add_argument("--port", type=int, default=BRIDGE_CLI_PORT)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument("--min_backlog", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with TorkCliClient(args.host, args.port) as cli:
+        collector = FrameStatsCollector(cli, interval=args.interval, window=args.window,
+                                        min_backlog=args.min_backlog)
+        try:
+            collector.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
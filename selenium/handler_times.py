@@ -0,0 +1,194 @@
+#!/bin/python3
+"""Controller handler time module
+
+With TIME_STATS enabled, the bridge controller times the sending of every
+ctrl, data and chaff frame, in microseconds. Only the first TIME_STATS
+samples are kept until the `json` (or `stats_time`) CLI command hands them
+out and clears them, so this drainer polls `json` often enough never to hit
+the cap: when a reply comes back full, samples were dropped and the polling
+interval is halved.
+
+The samples are merged into log-bucketed histograms per frame type, for the
+whole run and for every second, so the p50/p99/max handler time per second
+can be aligned with the throughput series.
+"""
+import json
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+from histogram import LogHistogram
+from tork_cli import TorkCliClient, BRIDGE_CLI_PORT
+
+# Frame types, by key of the `json` stats_time object
+FRAME_TYPES = {"ctrl": "ctrlTimes", "data": "dataTimes", "chaff": "chaffTimes"}
+
+# Statistics of each frame type reported per second
+SECOND_STATS = ("count", "p50", "p99", "max")
+
+class HandlerTimesDrainer:
+    """Drains the handler times of the bridge controller.
+
+    Args:
+        cli (TorkCliClient): Client of the bridge CLI.
+        cap (int, optional): TIME_STATS of the bridge build, the number of
+            samples kept per frame type. Defaults to None (unknown, the
+            polling interval is not adapted).
+        poll (float, optional): Initial polling interval in seconds.
+            Defaults to 0.1.
+        min_poll (float, optional): Shortest polling interval.
+            Defaults to 0.01.
+        resolution (float, optional): Length of the reported periods in
+            seconds. Defaults to 1.0.
+    """
+    def __init__(self, cli, cap=None, poll=0.1, min_poll=0.01, resolution=1.0):
+        self.cli = cli
+        self.cap = cap
+        self.poll_interval = poll
+        self.max_poll = poll
+        self.min_poll = min_poll
+        self.resolution = resolution
+        self.histograms = {name: LogHistogram() for name in FRAME_TYPES}
+        self._period = {name: LogHistogram() for name in FRAME_TYPES}
+        self._rows = []
+        self.saturated = 0
+        self.polls = 0
+        self._stop = threading.Event()
+        self._start = None
+        self._period_index = 0
+        self._period_saturated = 0
+
+    def drain(self):
+        """Fetches and clears the samples of the bridge.
+
+        Returns:
+            dict: Samples in seconds by frame type, None if the bridge was
+                not built with TIME_STATS.
+        """
+        reply = json.loads(self.cli.query("json"))
+        if "stats_time" not in reply:
+            return None
+        samples = {name: np.asarray(reply["stats_time"][key], dtype=np.float64) * 1e-6
+                   for name, key in FRAME_TYPES.items()}
+        self.polls += 1
+        if self.cap and any(len(values) >= self.cap for values in samples.values()):
+            # The cap was reached, samples were dropped: poll faster
+            self.saturated += 1
+            self._period_saturated += 1
+            self.poll_interval = max(self.min_poll, self.poll_interval / 2)
+        elif self.cap and all(len(values) < self.cap / 4 for values in samples.values()):
+            self.poll_interval = min(self.max_poll, self.poll_interval * 1.25)
+        return samples
+
+    def _close_period(self):
+        """Summarizes the histograms of the current period and resets them."""
+        row = [self._period_index * self.resolution, self._period_saturated]
+        for histogram in self._period.values():
+            summary = histogram.summary((50, 99))
+            row += [summary[stat] for stat in SECOND_STATS]
+            histogram.reset()
+        self._rows.append(row)
+        self._period_index += 1
+        self._period_saturated = 0
+
+    def step(self):
+        """Drains the bridge once and accounts the samples.
+
+        Returns:
+            bool: False if the bridge was not built with TIME_STATS.
+        """
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+        while now - self._start >= (self._period_index + 1) * self.resolution:
+            self._close_period()
+        samples = self.drain()
+        if samples is None:
+            return False
+        for name, values in samples.items():
+            self.histograms[name].record_many(values)
+            self._period[name].record_many(values)
+        return True
+
+    def stop(self):
+        """Stops `run` after the current poll."""
+        self._stop.set()
+
+    def run(self, duration=None):
+        """Drains the bridge until `duration` elapsed or `stop` is called.
+
+        Args:
+            duration (float, optional): Seconds to run. Defaults to None.
+
+        Returns:
+            dict: See `series`.
+        """
+        deadline = time.monotonic() + duration if duration is not None else None
+        while not self._stop.is_set():
+            if not self.step():
+                print("The bridge was not built with TIME_STATS")
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._stop.wait(self.poll_interval)
+        self._close_period()
+        return self.series()
+
+    def series(self):
+        """Per period statistics, in seconds.
+
+        Returns:
+            dict: "time" (start of each period), "saturated" (polls that hit
+                the cap) and, by frame type, "<type>_count", "<type>_p50",
+                "<type>_p99" and "<type>_max" (NaN when no frame was sent).
+        """
+        rows = np.array(self._rows, dtype=np.float64).reshape(-1, 2 + 3 * 4)
+        series = {"time": rows[:, 0], "saturated": rows[:, 1]}
+        column = 2
+        for name in FRAME_TYPES:
+            for stat in SECOND_STATS:
+                series[f"{name}_{stat}"] = rows[:, column]
+                column += 1
+        return series
+
+    def report(self):
+        """Summarizes the whole run.
+
+        Returns:
+            dict: Summary of the handler times of every frame type (see
+                `LogHistogram.summary`), with the number of polls and of
+                saturated polls.
+        """
+        report = {name: histogram.summary()
+                  for name, histogram in self.histograms.items()}
+        report["polls"] = self.polls
+        report["saturated"] = self.saturated
+        return report
+
+def main():
+    """Parses the drainer arguments and drains the bridge.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="bridge")
+    parser.add_argument("--port", type=int, default=BRIDGE_CLI_PORT)
+    parser.add_argument("--cap", type=int, default=None)
+    parser.add_argument("--poll", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=None)
+    args = parser.parse_args()
+
+    with TorkCliClient(args.host, args.port) as cli:
+        drainer = HandlerTimesDrainer(cli, cap=args.cap, poll=args.poll)
+        try:
+            drainer.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+    report = drainer.report()
+    print("type\tcount\tp50\tp99\tp99.9\tmax (us)")
+    for name in FRAME_TYPES:
+        summary = report[name]
+        print(f"{name}\t{summary['count']}\t" + "\t".join(
+            f"{summary[key] * 1e6:.1f}" for key in ("p50", "p99", "p99.9", "max")))
+    print(f"polls\t{report['polls']}\tsaturated\t{report['saturated']}")
+
+if __name__ == '__main__':
+    main()
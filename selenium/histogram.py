@@ -0,0 +1,128 @@
+"""Log-bucketed histogram module
+
+HDR-style histogram of positive values (e.g. latencies in seconds): buckets
+grow geometrically so every recorded value is kept within a fixed relative
+error, in constant memory, whatever the number of samples. Histograms with
+the same layout can be merged, e.g. to aggregate per-second histograms.
+"""
+import numpy as np
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+class LogHistogram:
+    """Histogram with logarithmic buckets.
+
+    Args:
+        lowest (float, optional): Smallest distinguishable value, smaller
+            values are counted in the first bucket. Defaults to 1e-6.
+        highest (float, optional): Largest trackable value, larger values
+            are counted in the last bucket. Defaults to 3600.
+        precision (float, optional): Maximum relative error of a reported
+            value. Defaults to 0.01 (1%).
+    """
+    def __init__(self, lowest=1e-6, highest=3600.0, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._log_base = np.log1p(2 * precision)
+        self.counts = np.zeros(self._index(highest) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _index(self, values):
+        """Bucket index of one or several values."""
+        values = np.maximum(np.asarray(values, dtype=np.float64), self.lowest)
+        index = np.floor(np.log(values / self.lowest) / self._log_base).astype(np.int64)
+        if np.ndim(index) == 0:
+            return int(index)
+        return index
+
+    def _value(self, index):
+        """Representative (middle) value of one or several buckets."""
+        return self.lowest * np.exp((np.asarray(index) + 0.5) * self._log_base)
+
+    def compatible(self, other):
+        """Whether another histogram has the same bucket layout."""
+        return (self.lowest, self.highest, self.precision) == \
+               (other.lowest, other.highest, other.precision)
+
+    def record(self, value):
+        """Records a single value."""
+        self.record_many((value,))
+
+    def record_many(self, values):
+        """Records several values at once.
+
+        Args:
+            values (array-like): Values to record.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        index = np.minimum(self._index(values), len(self.counts) - 1)
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        self.count += values.size
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """Adds the samples of another histogram with the same layout."""
+        if not self.compatible(other):
+            raise ValueError("Histograms with different layouts")
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        """Clears every sample."""
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def percentiles(self, percentiles=DEFAULT_PERCENTILES):
+        """Computes percentiles.
+
+        Args:
+            percentiles (tuple, optional): Percentiles in [0, 100].
+                Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+            dict: Value of each percentile, NaN if the histogram is empty.
+        """
+        if not self.count:
+            return {percentile: float("nan") for percentile in percentiles}
+        cumulative = np.cumsum(self.counts)
+        ranks = np.ceil(np.asarray(percentiles) / 100 * self.count).clip(1, self.count)
+        values = self._value(np.searchsorted(cumulative, ranks))
+        # Values are clamped to the exact extremes seen
+        values = np.clip(values, self.min, self.max)
+        return dict(zip(percentiles, values.tolist()))
+
+    def percentile(self, percentile):
+        """Computes a single percentile."""
+        return self.percentiles((percentile,))[percentile]
+
+    def mean(self):
+        """Mean of the recorded values."""
+        return self.total / self.count if self.count else float("nan")
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Summarizes the histogram.
+
+        Returns:
+            dict: count, mean, min, max and the requested percentiles
+                (as "p50", "p99.9", ...).
+        """
+        summary = {"count": self.count, "mean": self.mean(),
+                   "min": self.min if self.count else float("nan"),
+                   "max": self.max if self.count else float("nan")}
+        for percentile, value in self.percentiles(percentiles).items():
+            summary[f"p{percentile:g}"] = value
+        return summary
@@ -0,0 +1,217 @@
+#!/bin/python3
+"""Latency probe module
+
+Measures the latency of HTTP(S) requests through the SOCKS port, split in
+phases:
+
+* connect: TCP connection to the SOCKS port.
+* socks: SOCKS5 handshake, which includes Tor attaching the stream to a
+  circuit and connecting to the destination.
+* tls: TLS handshake with the destination (https only).
+* ttfb: time from sending a HEAD request to its first response byte.
+* total: sum of the phases of the probe.
+
+Probes run at a fixed rate on several workers and the phases are recorded in
+log-bucketed histograms, so thousands of probes expose the tail latency.
+With connection reuse only the first probe of a connection pays the setup
+phases, the following ones measure the request round trip alone.
+"""
+import ssl
+import threading
+import time
+from argparse import ArgumentParser
+from urllib.parse import urlsplit
+import numpy as np
+from histogram import LogHistogram
+from sampler import Sampler
+import socks5
+
+PHASES = ("connect", "socks", "tls", "ttfb", "total")
+
+class LatencyProbe:
+    """Runs latency probes against a site.
+
+    Args:
+        url (str): Probed URL (http or https).
+        socks_port (int, optional): SOCKS port. Defaults to None (direct).
+        socks_host (str, optional): SOCKS host. Defaults to "127.0.0.1".
+        rate (float, optional): Probes per second. Defaults to 10.
+        count (int, optional): Number of probes, about 10 s at the default
+            rate. Defaults to 100.
+        concurrency (int, optional): Workers sharing the rate. Defaults to 4.
+        reuse (bool, optional): Whether each worker reuses its connection.
+            Defaults to False.
+        timeout (int, optional): Probe timeout in seconds. Defaults to 30.
+    """
+    def __init__(self, url, socks_port=None, socks_host="127.0.0.1", rate=10.0,
+                 count=100, concurrency=4, reuse=False, timeout=30):
+        self.url = urlsplit(url)
+        self.proxy = (socks_host, socks_port) if socks_port else None
+        self.rate = rate
+        self.count = count
+        self.concurrency = max(1, min(concurrency, count))
+        self.reuse = reuse
+        self.timeout = timeout
+        self.histograms = {phase: LogHistogram() for phase in PHASES}
+        # Raw samples of each probe, NaN for phases not measured
+        self.samples = {phase: [] for phase in PHASES}
+        self.wall_times = []
+        self.errors = 0
+        # Probes skipped because the previous one of the worker overran
+        self.missed = 0
+        self._lock = threading.Lock()
+        # The site is probed for latency only, certificates are not verified
+        self._ssl = ssl.create_default_context()
+        self._ssl.check_hostname = False
+        self._ssl.verify_mode = ssl.CERT_NONE
+
+    def _open(self, phases):
+        """Opens a connection to the site, timing its setup phases."""
+        timings = socks5.Timings()
+        port = self.url.port or (443 if self.url.scheme == "https" else 80)
+        sock = socks5.create_connection(self.url.hostname, port, proxy=self.proxy,
+                                        timeout=self.timeout, timings=timings)
+        phases["connect"] = timings.connect
+        if self.proxy:
+            phases["socks"] = timings.handshake
+        if self.url.scheme == "https":
+            start = time.perf_counter()
+            try:
+                sock = self._ssl.wrap_socket(sock, server_hostname=self.url.hostname)
+            except BaseException:
+                sock.close()
+                raise
+            phases["tls"] = time.perf_counter() - start
+        return sock
+
+    def _request(self, sock, phases):
+        """Sends a HEAD request and reads its response headers.
+
+        Returns:
+            bool: Whether the connection can be reused.
+        """
+        request = (f"HEAD {self.url.path or '/'} HTTP/1.1\r\nHost: {self.url.netloc}\r\n"
+                   "Connection: keep-alive\r\n\r\n").encode()
+        start = time.perf_counter()
+        sock.sendall(request)
+        response = sock.recv(65536)
+        phases["ttfb"] = time.perf_counter() - start
+        while response and b"\r\n\r\n" not in response:
+            part = sock.recv(65536)
+            if not part:
+                break
+            response += part
+        if not response:
+            raise ConnectionError("Connection closed by the site")
+        headers = response.decode(errors="replace").lower()
+        return headers.startswith("http/1.1") and "connection: close" not in headers
+
+    def _record(self, phases):
+        """Records the phases of a probe."""
+        phases["total"] = sum(phases.values())
+        with self._lock:
+            self.wall_times.append(time.time())
+            for phase in PHASES:
+                value = phases.get(phase)
+                self.samples[phase].append(np.nan if value is None else value)
+                if value is not None:
+                    self.histograms[phase].record(value)
+
+    def _worker(self, probes):
+        """Runs `probes` probes at this worker's share of the rate."""
+        state = {"sock": None}
+
+        def probe():
+            phases = {}
+            try:
+                if state["sock"] is None:
+                    state["sock"] = self._open(phases)
+                reusable = self._request(state["sock"], phases)
+                self._record(phases)
+                if not (self.reuse and reusable):
+                    state["sock"].close()
+                    state["sock"] = None
+            except (OSError, socks5.SocksError) as exception:
+                with self._lock:
+                    self.errors += 1
+                print(f"Latency probe error: {exception!r}")
+                if state["sock"] is not None:
+                    state["sock"].close()
+                    state["sock"] = None
+
+        sampler = Sampler(probe, resolution=self.concurrency / self.rate,
+                          samples=probes)
+        sampler.run()
+        if state["sock"] is not None:
+            state["sock"].close()
+        with self._lock:
+            self.missed += len(sampler.missed)
+
+    def run(self):
+        """Runs every probe.
+
+        Returns:
+            dict: See `report`.
+        """
+        share, extra = divmod(self.count, self.concurrency)
+        workers = [threading.Thread(target=self._worker,
+                                    args=(share + (1 if worker < extra else 0),))
+                   for worker in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+            # Spread the workers over the probe period
+            time.sleep(1 / self.rate)
+        for worker in workers:
+            worker.join()
+        return self.report()
+
+    def report(self):
+        """Summarizes the probes.
+
+        Returns:
+            dict: Summary (count, mean, min, max, p50, p90, p99, p99.9) of
+                each phase, the number of failed probes as "errors" and of
+                skipped probes as "missed".
+        """
+        report = {phase: histogram.summary()
+                  for phase, histogram in self.histograms.items()}
+        report["errors"] = self.errors
+        report["missed"] = self.missed
+        return report
+
+    def series(self):
+        """Raw samples of each phase (NaN when not measured), with the wall
+        time of each probe."""
+        series = {phase: np.array(values) for phase, values in self.samples.items()}
+        series["wall_times"] = np.array(self.wall_times)
+        return series
+
+def print_report(report):
+    """Prints a latency probe report, in milliseconds."""
+    print("phase\tcount\tp50\tp90\tp99\tp99.9\tmax")
+    for phase in PHASES:
+        summary = report[phase]
+        print(f"{phase}\t{summary['count']}\t" + "\t".join(
+            f"{summary[key] * 1000:.1f}" for key in ("p50", "p90", "p99", "p99.9", "max")))
+    print(f"errors\t{report['errors']}")
+    print(f"missed\t{report['missed']}")
+
+def main():
+    """Parses the latency probe arguments and runs the probes.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--url", type=str, default="https://146.193.41.153/")
+    parser.add_argument("--socks_port", type=int, default=9050)
+    parser.add_argument("--rate", type=float, default=10)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--reuse", action="store_true")
+    args = parser.parse_args()
+
+    probe = LatencyProbe(args.url, socks_port=args.socks_port or None,
+                         rate=args.rate, count=args.count,
+                         concurrency=args.concurrency, reuse=args.reuse)
+    print_report(probe.run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+#!/bin/python3
+"""Multi-client load generator module
+
+Runs N synthetic clients concurrently from a single process. Each client
+opens its streams through its own SOCKS port (i.e. its own TorK/Tor
+instance) and runs one workload of the mix:
+
+* bulk: repeated HTTP downloads of a large resource.
+* rr: request/response, small HTTP requests over a keep-alive connection.
+* stream: constant-bitrate consumption of an HTTP stream.
+
+The report gives per-client and aggregate goodput and latency percentiles,
+to find where the bridge saturates as K grows.
+"""
+import asyncio
+import time
+from argparse import ArgumentParser
+from urllib.parse import urlsplit
+import numpy as np
+from results_store import ResultsStore
+import socks5
+
+WORKLOADS = ("bulk", "rr", "stream")
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+def assign_workloads(clients, mix):
+    """Splits the clients among workloads proportionally to the mix.
+
+    Args:
+        clients (int): Number of clients.
+        mix (dict): Weight of each workload, e.g. {"bulk": 2, "rr": 1}.
+
+    Returns:
+        list: Workload of each client.
+    """
+    for workload in mix:
+        if workload not in WORKLOADS:
+            raise ValueError(f"Unknown workload {workload}")
+    total = sum(mix.values())
+    shares = {workload: clients * weight / total for workload, weight in mix.items()}
+    counts = {workload: int(share) for workload, share in shares.items()}
+    # Largest remainder first
+    for workload in sorted(shares, key=lambda w: shares[w] - counts[w],
+                           reverse=True)[:clients - sum(counts.values())]:
+        counts[workload] += 1
+    assigned = []
+    for workload in mix:
+        assigned += [workload] * counts[workload]
+    return assigned
+
+def parse_mix(text):
+    """Parses a workload mix such as "bulk=2,rr=1,stream=1"."""
+    mix = {}
+    for item in text.split(","):
+        workload, _, weight = item.partition("=")
+        mix[workload.strip()] = float(weight) if weight else 1.0
+    return mix
+
+class ClientStats:
+    """Measurements of a synthetic client.
+
+    Args:
+        client (int): Client index.
+        workload (str): Workload name.
+        socks_port (int): SOCKS port used by the client, None when direct.
+    """
+    def __init__(self, client, workload, socks_port):
+        self.client = client
+        self.workload = workload
+        self.socks_port = socks_port
+        self.start = time.monotonic()
+        self.bytes = 0
+        # Bytes received in each second since the start
+        self.per_second = {}
+        # Request latency (bulk, rr) or chunk lateness (stream), in seconds
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+
+    def received(self, size):
+        """Accounts received payload bytes."""
+        self.bytes += size
+        second = int(time.monotonic() - self.start)
+        self.per_second[second] = self.per_second.get(second, 0) + size
+
+    def series(self, duration):
+        """Builds the per-second goodput and latency arrays of the client."""
+        goodput = np.zeros(int(np.ceil(duration)), dtype=np.int64)
+        for second, size in self.per_second.items():
+            if second < len(goodput):
+                goodput[second] = size
+        return {"bytes_per_second": goodput,
+                "latencies": np.array(self.latencies, dtype=np.float64)}
+
+async def _http_request(reader, writer, host, path, on_data=None):
+    """Sends a GET request and reads the response body.
+
+    The body is read up to its Content-Length, or until the connection is
+    closed when the server does not send one.
+
+    Args:
+        reader (StreamReader): Stream to the server.
+        writer (StreamWriter): Stream to the server.
+        host (str): Value of the Host header.
+        path (str): Requested path.
+        on_data (callable, optional): Called with the size of each part of
+            the body received.
+
+    Returns:
+        (int, bool): Body size and whether the connection can be reused.
+    """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+                 "Connection: keep-alive\r\n\r\n".encode())
+    headers = (await reader.readuntil(b"\r\n\r\n")).decode(errors="replace")
+    status = headers.split(" ", 2)
+    if len(status) < 2 or not status[1].startswith("2"):
+        raise ConnectionError(f"HTTP error: {headers.splitlines()[0]}")
+    length = None
+    keep_alive = status[0] == "HTTP/1.1"
+    for line in headers.split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "connection":
+            keep_alive = value.strip().lower() == "keep-alive"
+
+    size = 0
+    while length is None or size < length:
+        part = await reader.read(65536 if length is None else min(65536, length - size))
+        if not part:
+            break
+        size += len(part)
+        if on_data:
+            on_data(len(part))
+    return size, keep_alive and length is not None
+
+class LoadGenerator:
+    """Runs concurrent synthetic clients.
+
+    Args:
+        clients (int): Number of clients.
+        targets (dict): URL of each workload, by workload name.
+        mix (dict, optional): Weight of each workload. Defaults to all the
+            workloads with a target, evenly.
+        socks_ports (list, optional): SOCKS ports, assigned to the clients in
+            turn. Defaults to None (direct connections).
+        socks_host (str, optional): Host of the SOCKS ports.
+            Defaults to "127.0.0.1".
+        duration (int, optional): Test duration in seconds. Defaults to 60.
+        rate (float, optional): Requests per second of each rr client.
+            Defaults to 1.
+        bitrate (int, optional): Bitrate of stream clients in bit/s.
+            Defaults to 2500000.
+    """
+    def __init__(self, clients, targets, mix=None, socks_ports=None,
+                 socks_host="127.0.0.1", duration=60, rate=1.0, bitrate=2500000):
+        self.targets = {workload: urlsplit(url) for workload, url in targets.items()}
+        mix = mix or {workload: 1 for workload in targets}
+        for workload in mix:
+            if workload not in self.targets:
+                raise ValueError(f"No target for workload {workload}")
+        self.socks_ports = socks_ports
+        self.socks_host = socks_host
+        self.duration = duration
+        self.rate = rate
+        self.bitrate = bitrate
+        self.stats = [ClientStats(client, workload,
+                                  socks_ports[client % len(socks_ports)] if socks_ports else None)
+                      for client, workload in enumerate(assign_workloads(clients, mix))]
+
+    async def _connect(self, stats):
+        """Opens a stream of a client to the target of its workload."""
+        target = self.targets[stats.workload]
+        proxy = (self.socks_host, stats.socks_port) if stats.socks_port else None
+        return await socks5.open_connection(target.hostname, target.port or 80,
+                                            proxy=proxy)
+
+    def _path(self, workload):
+        target = self.targets[workload]
+        return (target.path or "/") + (f"?{target.query}" if target.query else "")
+
+    async def _bulk(self, stats):
+        """Downloads the bulk target back to back."""
+        target = self.targets["bulk"]
+        while True:
+            start = time.perf_counter()
+            reader, writer = await self._connect(stats)
+            try:
+                await _http_request(reader, writer, target.netloc,
+                                    self._path("bulk"), stats.received)
+            finally:
+                writer.close()
+            stats.requests += 1
+            stats.latencies.append(time.perf_counter() - start)
+
+    async def _rr(self, stats):
+        """Sends small requests at a fixed rate over a keep-alive connection."""
+        target = self.targets["rr"]
+        period = 1 / self.rate
+        reader = writer = None
+        next_request = time.monotonic()
+        try:
+            while True:
+                if writer is None:
+                    reader, writer = await self._connect(stats)
+                start = time.perf_counter()
+                _, reusable = await _http_request(reader, writer, target.netloc,
+                                                  self._path("rr"), stats.received)
+                stats.requests += 1
+                stats.latencies.append(time.perf_counter() - start)
+                if not reusable:
+                    writer.close()
+                    writer = None
+                next_request += period
+                await asyncio.sleep(max(0, next_request - time.monotonic()))
+        finally:
+            # Whatever ended the client (errors, cancellation at the end of
+            # the test), the connection is not leaked
+            if writer is not None:
+                writer.close()
+
+    async def _stream(self, stats, chunk_time=0.1):
+        """Consumes the stream target at the configured bitrate, recording how
+        late each chunk arrives compared to its playback deadline."""
+        target = self.targets["stream"]
+        chunk = max(1, int(self.bitrate / 8 * chunk_time))
+        reader, writer = await self._connect(stats)
+        try:
+            writer.write(f"GET {self._path('stream')} HTTP/1.1\r\nHost: {target.netloc}"
+                         "\r\nConnection: close\r\n\r\n".encode())
+            await reader.readuntil(b"\r\n\r\n")
+            stats.requests += 1
+            start = time.monotonic()
+            index = 0
+            while True:
+                data = await reader.readexactly(chunk)
+                stats.received(len(data))
+                deadline = start + index * chunk_time
+                stats.latencies.append(max(0.0, time.monotonic() - deadline))
+                index += 1
+                await asyncio.sleep(max(0, start + index * chunk_time - time.monotonic()))
+        finally:
+            writer.close()
+
+    async def _client(self, stats):
+        """Runs the workload of a client, restarting it on errors."""
+        workload = getattr(self, f"_{stats.workload}")
+        while True:
+            try:
+                await workload(stats)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, socks5.SocksError, ValueError) as exception:
+                stats.errors += 1
+                print(f"Client {stats.client} ({stats.workload}): {exception!r}")
+                await asyncio.sleep(0.1)
+
+    async def run(self):
+        """Runs every client for the test duration.
+
+        Returns:
+            dict: See `report`.
+        """
+        tasks = [asyncio.create_task(self._client(stats)) for stats in self.stats]
+        await asyncio.sleep(self.duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report()
+
+    def execute(self):
+        """Blocking entry point running the test on a new event loop."""
+        return asyncio.run(self.run())
+
+    def report(self):
+        """Summarizes the measurements.
+
+        Returns:
+            dict: "clients" with the goodput (bit/s), requests, errors and
+                latency percentiles of each client, and "aggregate" with the
+                total goodput and the latency percentiles of each workload.
+        """
+        clients = []
+        for stats in self.stats:
+            latencies = np.array(stats.latencies)
+            clients.append({
+                "client": stats.client,
+                "workload": stats.workload,
+                "socks_port": stats.socks_port,
+                "goodput": stats.bytes * 8 / self.duration,
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "latency": dict(zip(PERCENTILES, np.percentile(latencies, PERCENTILES)))
+                           if len(latencies) else {}})
+
+        aggregate = {"goodput": sum(client["goodput"] for client in clients),
+                     "latency": {}}
+        for workload in WORKLOADS:
+            latencies = np.concatenate([np.array(stats.latencies) for stats in self.stats
+                                        if stats.workload == workload] or [np.zeros(0)])
+            if len(latencies):
+                aggregate["latency"][workload] = dict(zip(PERCENTILES,
+                                                      np.percentile(latencies, PERCENTILES)))
+        return {"clients": clients, "aggregate": aggregate}
+
+def print_report(report):
+    """Prints a load generator report."""
+    print("client\tworkload\tport\tgoodput (kbit/s)\treqs\terrors\tp50\tp99")
+    for client in report["clients"]:
+        latency = client["latency"]
+        print(f"{client['client']}\t{client['workload']}\t{client['socks_port']}\t"
+              f"{client['goodput'] / 1000:.1f}\t{client['requests']}\t{client['errors']}\t"
+              f"{latency.get(50, float('nan')):.3f}\t{latency.get(99, float('nan')):.3f}")
+    print(f"Aggregate goodput: {report['aggregate']['goodput'] / 1000:.1f} kbit/s")
+    for workload, latency in report["aggregate"]["latency"].items():
+        print(f"{workload} latency (s): " +
+              ", ".join(f"p{p}={value:.3f}" for p, value in latency.items()))
+
+def main():
+    """Parses the load generator arguments and runs the test.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--clients", type=int, default=3)
+    parser.add_argument("--socks_host", type=str, default="127.0.0.1")
+    # Comma separated SOCKS ports, one per TorK instance. Empty for direct.
+    parser.add_argument("--socks_ports", type=str, default="9050")
+    parser.add_argument("--mix", type=str, default="bulk=1,rr=1,stream=1")
+    parser.add_argument("--bulk_url", type=str, default="http://146.193.41.153/tork/file_1")
+    parser.add_argument("--rr_url", type=str, default="http://146.193.41.153/")
+    parser.add_argument("--stream_url", type=str, default="http://146.193.41.153/tork/file_1")
+    parser.add_argument("--duration", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=1.0)
+    parser.add_argument("--bitrate", type=int, default=2500000)
+    parser.add_argument("--mode", type=int, default=0)
+    parser.add_argument("--k_min", type=int, default=3)
+    parser.add_argument("--results", type=str, default="")
+    args = parser.parse_args()
+
+    socks_ports = [int(port) for port in args.socks_ports.split(",") if port]
+    generator = LoadGenerator(args.clients,
+                              {"bulk": args.bulk_url, "rr": args.rr_url,
+                               "stream": args.stream_url},
+                              mix=parse_mix(args.mix), socks_ports=socks_ports,
+                              socks_host=args.socks_host, duration=args.duration,
+                              rate=args.rate, bitrate=args.bitrate)
+    report = generator.execute()
+    print_report(report)
+
+    if args.results:
+        store = ResultsStore(args.results)
+        # Synthetic clients are told apart by resolution, as in
+        # Performance.generate_load, client_id being the client slot
+        for stats in generator.stats:
+            store.append(stats.series(args.duration), f"loadgen_{stats.workload}",
+                         args.mode, args.k_min, 1, resolution=f"client_{stats.client}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Concurrent experiment orchestration module
+
+An iteration is described as a graph of probes (tcpdump, nethogs, telemetry,
+iperf, ...). Each probe knows how to start, how to tell when it is ready and
+how to stop. The orchestrator launches every probe as soon as the probes it
+depends on are ready, waits on readiness events instead of sleeping and tears
+everything down concurrently at the end of the iteration.
+"""
+import asyncio
+import os
+import re
+import signal
+import time
+
+async def wait_for_port(host, port, timeout=30, max_backoff=0.5):
+    """Wait for a TCP port to accept connections.
+
+    Args:
+        host (str): Hostname or IP address of the service.
+        port (int): Port of the service.
+        timeout (int, optional): Maximum time to wait in seconds.
+            Defaults to 30.
+        max_backoff (float, optional): Upper bound of the retry backoff in
+            seconds. Defaults to 0.5.
+
+    Returns:
+        bool: True if the port accepted a connection before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    backoff = 0.01
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, int(port))
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except OSError:
+            if time.monotonic() + backoff > deadline:
+                return False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+class Probe:
+    """Base class of a probe taking part in an iteration.
+
+    A background probe (`wait=False`) keeps running until the iteration is
+    torn down and is considered ready once `ready()` returns. A workload probe
+    (`wait=True`) runs to completion and is only considered ready when it has
+    finished, so probes depending on it start afterwards.
+
+    Args:
+        name (str): Unique name of the probe in the graph.
+        after (tuple, optional): Names of the probes that must be ready before
+            this one starts. Defaults to ().
+        wait (bool, optional): Whether the probe is a workload that runs to
+            completion. Defaults to False.
+        timeout (int, optional): Maximum run time of a workload probe in
+            seconds. Defaults to None (no limit).
+    """
+    def __init__(self, name, after=(), wait=False, timeout=None):
+        self.name = name
+        self.after = tuple(after)
+        self.wait = wait
+        self.timeout = timeout
+        self.started = False
+
+    async def start(self):
+        """Starts the probe."""
+        self.started = True
+
+    async def ready(self):
+        """Waits until the probe is ready to measure.
+
+        Returns:
+            bool: True if the probe became ready.
+        """
+        return True
+
+    async def run(self):
+        """Waits for a workload probe to finish.
+
+        Returns:
+            Result of the workload, None if it timed out.
+        """
+        return None
+
+    async def stop(self):
+        """Stops the probe and releases its resources."""
+
+class ProcessProbe(Probe):
+    """Probe backed by a (possibly remote, over SSH) process.
+
+    The process output is copied to `log_path` while it is scanned for
+    `ready_pattern`, so readiness is signalled by the tool itself (e.g.
+    tcpdump's "listening on") rather than guessed with a fixed sleep.
+
+    Args:
+        name (str): Unique name of the probe in the graph.
+        cmd (list): Command and arguments to execute.
+        log_path (str): Path of the file collecting the process output.
+        ready_pattern (str, optional): Regular expression marking the process
+            as ready once matched in its output. Defaults to None.
+        ready_port (tuple, optional): (host, port) that must accept
+            connections for the process to be ready. Defaults to None.
+        stop_cmd (list, optional): Command executed after the process is
+            killed, e.g. to clean up remote leftovers. Defaults to None.
+        **kwargs: See `Probe`.
+    """
+    def __init__(self, name, cmd, log_path, ready_pattern=None,
+                 ready_port=None, stop_cmd=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.cmd = cmd
+        self.log_path = log_path
+        self.ready_pattern = re.compile(ready_pattern) if ready_pattern else None
+        self.ready_port = ready_port
+        self.stop_cmd = stop_cmd
+        self.process = None
+        self._log = None
+        self._pump = None
+        self._matched = asyncio.Event()
+
+    async def start(self):
+        self._log = open(self.log_path, "wb")
+        self.process = await asyncio.create_subprocess_exec(*self.cmd,
+                                stdout=asyncio.subprocess.PIPE,
+                                stderr=asyncio.subprocess.STDOUT,
+                                start_new_session=True)
+        self._pump = asyncio.create_task(self._pump_output())
+        self.started = True
+
+    async def _pump_output(self):
+        """Copies the process output to the log file, looking for the
+        readiness pattern."""
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            self._log.write(line)
+            if self.ready_pattern and not self._matched.is_set() and \
+                    self.ready_pattern.search(line.decode(errors="replace")):
+                self._matched.set()
+
+    async def ready(self):
+        if self.ready_pattern:
+            matched = asyncio.create_task(self._matched.wait())
+            exited = asyncio.create_task(self.process.wait())
+            await asyncio.wait((matched, exited),
+                               return_when=asyncio.FIRST_COMPLETED)
+            exited.cancel()
+            matched.cancel()
+            if not self._matched.is_set():
+                return False
+        if self.ready_port:
+            return await wait_for_port(*self.ready_port)
+        return True
+
+    async def run(self):
+        try:
+            return await asyncio.wait_for(self.process.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"[{self.name}] took too much time. Killed.")
+            return None
+
+    async def stop(self):
+        if self.process is not None:
+            # Kill the whole process group so children holding the output
+            # pipe (e.g. a shell wrapper) do not outlive the probe
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        if self._pump is not None:
+            await self._pump
+        if self._log is not None:
+            self._log.close()
+        if self.stop_cmd:
+            cleanup = await asyncio.create_subprocess_exec(*self.stop_cmd,
+                                stdout=asyncio.subprocess.DEVNULL,
+                                stderr=asyncio.subprocess.DEVNULL)
+            await cleanup.wait()
+
+class CallableProbe(Probe):
+    """Workload probe running a blocking callable in a worker thread.
+
+    Args:
+        name (str): Unique name of the probe in the graph.
+        func (callable): Blocking function to execute.
+        *args: Positional arguments passed to `func`.
+        **kwargs: See `Probe`. `wait` is always True.
+    """
+    def __init__(self, name, func, *args, **kwargs):
+        kwargs["wait"] = True
+        super().__init__(name, **kwargs)
+        self.func = func
+        self.args = args
+        self._future = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._future = loop.run_in_executor(None, self.func, *self.args)
+        self.started = True
+
+    async def run(self):
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._future),
+                                          self.timeout)
+        except asyncio.TimeoutError:
+            print(f"[{self.name}] took too much time.")
+            return None
+
+class Orchestrator:
+    """Runs a graph of probes for a single iteration.
+
+    Args:
+        probes (list): Probes of the iteration. Dependencies (`after`) must
+            refer to probes of the same list.
+        ready_timeout (int, optional): Maximum time in seconds a probe may
+            take to become ready. Defaults to 30.
+    """
+    def __init__(self, probes, ready_timeout=30):
+        self.probes = {probe.name: probe for probe in probes}
+        self.ready_timeout = ready_timeout
+        for probe in probes:
+            for dependency in probe.after:
+                if dependency not in self.probes:
+                    raise ValueError(f"Unknown dependency {dependency} of {probe.name}")
+        self._ready = {}
+        self.results = {}
+        self.timings = {}
+
+    async def _launch(self, probe):
+        """Starts a probe after its dependencies and waits until it is ready
+        (or finished, for workload probes)."""
+        for dependency in probe.after:
+            if not await self._ready[dependency]:
+                raise RuntimeError(f"{probe.name} aborted: {dependency} failed")
+
+        started = time.monotonic()
+        await probe.start()
+        try:
+            ready = await asyncio.wait_for(probe.ready(), self.ready_timeout)
+        except asyncio.TimeoutError:
+            ready = False
+        if not ready:
+            raise RuntimeError(f"{probe.name} did not become ready")
+        self.timings[probe.name] = time.monotonic() - started
+
+        if probe.wait:
+            self.results[probe.name] = await probe.run()
+        return True
+
+    async def run(self):
+        """Runs the iteration and tears every started probe down.
+
+        Returns:
+            dict: Result of each workload probe, by name. A workload that
+                timed out has a None result.
+        """
+        loop = asyncio.get_running_loop()
+        for name in self.probes:
+            self._ready[name] = loop.create_future()
+
+        async def launch(probe):
+            try:
+                self._ready[probe.name].set_result(await self._launch(probe))
+            except Exception as exception:
+                print(f"[{probe.name}] {exception}")
+                self._ready[probe.name].set_result(False)
+                raise
+
+        tasks = [asyncio.create_task(launch(probe))
+                 for probe in self.probes.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*(probe.stop() for probe in self.probes.values()
+                                   if probe.started),
+                                 return_exceptions=True)
+        return self.results
+
+    def execute(self):
+        """Blocking entry point running the iteration on a new event loop.
+
+        Returns:
+            dict: See `run`.
+        """
+        return asyncio.run(self.run())
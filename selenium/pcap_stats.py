@@ -0,0 +1,226 @@
+"""Streaming pcap analysis module
+
+Computes per-interval byte and packet counts of TCP segments carrying payload
+for a set of ports, in a single pass over the raw pcap records. A capture is
+either read at once through mmap or followed while tcpdump is writing it, so
+the I/O statistics are ready as soon as the capture stops.
+"""
+import mmap
+import os
+import struct
+import numpy as np
+
+PCAP_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+# Link-layer types and the length of their header
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = 0x8100
+
+IPPROTO_TCP = 6
+
+class PcapStats:
+    """Per-interval statistics of TCP traffic by port and direction.
+
+    A segment whose source port is a watched port is accounted as "tx" of that
+    port, one whose destination port is watched as "rx". Only segments with
+    payload are considered, like `tcp.len>0` in tshark. Lengths are taken
+    from the IP header, so captures truncated with a small snaplen are
+    accounted with the size of the original segments.
+
+    Args:
+        ports (dict): Ports to account, by name, e.g. {"bridge": 8081}.
+        interval (float, optional): Bucket size in seconds. Defaults to 1.
+    """
+    def __init__(self, ports, interval=1.0):
+        self.ports = {int(port): name for name, port in ports.items()}
+        self.interval = interval
+        # (name, direction) -> {bucket: [packets, bytes, payload bytes]}
+        self.counters = {}
+        self.linktype = None
+        self._endian = None
+        self._ts_scale = None
+
+    def _parse_header(self, data):
+        """Parses the pcap global header."""
+        magic = bytes(data[:4])
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            self._endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            self._endian = ">"
+        else:
+            raise ValueError("Not a pcap file (pcapng is not supported)")
+        self._ts_scale = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") \
+                         else 1e-6
+        self.linktype = struct.unpack_from(f"{self._endian}I", data, 20)[0]
+
+    def _network_offset(self, data, offset):
+        """Finds the network layer of a frame.
+
+        Returns:
+            (int, int): IP version and offset of the IP header, (0, 0) if the
+                frame does not carry IP.
+        """
+        if self.linktype == LINKTYPE_ETHERNET:
+            ethertype = struct.unpack_from("!H", data, offset + 12)[0]
+            offset += 14
+            while ethertype == ETHERTYPE_VLAN:
+                ethertype = struct.unpack_from("!H", data, offset + 2)[0]
+                offset += 4
+        elif self.linktype == LINKTYPE_LINUX_SLL:
+            ethertype = struct.unpack_from("!H", data, offset + 14)[0]
+            offset += 16
+        elif self.linktype == LINKTYPE_LINUX_SLL2:
+            ethertype = struct.unpack_from("!H", data, offset)[0]
+            offset += 20
+        elif self.linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+            version = data[offset] >> 4
+            return (version, offset) if version in (4, 6) else (0, 0)
+        else:
+            raise ValueError(f"Unsupported link type {self.linktype}")
+
+        if ethertype == ETHERTYPE_IPV4:
+            return 4, offset
+        if ethertype == ETHERTYPE_IPV6:
+            return 6, offset
+        return 0, 0
+
+    def _account(self, data, offset, caplen, timestamp, frame_len):
+        """Accounts a single captured frame."""
+        end = offset + caplen
+        version, offset = self._network_offset(data, offset)
+        if version == 4:
+            if offset + 20 > end or data[offset + 9] != IPPROTO_TCP:
+                return
+            ip_len = struct.unpack_from("!H", data, offset + 2)[0]
+            ip_header = (data[offset] & 0x0F) * 4
+        elif version == 6:
+            if offset + 40 > end or data[offset + 6] != IPPROTO_TCP:
+                return
+            ip_len = struct.unpack_from("!H", data, offset + 4)[0] + 40
+            ip_header = 40
+        else:
+            return
+        tcp = offset + ip_header
+        if tcp + 14 > end:
+            return
+        src_port, dst_port = struct.unpack_from("!HH", data, tcp)
+        payload = ip_len - ip_header - (data[tcp + 12] >> 4) * 4
+        if payload <= 0:
+            return
+
+        bucket = int(timestamp // self.interval)
+        for port, direction in ((src_port, "tx"), (dst_port, "rx")):
+            name = self.ports.get(port)
+            if name is None:
+                continue
+            counter = self.counters.setdefault((name, direction), {}) \
+                                  .setdefault(bucket, [0, 0, 0])
+            counter[0] += 1
+            counter[1] += frame_len
+            counter[2] += payload
+
+    def parse(self, data):
+        """Parses as many complete records as available.
+
+        Args:
+            data (bytes-like): Capture content, from the start of the file
+                for the first call and from the first unparsed byte after.
+
+        Returns:
+            int: Number of bytes consumed.
+        """
+        offset = 0
+        if self._endian is None:
+            if len(data) < PCAP_HEADER_LEN:
+                return 0
+            self._parse_header(data)
+            offset = PCAP_HEADER_LEN
+
+        record = struct.Struct(f"{self._endian}IIII")
+        size = len(data)
+        while offset + RECORD_HEADER_LEN <= size:
+            ts_sec, ts_frac, caplen, frame_len = record.unpack_from(data, offset)
+            if offset + RECORD_HEADER_LEN + caplen > size:
+                break
+            self._account(data, offset + RECORD_HEADER_LEN, caplen,
+                          ts_sec + ts_frac * self._ts_scale, frame_len)
+            offset += RECORD_HEADER_LEN + caplen
+        return offset
+
+    def read(self, path):
+        """Reads a whole capture through mmap.
+
+        Counters add up over several calls, e.g. for the files of a ring
+        capture.
+
+        Args:
+            path (str): Path to the pcap file.
+        """
+        # Every file starts with its own global header
+        self._endian = None
+        with open(path, "rb") as pcap:
+            if os.fstat(pcap.fileno()).st_size == 0:
+                return
+            with mmap.mmap(pcap.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.parse(memoryview(data))
+
+    def follow(self, path, stop, poll=0.05):
+        """Follows a capture while it is being written, until `stop` is set.
+
+        The capture should be written packet-buffered (`tcpdump -U`) so that
+        records reach the file as soon as they are captured.
+
+        Args:
+            path (str): Path to the pcap file.
+            stop (threading.Event): Set once the capture has been stopped, the
+                remaining records are then read before returning.
+            poll (float, optional): Polling period in seconds while no new
+                data is available. Defaults to 0.05.
+        """
+        while not os.path.exists(path):
+            if stop.is_set():
+                return
+            stop.wait(poll)
+        pending = bytearray()
+        with open(path, "rb") as pcap:
+            while True:
+                stopped = stop.is_set()
+                chunk = pcap.read(1 << 20)
+                if chunk:
+                    pending += chunk
+                    del pending[:self.parse(pending)]
+                elif stopped:
+                    break
+                else:
+                    stop.wait(poll)
+
+    def series(self):
+        """Builds aligned per-interval series.
+
+        Returns:
+            dict: "time" with the start of each interval (epoch seconds) and,
+                for each port and direction, "<name>_<dir>_packets",
+                "<name>_<dir>_bytes" and "<name>_<dir>_payload" arrays.
+        """
+        buckets = [bucket for counter in self.counters.values() for bucket in counter]
+        if not buckets:
+            return {"time": np.zeros(0)}
+        first = min(buckets)
+        length = max(buckets) - first + 1
+        series = {"time": (np.arange(length) + first) * self.interval}
+        for (name, direction), counter in sorted(self.counters.items()):
+            values = np.zeros((length, 3), dtype=np.int64)
+            index = np.fromiter(counter.keys(), dtype=np.int64, count=len(counter)) - first
+            values[index] = np.array(list(counter.values()), dtype=np.int64)
+            for column, field in enumerate(("packets", "bytes", "payload")):
+                series[f"{name}_{direction}_{field}"] = values[:, column]
+        return series
@@ -3,9 +3,30 @@
 import os
 import subprocess
 import socket
+import threading
 import time
 import stem.process
 import requests
+import numpy as np
+from orchestrator import Orchestrator, ProcessProbe, CallableProbe
+from tork_cli import TorkCliClient, STATS_BYTES_FIELDS, BRIDGE_CLI_PORT
+from frame_stats import FrameStatsCollector
+from frame_pool import FramePoolMonitor
+from handler_times import HandlerTimesDrainer
+from sampler import Sampler
+from results_store import ResultsStore
+from pcap_stats import PcapStats
+from ring_capture import RingCapture, ring_options, DEFAULT_SNAPLEN
+from targets import HTTP_PORT, ECHO_PORT, BULK_PORT
+from latency_probe import LatencyProbe, print_report as print_latency_report
+from throughput import ThroughputTest
+from loadgen import LoadGenerator, parse_mix, print_report as print_loadgen_report
+from steady_state import SteadyStateDetector, WARMUP, STEADY, TRANSIENT
+from streaming_qoe import StreamingTest, PROFILES, print_report as print_qoe_report
+from telemetry_agent import TelemetryCollector, TELEMETRY_PORT
+from remote import RemotePool
+from circuit_events import CircuitEventCollector, report as circuit_report, \
+    print_report as print_circuit_report
 
 def save_to_file(filename, content):
     """Save results output to file.
@@ -63,25 +84,52 @@ class TimeoutException(Exception):
 class Performance:
     """Performance Experiment Class
     """
-    def __init__(self, client_settings, bridge_ip, mode, tor_channel, k_min):
+    def __init__(self, client_settings, bridge_ip, mode, tor_channel, k_min,
+                 tor_pool=None):
         """
-        Initializes Performance experiment
+        Initializes Performance experiment, taking its Tor from `tor_pool`
+        (see tor_pool.py) if given
         """
         self.client_id = client_settings[0]
         self.socks = int(client_settings[1]["socksport"])
         self.control = int(client_settings[1]["controlport"])
+        # CLI port of the TorK client, the one of the instance with a pool
+        self.cli_port = 9091
         self.devnull = open(os.devnull, "w", encoding="utf8")
         self.torrc_dict = client_settings[1]
         self.bridge_ip = bridge_ip
         self.ssh_cmd_bridge_prefix = "ssh -t " + self.bridge_ip
         self.tor_binary_path = "/usr/local/bin/tor"
         self.results = "/results/"
+        self.store = ResultsStore(f"{self.results}/results_{self.client_id}.npz")
         self.iperf_hostname = os.getenv("TARGET_HOST_IP")
         self.iperf_port = os.getenv("TARGET_HOST_PORT")
         self.host1 = os.getenv("HOST_1")
         self.host2 = os.getenv("HOST_2")
         self.tork_analysis_path = os.getenv("TORK_ANALYSIS_PATH")
-        self.latency_site = "https://146.193.41.153/"
+        self.latency_site = os.getenv("LATENCY_SITE", "https://146.193.41.153/")
+        self.download_url = os.getenv("DOWNLOAD_URL",
+                                      "http://146.193.41.153/tork/file_1")
+        self.latency_probes = int(os.getenv("LATENCY_PROBES", "100"))
+        self.latency_rate = float(os.getenv("LATENCY_RATE", "10"))
+        self.stream_url = None
+        self.echo_target = None
+        self.bulk_target = None
+        if os.getenv("BULK_TARGET"):
+            bulk_host, _, bulk_port = os.getenv("BULK_TARGET").partition(":")
+            self.bulk_target = (bulk_host, int(bulk_port or BULK_PORT))
+        # HTTP target server ("host[:port]") of the native streaming benchmark
+        self.stream_target = None
+        if os.getenv("STREAM_TARGET"):
+            stream_host, _, stream_port = os.getenv("STREAM_TARGET").partition(":")
+            self.stream_target = (stream_host, int(stream_port or HTTP_PORT))
+        self.run_streaming = os.getenv("RUN_STREAMING", "0") == "1"
+        # CAPTURE_MODE=ring records header-only captures into a bounded ring
+        # of files (see ring_capture.py) instead of full packets
+        self.capture_ring = os.getenv("CAPTURE_MODE", "full") == "ring"
+        self.ring = {"snaplen": int(os.getenv("CAPTURE_SNAPLEN", str(DEFAULT_SNAPLEN))),
+                     "file_size": int(os.getenv("CAPTURE_RING_MB", "16")),
+                     "files": int(os.getenv("CAPTURE_RING_FILES", "8"))}
         self.mode = mode
         self.tor_channel = tor_channel
         self.k_min = k_min
@@ -89,15 +137,85 @@ class Performance:
         self.tunnelport = self.socks
         self.tor_ch = None
         self.tor = None
+        self.tor_pool = tor_pool
+        # One multiplexed connection per remote host, shared by the probes
+        # (REMOTE_LOCAL runs the remote commands locally, for testing)
+        self.remote = RemotePool(local=os.getenv("REMOTE_LOCAL", "0") == "1")
         self.nethogs = {}
         self.vlc_server = None
         self.iperf = None
         self.vlc_client = None
         self.tcpdump = {}
+        self.iteration_metrics = {}
 
         self.iperf_server = None
         self.httping = None
         self.telemetry = {}
+        # Telemetry agents ("name=host[:port]" list) replacing telemetry.sh
+        # and nethogs, connected once for the whole session
+        self.telemetry_agents = {}
+        for agent in filter(None, os.getenv("TELEMETRY_AGENTS", "").split(",")):
+            name, _, address = agent.partition("=")
+            agent_host, _, agent_port = address.partition(":")
+            self.telemetry_agents[name] = (agent_host, int(agent_port or TELEMETRY_PORT))
+        self.collectors = {}
+        # Bridge CLI ("host[:port]") polled for per-client frame statistics
+        self.bridge_cli = None
+        if os.getenv("BRIDGE_CLI"):
+            cli_host, _, cli_port = os.getenv("BRIDGE_CLI").partition(":")
+            self.bridge_cli = (cli_host, int(cli_port or BRIDGE_CLI_PORT))
+        # Time circuit builds and stream attachments from the control port
+        # events (CIRCUIT_EVENTS=1), see circuit_events.py
+        self.circuit_events = os.getenv("CIRCUIT_EVENTS", "0") == "1"
+        self.control_password = os.getenv("TOR_CONTROL_PASSWORD")
+        # Sample the frame pools of TorK (FRAME_POOL_MONITOR=1), every
+        # FRAME_POOL_RESOLUTION seconds, see frame_pool.py
+        self.frame_pool_monitor = os.getenv("FRAME_POOL_MONITOR", "0") == "1"
+        self.frame_pool_resolution = float(os.getenv("FRAME_POOL_RESOLUTION", "0.05"))
+        # End the warm-up and the goodput and insights measurements on the
+        # detected steady state (STEADY_STATE=1): STEADY_SECONDS of steady
+        # samples, windows of STEADY_WINDOW seconds agreeing within
+        # STEADY_TOLERANCE, up to STEADY_MAX_DURATION, see steady_state.py
+        self.steady_state = os.getenv("STEADY_STATE", "0") == "1"
+        self.steady = {"seconds": float(os.getenv("STEADY_SECONDS", "20")),
+                       "window": float(os.getenv("STEADY_WINDOW", "1")),
+                       "tolerance": float(os.getenv("STEADY_TOLERANCE", "0.1")),
+                       "max_duration": float(os.getenv("STEADY_MAX_DURATION", "60"))}
+        # Load generator mode (see loadgen.py): LOADGEN_MIX of workloads over
+        # LOADGEN_SOCKS_PORTS (one TorK instance each, this client's SOCKS
+        # port by default), for LOADGEN_DURATION seconds per iteration
+        self.loadgen = {"mix": parse_mix(os.getenv("LOADGEN_MIX", "bulk=1,rr=1,stream=1")),
+                        "socks_ports": [int(port) for port in
+                                        os.getenv("LOADGEN_SOCKS_PORTS", "").split(",") if port],
+                        "duration": int(os.getenv("LOADGEN_DURATION", "60")),
+                        "rate": float(os.getenv("LOADGEN_RATE", "1")),
+                        "bitrate": int(os.getenv("LOADGEN_BITRATE", "2500000")),
+                        "rr_url": os.getenv("LOADGEN_RR_URL")}
+        # TIME_STATS of the bridge build, its handler times are drained if set
+        self.bridge_time_stats = int(os.getenv("BRIDGE_TIME_STATS", "0"))
+
+        if os.getenv("LOCAL_TARGETS"):
+            self.use_local_targets(os.getenv("LOCAL_TARGETS"))
+
+    def use_local_targets(self, host, http_port=HTTP_PORT, echo_port=ECHO_PORT,
+                          bulk_port=BULK_PORT):
+        """Points the experiments at the local target servers (see targets.py)
+        instead of the external endpoints.
+
+        Args:
+            host (str): Hostname where the target servers are running.
+            http_port (int, optional): HTTP server port. Defaults to HTTP_PORT.
+            echo_port (int, optional): Echo server port. Defaults to ECHO_PORT.
+            bulk_port (int, optional): Bulk TCP server port.
+                Defaults to BULK_PORT.
+        """
+        print(f"Using local targets at {host}")
+        self.latency_site = f"http://{host}:{http_port}/"
+        self.download_url = f"http://{host}:{http_port}/tork/file_1"
+        self.stream_url = f"http://{host}:{http_port}/stream/"
+        self.stream_target = (host, http_port)
+        self.echo_target = (host, echo_port)
+        self.bulk_target = (host, bulk_port)
 
     def launch_tor_channel(self):
         """Launches a Tor Channel over SSH port forwarding
@@ -146,6 +264,12 @@ class Performance:
         """
         # launch tor process
         print(f"Tor config: {self.torrc_dict}")
+        if self.tor_pool is not None:
+            # Warm instance of the pool, already bootstrapped
+            self.tor = self.tor_pool.acquire(self.torrc_dict)
+            self.control = self.tor.control_port
+            self.cli_port = self.tor.cli_port
+            return
         self.tor = stem.process.launch_tor_with_config(
                     config=self.torrc_dict,
                     tor_cmd=self.tor_binary_path,
@@ -177,10 +301,37 @@ class Performance:
         else:
             pcap_f = f"{output}pcap_{location}_{resolution}_{iteration}.pcap"
 
-        self.tcpdump[location] = subprocess.Popen(f"{cmd} -w {pcap_f}".split(" "),
+        self.tcpdump[location] = subprocess.Popen(self.capture_cmd(cmd, pcap_f).split(" "),
                                                     stdout=stdout_f,
                                                     stderr=stdout_f)
 
+    def capture_cmd(self, cmd, output):
+        """Completes a tcpdump command writing to `output`, as a header-only
+        ring of files if the ring capture mode is set.
+
+        Args:
+            cmd (str): tcpdump command without its output.
+            output (str): Capture file, the prefix of the ring files in ring
+                mode.
+
+        Returns:
+            str: Full tcpdump command.
+        """
+        if self.capture_ring:
+            return f"{cmd} {ring_options(**self.ring)} -w {output}"
+        return f"{cmd} -w {output}"
+
+    def ring_capture(self, prefix):
+        """Header-only ring capture of the client, accounting `io_ports`.
+
+        Args:
+            prefix (str): Path prefix of the ring files.
+
+        Returns:
+            RingCapture: Capture, see `RingCapture.command`.
+        """
+        return RingCapture(prefix, self.io_ports(), **self.ring)
+
     def latency_test(self):
         """Launches a latency test agains a given site. The latency is measure
         by measuring the time it takes to get the header of the page.
@@ -201,6 +352,10 @@ class Performance:
     def kill_tor(self):
         """Kills the Tor opened locally on a subprocess
         """
+        if self.tor_pool is not None:
+            print("Giving Tor back to the pool")
+            self.tor_pool.release(self.tor)
+            return
         print("Killing Tor")
         self.tor.kill()
 
@@ -233,9 +388,15 @@ class Performance:
         """
         print("Killing vlc server on remote host")
         self.vlc_server.kill()
-        cmd = f"ssh vlc@{vlc_server} -t pkill Xvfb"
-        self.vlc_server = subprocess.Popen(cmd.split(" "), stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
+        self.remote.run(f"vlc@{vlc_server}", "pkill Xvfb")
+
+    def iperf_cmd(self):
+        """Builds the iperf client command.
+
+        Returns:
+            list: iperf command and arguments
+        """
+        return f"proxychains4 -f /etc/proxychains4.conf iperf3 -c {self.iperf_hostname} -p {self.iperf_port} -t 30 -O 1 -f k -R".split(" ")
 
     def start_iperf(self, iteration):
         """Runs a local iperf instance against a server.
@@ -243,12 +404,12 @@ class Performance:
         Returns:
             str: iperf output results
         """
-        cmd = f"proxychains4 -f /etc/proxychains4.conf iperf3 -c {self.iperf_hostname} -p {self.iperf_port} -t 30 -O 1 -f k -R"
+        cmd = self.iperf_cmd()
 
         stdout_f = open(f"{self.results}/iperf_k_{self.k_min}_{iteration}.txt",
                         "w", encoding="utf8")
 
-        self.iperf = subprocess.Popen(cmd.split(" "), stdout=stdout_f,
+        self.iperf = subprocess.Popen(cmd, stdout=stdout_f,
                             stderr=stdout_f)
 
     def kill_iperf(self):
@@ -256,6 +417,31 @@ class Performance:
         """
         self.iperf.kill()
 
+    def vlc_server_cmd(self, vlc_server, video_sample, port="80"):
+        """Builds the command launching a VLC server on a remote host.
+
+        Args:
+            vlc_server (str): remote hostname where to launch VLC server.
+            video_sample (str): sample to be used in server.
+            port (str, optional): Port where the server will listen for client
+            requests. Defaults to "80".
+
+        Returns:
+            list: ssh command and arguments
+        """
+        cmd = f"ssh vlc@{vlc_server} -t " + self.vlc_server_shell_cmd(video_sample, port)
+        return cmd.split(" ")
+
+    def vlc_server_shell_cmd(self, video_sample, port="80"):
+        """Builds the shell command of the VLC server, run on the remote host.
+
+        Returns:
+            str: Shell command.
+        """
+        return f"xvfb-run cvlc {video_sample} --verbose=1" + \
+            " --sout '#http{mux=ffmpeg{mux=flv},dst=:" + port + \
+            "/},dst=gather:std' --sout-all --sout-keep"
+
     def run_vlc_server(self, vlc_server, video_sample, resolution, port="80",
                        iteration=1):
         """Launch a VLC server process on a remote host
@@ -276,10 +462,8 @@ class Performance:
                                     "w", encoding="utf8")
         vlc_server_stderr_f = open(f"/results/vlc_server_{resolution}_stderr.log",
                                     "w", encoding="utf8")
-        cmd = f"ssh vlc@{vlc_server} -t " + f"xvfb-run cvlc {video_sample} \
-            --verbose=1" + " --sout '#http{mux=ffmpeg{mux=flv},dst=:" + port + \
-            "/},dst=gather:std' --sout-all --sout-keep"
-        self.vlc_server = subprocess.Popen(cmd.split(" "),
+        cmd = self.vlc_server_cmd(vlc_server, video_sample, port)
+        self.vlc_server = subprocess.Popen(cmd,
                                 stdout=vlc_server_stdout_f,
                                 stderr=vlc_server_stderr_f)
         print("Started vlc server on remote host")
@@ -345,7 +529,8 @@ class Performance:
             Exception: _description_
 
         Returns:
-            _type_: _description_
+            dict: Series of frames displayed and lost and of each TorK byte
+                counter, with the sample times (see `collect_tork_insights`).
         """
 
         vlc_client_port = self._start_vlc_stream(stream_options[0],
@@ -366,27 +551,19 @@ class Performance:
         # If running in TorK mode, also connect to the stats endpoint to gather
         # the amount of received and sent data and chaff traffic
         if self.mode == 0:
-            stats_s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            stats_s.settimeout(15)
-            stats_s.connect(("127.0.0.1", 9091))
+            stats_cli = TorkCliClient(port=self.cli_port)
+            stats_cli.connect()
 
         # Clean vlc welcome message and prompt
         part = ""
         while not part or ">" not in part:
             part = vlc_client_port.recv(buff_size).decode()
 
-        for _ in range(0, experiment_time):
+        def sample():
             if self.mode == 0:
-                stats_s.send("stats_bytes\n".encode())
-                stats_part = stats_s.recv(buff_size).decode()
-                stats_part.rstrip('\n')
-                stats_splitted = stats_part.split('\t')
-                tork_insights["data_bytes_received"].append(int(stats_splitted[1]))
-                tork_insights["data_bytes_sent"].append(int(stats_splitted[2]))
-                tork_insights["tor_bytes_received"].append(int(stats_splitted[3]))
-                tork_insights["tor_bytes_sent"].append(int(stats_splitted[4]))
-                tork_insights["other_bytes_received"].append(int(stats_splitted[5]))
-                tork_insights["other_bytes_sent"].append(int(stats_splitted[6]))
+                stats_bytes = self._read_stats_bytes(stats_cli)
+                for field in STATS_BYTES_FIELDS[1:]:
+                    tork_insights[field].append(stats_bytes[field])
 
             #gather FPS info in time seconds of streaming
             vlc_client_port.send("stats\n".encode())
@@ -405,18 +582,17 @@ class Performance:
                 elif "frames lost" in line:
                     tork_insights["frames_lost"].append(int(line.split(":")[1]))
 
-            time.sleep(1)
+        sampler = Sampler(sample, resolution=1.0, samples=experiment_time)
+        sampler.run()
 
         self.vlc_client.kill()
+        if self.mode == 0:
+            stats_cli.close()
 
-        return tork_insights["frames_displayed"],    \
-               tork_insights["frames_lost"],         \
-               tork_insights["data_bytes_received"], \
-               tork_insights["data_bytes_sent"],     \
-               tork_insights["tor_bytes_received"],  \
-               tork_insights["tor_bytes_sent"],      \
-               tork_insights["other_bytes_received"],\
-               tork_insights["other_bytes_sent"]
+        tork_insights["timestamps"] = sampler.timestamps
+        tork_insights["wall_times"] = sampler.wall_times
+        tork_insights["missed_ticks"] = sampler.missed
+        return tork_insights
 
     def streaming(self, vlc_hostname, vlc_port, video_sample_prefix,
                   video_resolutions=("480p", "720p", "1080p")):
@@ -432,47 +608,127 @@ class Performance:
                 Defaults to ("480p", "720p", "1080p").
         """
         for resolution in video_resolutions:
-            # Abort if result files are about to be overwritten!
-            if os.path.exists(f"/results/frames_displayed_{resolution}.txt"):
+            # Abort if results of this resolution were already collected!
+            if self.store.runs(experiment="streaming", resolution=resolution):
                 raise Exception(f"!! Failsafe crash! Results of {resolution} exist!")
             print(f"Running Streaming {resolution} @ http://{vlc_hostname}:{vlc_port}/")
-            self.launch_tcpdump_capture(resolution, "bridge", cmd="ssh root@bridge -t tcpdump -i any", output="/root/experiment/")
-            self.launch_tcpdump_capture(resolution, "server", cmd=f"ssh vlc@{vlc_hostname} -t tcpdump", output="")
-            self.launch_tcpdump_capture(resolution, "client", cmd="tcpdump", output=f"{self.results}/")
-            self.run_vlc_server(vlc_hostname,
-                            f"{video_sample_prefix}_{resolution}.mp4", resolution)
-            self.launch_nethogs(resolution, "bridge",
-                                cmd="ssh root@bridge -t /usr/sbin/nethogs -t")
-            self.launch_nethogs(resolution, "server",
-                                cmd=f"ssh vlc@{vlc_hostname} -t /usr/sbin/nethogs -t")
-            self.launch_nethogs(resolution,"client", cmd="/usr/sbin/nethogs -t")
-            frames_displayed, frames_lost, data_bytes_received,  \
-            data_bytes_sent, tor_bytes_received, tor_bytes_sent, \
-                other_bytes_received, other_bytes_sent =         \
-                    self.run_vlc_client((vlc_hostname, vlc_port, resolution), 75)
-            print(frames_displayed, frames_lost)
-            # FPS
-            save_to_file(f"frames_displayed_{resolution}.txt", frames_displayed)
-            save_to_file(f"frames_lost_{resolution}.txt", frames_lost)
-
-            # TorK data usage
-            save_to_file(f"data_bytes_received_{resolution}.txt", data_bytes_received)
-            save_to_file(f"data_bytes_sent_{resolution}.txt", data_bytes_sent)
-            save_to_file(f"tor_bytes_received_{resolution}.txt", tor_bytes_received)
-            save_to_file(f"tor_bytes_sent_{resolution}.txt", tor_bytes_sent)
-            save_to_file(f"other_bytes_received_{resolution}.txt", other_bytes_received)
-            save_to_file(f"other_bytes_sent_{resolution}.txt", other_bytes_sent)
-
-            self.kill_tcpdump("bridge")
-            self.kill_tcpdump("server")
-            self.kill_tcpdump("client")
-
-            self.kill_nethogs("bridge")
-            self.kill_nethogs("server")
-            self.kill_nethogs("client")
-            self.kill_vlc_server(vlc_hostname)
-            # Wait so the binded ports are released
-            time.sleep(3)
+            probes = [
+                self.remote.probe("tcpdump_bridge", "root@bridge",
+                    self.capture_cmd("tcpdump -i any",
+                        f"/root/experiment/pcap_bridge_{resolution}_1.pcap"),
+                    f"{self.results}/tcpdump_bridge_{resolution}_1.log",
+                    ready_pattern="listening on"),
+                self.remote.probe("tcpdump_server", f"vlc@{vlc_hostname}",
+                    self.capture_cmd("tcpdump", f"pcap_server_{resolution}_1.pcap"),
+                    f"{self.results}/tcpdump_server_{resolution}_1.log",
+                    ready_pattern="listening on"),
+                ProcessProbe("tcpdump_client",
+                    self.capture_cmd("tcpdump",
+                        f"{self.results}/pcap_client_{resolution}_1.pcap").split(" "),
+                    f"{self.results}/tcpdump_client_{resolution}_1.log",
+                    ready_pattern="listening on"),
+                self.remote.probe("vlc_server", f"vlc@{vlc_hostname}",
+                    self.vlc_server_shell_cmd(f"{video_sample_prefix}_{resolution}.mp4"),
+                    f"/results/vlc_server_{resolution}_stdout.log",
+                    ready_port=(vlc_hostname, 80), cleanup="pkill Xvfb"),
+                self.remote.probe("nethogs_bridge", "root@bridge", "/usr/sbin/nethogs -t",
+                    f"{self.results}/nethogs_bridge_{resolution}_1.txt"),
+                self.remote.probe("nethogs_server", f"vlc@{vlc_hostname}",
+                    "/usr/sbin/nethogs -t",
+                    f"{self.results}/nethogs_server_{resolution}_1.txt"),
+                ProcessProbe("nethogs_client", "/usr/sbin/nethogs -t".split(" "),
+                    f"{self.results}/nethogs_client_{resolution}_1.txt"),
+                CallableProbe("vlc_client", self.run_vlc_client,
+                    (vlc_hostname, vlc_port, resolution), 75,
+                    after=("vlc_server", "tcpdump_bridge", "tcpdump_server",
+                           "tcpdump_client")),
+            ]
+            results = Orchestrator(probes).execute()
+
+            insights = results["vlc_client"]
+            print(insights["frames_displayed"], insights["frames_lost"])
+            # FPS, TorK data usage and sample times
+            self.store.append(insights, "streaming", self.mode, self.k_min, 1,
+                              resolution=resolution, client_id=self.client_id)
+
+    def measure_streaming(self, resolution, duration=60, vbr=0.0):
+        """Streams a video-equivalent paced stream from the target server
+        through the SOCKS port and models its playback, without VLC.
+
+        Args:
+            resolution (str): Bitrate profile (see `streaming_qoe.PROFILES`).
+            duration (int, optional): Seconds of video. Defaults to 60.
+            vbr (float, optional): Spread of the chunk sizes, 0 for a
+                constant bitrate. Defaults to 0.
+
+        Returns:
+            StreamingTest: Finished test (see `StreamingTest.report`).
+        """
+        test = StreamingTest(self.stream_target[0], self.stream_target[1], resolution,
+                             duration=duration, vbr=vbr,
+                             socks_port=self.socks if self.mode != 2 else None)
+        test.run()
+        return test
+
+    def streaming_qoe(self, iteration=1, video_resolutions=tuple(PROFILES), vbr=0.0):
+        """Streaming experiment with the native QoE benchmark: startup delay,
+        stalls, arrival jitter and effective bitrate of every resolution,
+        with the TorK byte counters sampled meanwhile.
+
+        Args:
+            iteration (int, optional): Current iteration index. Defaults to 1.
+            video_resolutions (tuple, optional): Bitrate profiles.
+                Defaults to every profile.
+            vbr (float, optional): Spread of the chunk sizes. Defaults to 0.
+
+        Returns:
+            bool: False if a stream could not be received.
+        """
+        for resolution in video_resolutions:
+            print(f"K: {self.k_min}\t[# {iteration}] Streaming {resolution}")
+            pcap = f"{self.results}/pcap_client_{resolution}_{iteration}.pcap"
+            capture = self.ring_capture(pcap) if self.capture_ring else None
+            probes = [
+                ProcessProbe("tcpdump_client",
+                    capture.command() if capture else f"tcpdump -w {pcap}".split(" "),
+                    f"{self.results}/tcpdump_client_{resolution}_{iteration}.log",
+                    ready_pattern="listening on"),
+                CallableProbe("stream_client", self.measure_streaming, resolution, 60, vbr,
+                    after=("tcpdump_client",), timeout=180),
+            ]
+            if self.mode == 0:
+                probes.append(CallableProbe("insights", self.collect_tork_insights, 60,
+                    after=("tcpdump_client",)))
+            if capture:
+                io_stop = threading.Event()
+                io_follow = threading.Thread(target=capture.follow, args=(io_stop,))
+                io_follow.start()
+            try:
+                results = Orchestrator(probes).execute()
+            except RuntimeError as exception:
+                print(f"K: {self.k_min}\t[# {iteration}] Streaming aborted: {exception}")
+                return False
+            finally:
+                if capture:
+                    io_stop.set()
+                    io_follow.join()
+                    self.store.append(capture.series(), "io_client", self.mode,
+                                      self.k_min, iteration, resolution=resolution,
+                                      client_id=self.client_id)
+            test = results["stream_client"]
+            if test is None:
+                return False
+            report = test.report()
+            print_qoe_report(report)
+            self.store.append(test.series(), "streaming_qoe", self.mode, self.k_min,
+                              iteration, resolution=resolution, client_id=self.client_id)
+            if results.get("insights") is not None:
+                self.store.append(results["insights"], "stream_insights", self.mode,
+                                  self.k_min, iteration, resolution=resolution,
+                                  client_id=self.client_id)
+            if report["errors"]:
+                return False
+        return True
 
     def start_telemetry(self, location, iteration, cmd="/home/tork/telemetry.sh"):
         """Starts a CPU and memory telemetry on a location
@@ -497,25 +753,68 @@ class Performance:
         """
         self.telemetry[location].kill()
 
-    def extract_io_usage(self, pcap, output):
-        """Extracts aggregated bandwidth usage from a pcap into output.
+    def connect_telemetry(self):
+        """Connects to the telemetry agents not connected yet.
+
+        Returns:
+            dict: Connected collectors by agent name, with their current mark.
+        """
+        marks = {}
+        for name, (host, port) in self.telemetry_agents.items():
+            collector = self.collectors.get(name)
+            if collector is None or not collector.connected():
+                collector = TelemetryCollector(host, port)
+                try:
+                    collector.connect()
+                except (OSError, ValueError, KeyError) as exception:
+                    # Unreachable agent, or a bad header
+                    print(f"Telemetry agent {name} unavailable: {exception!r}")
+                    collector.close()
+                    continue
+                self.collectors[name] = collector
+            marks[name] = collector.mark()
+        return marks
+
+    def store_telemetry(self, marks, iteration):
+        """Stores the telemetry received since `marks` (see
+        `connect_telemetry`), one run per agent.
 
         Args:
-            pcap (_type_): Path to the pcap file
-            output (_type_): Path to the output file
+            marks (dict): Marks of the collectors at the iteration start.
+            iteration (_type_): Current iteration index
         """
-        stdout_f = open(f"{output}", "w", encoding="utf8")
-        cmd = f"tshark -r {pcap} -q -Y tcp.srcport==8081&&tcp.len>0 -z io,stat,1,tcp.srcport==8081&&tcp.len>0"
+        for name, first in marks.items():
+            series = self.collectors[name].series(first)
+            series["agent"] = np.array(name)
+            self.store.append(series, "telemetry", self.mode, self.k_min,
+                              iteration, client_id=self.client_id)
 
-        self.io_extract = subprocess.Popen(cmd.split(" "),
-                    stdout=stdout_f,
-                    stderr=stdout_f)
+    def io_ports(self):
+        """Ports whose traffic is accounted in the I/O usage.
 
-        try:
-            self.io_extract.wait(timeout=120)
-        except subprocess.TimeoutExpired as _:
-            self.io_extract.kill()
-            print("IO tooked too much time. Killed.")
+        Returns:
+            dict: Port of the bridge, of the SOCKS proxy and of iperf, by name.
+        """
+        ports = {"bridge": 8081}
+        if self.socks:
+            ports["socks"] = self.socks
+        if self.iperf_port:
+            ports["iperf"] = int(self.iperf_port)
+        return ports
+
+    def extract_io_usage(self, pcap):
+        """Extracts aggregated bandwidth usage from a pcap.
+
+        Args:
+            pcap (_type_): Path to the pcap file
+
+        Returns:
+            dict: Per-second packet and byte series of each port and
+                direction (see `PcapStats.series`).
+        """
+        io_stats = PcapStats(self.io_ports())
+        io_stats.read(pcap)
+        return io_stats.series()
 
     def launch_iperf_server(self, cmd):
         """Launches a iperf3 server
@@ -535,18 +834,26 @@ class Performance:
         """
         self.iperf_server.kill()
 
+    def httping_cmd(self):
+        """Builds the httping command.
+
+        Returns:
+            list: httping command and arguments
+        """
+        return f"httping -c 10 -x 127.0.0.1:{self.socks} -5 -i 1 -r -S -l -g {self.latency_site}".split(" ")
+
     def launch_httping(self, iteration):
         """Launches a httping instance
 
         Args:
             iteration (_type_): Current iteration index
         """
-        cmd = f"httping -c 10 -x 127.0.0.1:{self.socks} -5 -i 1 -r -S -l -g {self.latency_site}"
+        cmd = self.httping_cmd()
 
         stdout_f = open(f"{self.results}/httping_k_{self.k_min}_{iteration}.txt",
                         "w", encoding="utf8")
 
-        self.httping = subprocess.Popen(cmd.split(" "),
+        self.httping = subprocess.Popen(cmd,
                             stdout=stdout_f,
                             stderr=stdout_f)
 
@@ -557,17 +864,119 @@ class Performance:
             return False
         return True
 
-    def collect_tork_insights(self, interval=60):
+    def steady_state_detector(self, resolution):
+        """Steady-state detector of a series sampled every `resolution`
+        seconds, None if disabled."""
+        if not self.steady_state:
+            return None
+        return SteadyStateDetector(window=max(int(round(self.steady["window"] / resolution)), 1),
+                                   tolerance=self.steady["tolerance"],
+                                   steady_samples=int(round(self.steady["seconds"] / resolution)),
+                                   min_warmup=int(round(1 / resolution)))
+
+    def measure_goodput(self, iteration, streams=1, direction="download"):
+        """Measures the goodput through the SOCKS port against the bulk
+        target server, without proxychains and iperf.
+
+        Args:
+            iteration (_type_): Current iteration index
+            streams (int, optional): Number of parallel streams. Defaults to 1.
+            direction (str, optional): "download", "upload" or "both".
+                Defaults to "download" (like iperf -R).
+
+        With steady-state detection, the test ends once enough steady-state
+        goodput was measured, after STEADY_MAX_DURATION at most.
+
+        Returns:
+            dict: Mean goodput (see `ThroughputTest.report`), None if the
+                streams failed, so the iteration is run again.
+        """
+        detector = self.steady_state_detector(0.1)
+        test = ThroughputTest(self.bulk_target[0], self.bulk_target[1],
+                              socks_port=self.socks if self.mode != 2 else None,
+                              streams=streams, direction=direction, interval=0.1,
+                              duration=self.steady["max_duration"] if detector else 30,
+                              detector=detector)
+        report = test.run()
+        if report["errors"] and (np.isnan(test.setup).all()
+                                 or report["rx"] + report["tx"] == 0):
+            print(f"K: {self.k_min}\t[# {iteration}] Goodput failed: "
+                  f"{'; '.join(report['errors'])}")
+            return None
+        print(f"K: {self.k_min}\t[# {iteration}] Goodput: "
+              f"rx {report['rx'] / 1000:.1f} kbit/s, tx {report['tx'] / 1000:.1f} kbit/s")
+        if detector:
+            if report["steady"]:
+                print(f"K: {self.k_min}\t[# {iteration}] Steady after {report['warmup']:.1f} s "
+                      f"(warm-up rx {report['warmup_rx'] / 1000:.1f} kbit/s), "
+                      f"{len(detector.changes)} transients "
+                      f"(rx {report['transient_rx'] / 1000:.1f} kbit/s)")
+            else:
+                print(f"K: {self.k_min}\t[# {iteration}] No steady state in "
+                      f"{self.steady['max_duration']:.0f} s")
+        self.store.append(test.series(), "goodput", self.mode, self.k_min,
+                          iteration, client_id=self.client_id)
+        return report
+
+    def probe_latency(self, iteration):
+        """Measures the connect, SOCKS handshake, TLS and time-to-first-byte
+        latency of requests to the latency site through the SOCKS port.
+
+        Args:
+            iteration (_type_): Current iteration index
+
+        Returns:
+            dict: Percentiles of each phase (see `LatencyProbe.report`).
+        """
+        probe = LatencyProbe(self.latency_site,
+                             socks_port=self.socks if self.mode != 2 else None,
+                             rate=self.latency_rate, count=self.latency_probes)
+        report = probe.run()
+        print_latency_report(report)
+        self.store.append(probe.series(), "latency", self.mode, self.k_min,
+                          iteration, client_id=self.client_id)
+        return report
+
+    @staticmethod
+    def _read_stats_bytes(stats_cli):
+        """Reads the TorK byte counters.
+
+        Args:
+            stats_cli (TorkCliClient): Client of the TorK CLI.
+
+        Returns:
+            dict: See `parse_stats_bytes`, NaN counters if the reply was lost
+                with the connection: the bytes since the previous read are
+                unknown.
+        """
+        try:
+            return stats_cli.stats_bytes()
+        except ConnectionError as exception:
+            print(f"TorK byte counters lost: {exception}")
+            return dict.fromkeys(STATS_BYTES_FIELDS, np.nan)
+
+    def collect_tork_insights(self, interval=60, resolution=1.0):
         """Connects to TorK's CLI port and fetch bytes statistics
 
+        Samples are taken on a fixed monotonic-clock schedule, so the time
+        spent querying TorK does not make the series drift. With steady-state
+        detection in TorK mode, the rate of data received is fed to the
+        detector and the sampling ends once enough steady-state samples were
+        taken, after STEADY_MAX_DURATION at most instead of `interval`.
+
         Args:
             interval (int, optional): Experiment time in seconds. Defaults to 60.
+            resolution (float, optional): Sampling interval in seconds, down to
+                10 ms. Defaults to 1.0.
 
         Returns:
-            _type_: _description_
+            dict: Series of each byte counter (NaN where the reply was lost),
+                plus the monotonic ("timestamps") and wall-clock ("wall_times")
+                time of each sample and the indexes of the ticks missed
+                ("missed_ticks"), and with
+                steady-state detection the "state" of each sample and the
+                "warmup" duration (s, NaN if never steady).
         """
-        buff_size = 2048
-
         tork_insights = {"data_bytes_received": [],
                          "data_bytes_sent": [],
                          "tor_bytes_received": [],
@@ -577,108 +986,422 @@ class Performance:
 
         # If running in TorK mode, also connect to the stats endpoint to gather
         # the amount of received and sent data and chaff traffic
+        detector = None
         if self.mode == 0:
-            stats_s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            stats_s.settimeout(15)
-            stats_s.connect(("127.0.0.1", 9091))
+            stats_cli = TorkCliClient(port=self.cli_port)
+            stats_cli.connect()
+            detector = self.steady_state_detector(resolution)
+            if detector:
+                interval = self.steady["max_duration"]
 
-        for _ in range(0, interval):
+        fed = []
+
+        def sample():
             if self.mode == 0:
-                stats_s.send("stats_bytes\n".encode())
-                stats_part = stats_s.recv(buff_size).decode()
-                stats_part.rstrip('\n')
-                stats_splitted = stats_part.split('\t')
-                tork_insights["data_bytes_received"].append(int(stats_splitted[1]))
-                tork_insights["data_bytes_sent"].append(int(stats_splitted[2]))
-                tork_insights["tor_bytes_received"].append(int(stats_splitted[3]))
-                tork_insights["tor_bytes_sent"].append(int(stats_splitted[4]))
-                tork_insights["other_bytes_received"].append(int(stats_splitted[5]))
-                tork_insights["other_bytes_sent"].append(int(stats_splitted[6]))
-            time.sleep(1)
+                stats_bytes = self._read_stats_bytes(stats_cli)
+                for field in STATS_BYTES_FIELDS[1:]:
+                    tork_insights[field].append(stats_bytes[field])
+                # The counters reset on every read, the first sample covers
+                # an unknown period
+                if detector and len(tork_insights["data_bytes_received"]) > 1 \
+                        and not np.isnan(stats_bytes["data_bytes_received"]):
+                    fed.append(len(tork_insights["data_bytes_received"]) - 1)
+                    detector.add(stats_bytes["data_bytes_received"] / resolution)
+                    if detector.finished:
+                        sampler.stop()
+
+        sampler = Sampler(sample, resolution=resolution, duration=interval)
+        sampler.run()
+
+        if self.mode == 0:
+            stats_cli.close()
+
+        tork_insights["timestamps"] = sampler.timestamps
+        tork_insights["wall_times"] = sampler.wall_times
+        tork_insights["missed_ticks"] = sampler.missed
+        if detector:
+            # Samples not fed to the detector (the first one and the lost
+            # ones) are labelled as transients, the first one as warm-up
+            tork_insights["state"] = np.full(len(tork_insights["data_bytes_received"]),
+                                             TRANSIENT, dtype=np.int8)
+            tork_insights["state"][:1] = WARMUP
+            tork_insights["state"][fed] = detector.labels
+            steady = np.flatnonzero(tork_insights["state"] == STEADY)
+            tork_insights["warmup"] = np.array(
+                sampler.timestamps[steady[0]] if len(steady) else np.nan)
+        return tork_insights
+
+    def start_circuit_events(self):
+        """Subscribes to the circuit and stream events of the Tor control
+        port, if enabled and Tor is used.
+
+        Returns:
+            CircuitEventCollector: Running collector, None if disabled or the
+                control port is unreachable.
+        """
+        if not self.circuit_events or self.mode == 2:
+            return None
+        collector = CircuitEventCollector(self.control, self.control_password)
+        try:
+            collector.start()
+        except (stem.ControllerError, stem.SocketError) as exception:
+            print(f"Circuit events unavailable: {exception}")
+            return None
+        return collector
+
+    def store_circuit_events(self, collector, iteration):
+        """Stops a circuit event collector and stores its timings.
+
+        Args:
+            collector (CircuitEventCollector): Running collector.
+            iteration (int): Current iteration index.
+        """
+        collector.stop()
+        series = collector.series()
+        print(f"K: {self.k_min}\t[# {iteration}] {len(series['circuit_build'])} circuits "
+              f"({int(series['circuits_failed'])} failed), "
+              f"{len(series['stream_attach'])} streams "
+              f"({int(series['streams_failed'])} failed)")
+        print_circuit_report(circuit_report(series), prefix=f"K: {self.k_min}\t")
+        self.store.append(series, "circuit_events", self.mode, self.k_min, iteration,
+                          client_id=self.client_id)
+
+    def collect_frame_stats(self, interval=40, resolution=1.0):
+        """Collects the per-client frame statistics of the bridge and flags
+        the clients lagging behind their K-group.
+
+        Args:
+            interval (int, optional): Collection time in seconds. Defaults to 40.
+            resolution (float, optional): Polling interval in seconds.
+                Defaults to 1.0.
+
+        Returns:
+            dict: See `FrameStatsCollector.series`, None if the bridge CLI
+                is unreachable.
+        """
+        try:
+            with TorkCliClient(*self.bridge_cli) as bridge_cli:
+                collector = FrameStatsCollector(bridge_cli, interval=resolution)
+                return collector.run(interval)
+        except OSError as exception:
+            print(f"Bridge frame stats unavailable: {exception}")
+            return None
+
+    def monitor_frame_pool(self, cli, interval=40):
+        """Samples the frame pool occupancy of a TorK client or bridge,
+        warning before it runs dry.
+
+        Args:
+            cli (tuple): Host and port of the TorK CLI.
+            interval (int, optional): Collection time in seconds. Defaults to 40.
+
+        Returns:
+            dict: See `FramePoolMonitor.series`, with "warning_times"
+                marking the pressure episodes, None if the CLI is
+                unreachable.
+        """
+        try:
+            with TorkCliClient(*cli) as tork_cli:
+                monitor = FramePoolMonitor(tork_cli, resolution=self.frame_pool_resolution,
+                                           name=f"K: {self.k_min}\t{cli[0]}:{cli[1]}")
+                series = monitor.run(interval)
+        except OSError as exception:
+            print(f"Frame pool of {cli[0]}:{cli[1]} unavailable: {exception}")
+            return None
+        if len(series["time"]):
+            print(f"K: {self.k_min}\t{cli[0]}:{cli[1]} frame pool peak "
+                  f"{series['allocated'].max()} frames, {monitor.growths} growths, "
+                  f"{len(monitor.warnings)} warnings")
+        return series
+
+    def collect_handler_times(self, interval=40):
+        """Drains the frame handler times of the bridge controller (TIME_STATS
+        builds only).
 
-        return tork_insights["data_bytes_received"], \
-               tork_insights["data_bytes_sent"],     \
-               tork_insights["tor_bytes_received"],  \
-               tork_insights["tor_bytes_sent"],      \
-               tork_insights["other_bytes_received"],\
-               tork_insights["other_bytes_sent"]
+        Args:
+            interval (int, optional): Collection time in seconds. Defaults to 40.
+
+        Returns:
+            dict: Per second handler time statistics (see
+                `HandlerTimesDrainer.series`), None if the bridge CLI is
+                unreachable.
+        """
+        try:
+            with TorkCliClient(*self.bridge_cli) as bridge_cli:
+                drainer = HandlerTimesDrainer(bridge_cli, cap=self.bridge_time_stats)
+                series = drainer.run(interval)
+        except OSError as exception:
+            print(f"Bridge handler times unavailable: {exception}")
+            return None
+        report = drainer.report()
+        for frame_type in ("ctrl", "data", "chaff"):
+            summary = report[frame_type]
+            print(f"K: {self.k_min}\t{frame_type} handler: p50 {summary['p50'] * 1e6:.1f} us, "
+                  f"p99 {summary['p99'] * 1e6:.1f} us, max {summary['max'] * 1e6:.1f} us")
+        if report["saturated"]:
+            print(f"K: {self.k_min}\t{report['saturated']} handler time polls hit the cap")
+        return series
 
     def throughput(self, iteration, proxy_hostname):
         """Placeholder for the throughput and latency experiment
 
+        The probes of the iteration are described as a graph and launched
+        concurrently by the orchestrator: the goodput measurement (native
+        tester against BULK_TARGET, iperf otherwise) and the TorK insights
+        start as soon as the client capture is listening, and the latency
+        probes run once both finished.
+
         Args:
             iteration (_type_): Current iteration index.
             proxy_hostname (_type_): IP or fqdn of the proxy hostname (when
             hosted outside Docker swarm setup)
         """
-        if self.mode != 2:
-            self.launch_nethogs(self.k_min, "bridge",
-                                cmd="ssh root@bridge -t /usr/sbin/nethogs -t -v 2",
-                                iteration=iteration)
-        #self.launch_nethogs(self.k_min, "server",
-        #                    cmd=f"ssh vlc@{proxy_hostname} -t /usr/sbin/nethogs -t -v 2",
-        #                    iteration=iteration)
-        self.start_telemetry("host_1", iteration, cmd=f"ssh vagrant@{self.host1} -t {self.tork_analysis_path}/machine_setup/Performance/telemetry.sh")
-        self.start_telemetry("host_2", iteration, cmd=f"ssh vagrant@{self.host2} -t {self.tork_analysis_path}/machine_setup/Performance/telemetry.sh")
-        self.launch_nethogs(self.k_min,"client", cmd="/usr/sbin/nethogs -t -v 2",
-                            iteration=iteration)
-        # Store temporary pcap
-        self.launch_tcpdump_capture(self.k_min, "client",
-            cmd="tcpdump -i any", output=f"{self.results}/",
-            iteration=iteration, temp=True)
-
-        print(f"K: {self.k_min}\t[# {iteration}] Started iperf...")
-        self.start_iperf(iteration)
-
-        data_bytes_received,  \
-        data_bytes_sent, tor_bytes_received, tor_bytes_sent, \
-        other_bytes_received, other_bytes_sent =         \
-            self.collect_tork_insights(interval=40)
-
+        telemetry_cmd = f"{self.tork_analysis_path}/machine_setup/Performance/telemetry.sh"
+        # Temporary capture, a header-only ring in ring mode
+        capture = self.ring_capture("temp.pcap") if self.capture_ring else None
+        probes = [
+            ProcessProbe("tcpdump_client", capture.command() if capture
+                         else "tcpdump -i any -U -w temp.pcap".split(" "),
+                f"{self.results}/tcpdump_client_{self.k_min}_{iteration}.log",
+                ready_pattern="listening on"),
+            CallableProbe("insights", self.collect_tork_insights, 40,
+                after=("tcpdump_client",)),
+            # Wait until the goodput and insights are over to collect the latency
+            CallableProbe("latency", self.probe_latency, iteration,
+                after=("goodput", "insights"), timeout=600),
+        ]
+        if self.bridge_cli and self.mode == 0:
+            probes.append(CallableProbe("frames", self.collect_frame_stats, 40,
+                after=("tcpdump_client",)))
+            if self.bridge_time_stats:
+                probes.append(CallableProbe("handler_times", self.collect_handler_times, 40,
+                    after=("tcpdump_client",)))
+        if self.frame_pool_monitor and self.mode == 0:
+            probes.append(CallableProbe("pool_client", self.monitor_frame_pool,
+                ("127.0.0.1", self.cli_port), 40, after=("tcpdump_client",)))
+            if self.bridge_cli:
+                probes.append(CallableProbe("pool_bridge", self.monitor_frame_pool,
+                    self.bridge_cli, 40, after=("tcpdump_client",)))
+        if self.bulk_target:
+            probes.append(CallableProbe("goodput", self.measure_goodput, iteration,
+                after=("tcpdump_client",),
+                timeout=self.steady["max_duration"] + 40 if self.steady_state else 100))
+        else:
+            probes.append(ProcessProbe("goodput", self.iperf_cmd(),
+                f"{self.results}/iperf_k_{self.k_min}_{iteration}.txt",
+                after=("tcpdump_client",), wait=True, timeout=100))
+        if self.telemetry_agents:
+            telemetry_marks = self.connect_telemetry()
+        else:
+            telemetry_marks = {}
+            probes += [
+                self.remote.probe("telemetry_host_1", f"vagrant@{self.host1}", telemetry_cmd,
+                    f"{self.results}/telemetry_host_1_k_{self.k_min}_{iteration}.txt"),
+                self.remote.probe("telemetry_host_2", f"vagrant@{self.host2}", telemetry_cmd,
+                    f"{self.results}/telemetry_host_2_k_{self.k_min}_{iteration}.txt"),
+                ProcessProbe("nethogs_client", "/usr/sbin/nethogs -t -v 2".split(" "),
+                    f"{self.results}/nethogs_client_{self.k_min}_{iteration}.txt"),
+            ]
+            if self.mode != 2:
+                probes.append(self.remote.probe("nethogs_bridge", "root@bridge",
+                    "/usr/sbin/nethogs -t -v 2",
+                    f"{self.results}/nethogs_bridge_{self.k_min}_{iteration}.txt"))
+        #probes.append(ProcessProbe("nethogs_server",
+        #    f"ssh vlc@{proxy_hostname} -t /usr/sbin/nethogs -t -v 2".split(" "),
+        #    f"{self.results}/nethogs_server_{self.k_min}_{iteration}.txt"))
+
+        # Extract network usage from the temporary pcap while it is captured
+        # (from each ring file once closed in ring mode)
+        io_stop = threading.Event()
+        if capture:
+            io_stats = capture
+            io_follow = threading.Thread(target=capture.follow, args=(io_stop,))
+        else:
+            if os.path.exists("temp.pcap"):
+                os.remove("temp.pcap")
+            io_stats = PcapStats(self.io_ports())
+            io_follow = threading.Thread(target=io_stats.follow,
+                                         args=("temp.pcap", io_stop))
+        io_follow.start()
+
+        # Circuit and stream events of the whole iteration, latency probes
+        # included
+        events = self.start_circuit_events()
+
+        print(f"K: {self.k_min}\t[# {iteration}] Started iteration...")
         try:
-            try:
-                self.iperf.wait(timeout=60)
-            except subprocess.TimeoutExpired as _:
-                self.kill_iperf()
-                print("Iperf harshly terminated")
-                return False
+            results = Orchestrator(probes).execute()
+        except RuntimeError as exception:
+            print(f"K: {self.k_min}\t[# {iteration}] Aborted: {exception}")
+            return False
+        finally:
+            io_stop.set()
+            io_follow.join()
+            self.store.append(io_stats.series(), "io_client", self.mode,
+                              self.k_min, iteration, client_id=self.client_id)
+            if capture:
+                capture.cleanup()
+            if events is not None:
+                self.store_circuit_events(events, iteration)
+            self.store_telemetry(telemetry_marks, iteration)
+            print(f"K: {self.k_min}\t[# {iteration}] Iteration finished!")
 
-            print(f"K: {self.k_min}\t[# {iteration}] Iperf and insights finished.")
+        if results["goodput"] is None:
+            print("Goodput measurement harshly terminated")
+            return False
+        print(f"K: {self.k_min}\t[# {iteration}] Goodput and insights finished.")
+
+        # TorK data usage and sample times
+        self.store.append(results["insights"], "throughput", self.mode,
+                          self.k_min, iteration, client_id=self.client_id)
+        if results.get("frames") is not None:
+            self.store.append(results["frames"], "frames_bridge", self.mode,
+                              self.k_min, iteration, client_id=self.client_id)
+        if results.get("handler_times") is not None:
+            self.store.append(results["handler_times"], "handler_times", self.mode,
+                              self.k_min, iteration, client_id=self.client_id)
+        for location in ("pool_client", "pool_bridge"):
+            if results.get(location) is not None:
+                self.store.append(results[location], location, self.mode,
+                                  self.k_min, iteration, client_id=self.client_id)
+
+        if results["latency"] is None:
+            print("Latency probes tooked to much time.")
+            return False
+        # Key metrics of the iteration, for the adaptive iteration count
+        goodput = results["goodput"]
+        self.iteration_metrics = {
+            "goodput": goodput["rx"] if isinstance(goodput, dict) else None,
+            "latency_p99": results["latency"]["total"]["p99"]}
+        print(f"K: {self.k_min}\t[# {iteration}] Finished")
 
-            # TorK data usage
-            save_to_file(f"data_bytes_received_{self.k_min}_{iteration}.txt", data_bytes_received)
-            save_to_file(f"data_bytes_sent_{self.k_min}_{iteration}.txt", data_bytes_sent)
-            save_to_file(f"tor_bytes_received_{self.k_min}_{iteration}.txt", tor_bytes_received)
-            save_to_file(f"tor_bytes_sent_{self.k_min}_{iteration}.txt", tor_bytes_sent)
-            save_to_file(f"other_bytes_received_{self.k_min}_{iteration}.txt", other_bytes_received)
-            save_to_file(f"other_bytes_sent_{self.k_min}_{iteration}.txt", other_bytes_sent)
+        return True
 
-            # Wait until iperf and insights are over to collect the latency
-            print(f"K: {self.k_min}\t[# {iteration}] Running httping...")
-            if self.launch_httping(iteration) is False:
-                return False
-            print(f"K: {self.k_min}\t[# {iteration}] Finished")
+    def run_iterations(self, iterations=10, done=(), checkpoint=None,
+                       proxy_hostname=None, stopper=None):
+        """Throughput experiment of a sweep point, skipping the iterations
+        already done before a restart.
 
-        finally:
-            self.kill_tcpdump("client")
+        Args:
+            iterations (int, optional): Number of repetions. Defaults to 10.
+            done (set, optional): Iterations already done. Defaults to ().
+            checkpoint (callable, optional): Called with the index of every
+                successful iteration. Defaults to None.
+            proxy_hostname (_type_, optional): See `throughput`.
+            stopper (SequentialStopper, optional): Stops the point before
+                `iterations` once the goodput and p99 latency are precise
+                enough (see sequential.py). Iterations done before a restart
+                count towards its limits without contributing samples.
+                Defaults to None (fixed number of iterations).
 
+        Raises:
+            RuntimeError: An experiment of an iteration failed three times
+                in a row.
+        """
+        if self.mode != 2:
+            self.launch_tor()
+        if self.tor_channel == 1:
+            self.launch_tor_channel()
+        try:
+            for iteration in range(1, iterations + 1):
+                if iteration in done:
+                    continue
+                # Each experiment is retried on its own, a streaming failure
+                # does not repeat (and store again) a throughput run
+                experiments = [lambda: self.throughput(iteration, proxy_hostname)]
+                if self.run_streaming and self.stream_target:
+                    experiments.append(lambda: self.streaming_qoe(iteration))
+                for experiment in experiments:
+                    attempts = 3
+                    while not experiment():
+                        attempts -= 1
+                        if not attempts:
+                            raise RuntimeError(f"Iteration {iteration} failed")
+                        print(f"K: {self.k_min}\t[# {iteration}] Retrying...")
+                if checkpoint is not None:
+                    checkpoint(iteration)
+                if stopper is not None:
+                    stopper.add(**self.iteration_metrics)
+                    if stopper.done(iteration):
+                        print(f"K: {self.k_min}\t[# {iteration}] Stopping: "
+                              f"{stopper.status()}")
+                        break
+        finally:
+            self.remote.close()
+            if self.tor_channel == 1:
+                self.kill_tor_channel()
             if self.mode != 2:
-                self.kill_nethogs("bridge")
-            #self.kill_nethogs("server")
-            self.kill_nethogs("client")
-            self.stop_telemetry("host_1")
-            self.stop_telemetry("host_2")
-
-            # Extract network usage from temporary pcap
-            print(f"K: {self.k_min}\t[# {iteration}] Extracting I/O usage...")
-            self.extract_io_usage("temp.pcap",
-                                f"{self.results}/io_client_k_{self.k_min}_{iteration}.txt")
-            print(f"K: {self.k_min}\t[# {iteration}] Iteration finished!")
+                self.kill_tor()
 
-            # Wait so the binded ports are released
-            time.sleep(3)
+    def generate_load(self, iteration, clients):
+        """Runs concurrent synthetic clients from this process (see loadgen.py)
+        and stores the series of each of them.
 
-        return True
+        The bulk clients download DOWNLOAD_URL, the stream clients the paced
+        stream of the local targets at LOADGEN_BITRATE (DOWNLOAD_URL without
+        them), the request/response clients LOADGEN_RR_URL, the latency site
+        by default when it is plain HTTP.
+
+        Args:
+            iteration (int): Current iteration index.
+            clients (int): Number of synthetic clients.
+
+        Returns:
+            dict: Per client and aggregate goodput and latency percentiles
+                (see `LoadGenerator.report`).
+        """
+        config = self.loadgen
+        rr_url = config["rr_url"] or (self.latency_site
+                                      if self.latency_site.startswith("http://")
+                                      else "http://146.193.41.153/")
+        socks_ports = None
+        if self.mode != 2:
+            socks_ports = config["socks_ports"] or [self.socks]
+        generator = LoadGenerator(clients,
+                                  {"bulk": self.download_url, "rr": rr_url,
+                                   "stream": f"{self.stream_url}{config['bitrate']}"
+                                             if self.stream_url else self.download_url},
+                                  mix=config["mix"], socks_ports=socks_ports,
+                                  duration=config["duration"], rate=config["rate"],
+                                  bitrate=config["bitrate"])
+        print(f"K: {self.k_min}\t[# {iteration}] Load generator: {clients} clients")
+        report = generator.execute()
+        print_loadgen_report(report)
+        for stats in generator.stats:
+            # One run per synthetic client, told apart by the resolution tag
+            self.store.append(stats.series(config["duration"]), f"loadgen_{stats.workload}",
+                              self.mode, self.k_min, iteration,
+                              resolution=f"client_{stats.client}", client_id=self.client_id)
+        return report
+
+    def run_load(self, clients, iterations=10, done=(), checkpoint=None):
+        """Load generator experiment of a sweep point, instead of the
+        throughput iterations.
+
+        Args:
+            clients (int): Number of synthetic clients.
+            iterations (int, optional): Number of repetions. Defaults to 10.
+            done (set, optional): Iterations already done. Defaults to ().
+            checkpoint (callable, optional): Called with the index of every
+                iteration done. Defaults to None.
+        """
+        if self.mode != 2:
+            self.launch_tor()
+        if self.tor_channel == 1:
+            self.launch_tor_channel()
+        try:
+            for iteration in range(1, iterations + 1):
+                if iteration in done:
+                    continue
+                self.generate_load(iteration, clients)
+                if checkpoint is not None:
+                    checkpoint(iteration)
+        finally:
+            self.remote.close()
+            if self.tor_channel == 1:
+                self.kill_tor_channel()
+            if self.mode != 2:
+                self.kill_tor()
 
     def run(self, iterations=10):
         """Generic Performance experiment
@@ -699,7 +1422,7 @@ class Performance:
         while True:
             print(f"{self.client_id} Starting download of dummy file ...")
             try:
-                r = requests.get("http://146.193.41.153/tork/file_1", allow_redirects=True, proxies=dict(http=f"socks5h://127.0.0.1:{self.socks}",
+                r = requests.get(self.download_url, allow_redirects=True, proxies=dict(http=f"socks5h://127.0.0.1:{self.socks}",
                     https=f"socks5h://127.0.0.1:{self.socks}"))
             except Exception as ex:
                 print("Exception: ", str(ex))
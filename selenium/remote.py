@@ -0,0 +1,289 @@
+"""Remote command pool module
+
+The probes of an iteration used to open a new SSH session each (tcpdump,
+nethogs and telemetry on the bridge and the hosts, the VLC server...), paying
+the key exchange and authentication at the start of every measurement, and
+killing the local `ssh` left the remote process running when no tty hung it
+up.
+
+The pool keeps one multiplexed connection (ControlMaster) per destination
+and runs every remote command as a new channel of it. Each command is
+started in its own session on the remote side, which records its process
+group in a pid file, so stopping a probe kills the whole remote process group
+through the same connection: nothing is left behind whatever the command
+spawned.
+
+A local transport runs the same wrapped commands on this host, to exercise
+the probes without remote hosts.
+"""
+import asyncio
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from orchestrator import ProcessProbe
+
+# Directory of the ControlMaster sockets
+CONTROL_DIR = "/tmp/tork_ssh"
+
+# Directory of the pid files of the remote commands
+PID_DIR = "/tmp"
+
+class Transport(ABC):
+    """Runs shell commands on a host.
+
+    Args:
+        pid_dir (str, optional): Directory of the pid files on the host.
+            Defaults to PID_DIR.
+    """
+    def __init__(self, pid_dir=PID_DIR):
+        self.pid_dir = pid_dir
+
+    @abstractmethod
+    def command(self, shell_cmd):
+        """Command line running a shell command on the host.
+
+        Returns:
+            list: Command and arguments to execute locally.
+        """
+
+    def start(self):
+        """Opens the connection to the host."""
+
+    def check(self):
+        """Whether the connection to the host is open."""
+        return True
+
+    def stop(self):
+        """Closes the connection to the host."""
+
+    def wrap(self, cmd, name="probe", cleanup=None):
+        """Wraps a command so its process group can be killed afterwards.
+
+        Args:
+            cmd (str): Shell command to run on the host.
+            name (str, optional): Name used in the pid file. Defaults to
+                "probe".
+            cleanup (str, optional): Shell command run on the host once the
+                process group was killed. Defaults to None.
+
+        Returns:
+            (list, list, str): Command starting `cmd`, command killing it and
+                path of its pid file on the host.
+        """
+        pid_file = f"{self.pid_dir}/tork_{name}_{uuid.uuid4().hex[:8]}.pid"
+        # The new session leader writes its pid, which is also its process
+        # group, then runs the command
+        script = f"echo $$ > {pid_file}; {cmd}"
+        start = f"exec setsid -w sh -c {shlex.quote(script)}"
+        kill = (f"if [ -s {pid_file} ]; then pgid=$(cat {pid_file}); "
+                f"kill -TERM -$pgid 2>/dev/null && sleep 0.5; "
+                f"kill -KILL -$pgid 2>/dev/null; fi; rm -f {pid_file}")
+        if cleanup:
+            kill += f"; {cleanup}"
+        return self.command(start), self.command(kill), pid_file
+
+class LocalTransport(Transport):
+    """Stand-in transport running the commands on this host.
+
+    Args:
+        destination (str, optional): Ignored, kept to be interchangeable with
+            SshTransport. Defaults to None.
+        pid_dir (str, optional): Directory of the pid files. Defaults to a
+            temporary directory.
+    """
+    def __init__(self, destination=None, pid_dir=None):
+        super().__init__(pid_dir or tempfile.gettempdir())
+        self.destination = destination
+
+    def command(self, shell_cmd):
+        return ["sh", "-c", shell_cmd]
+
+class SshTransport(Transport):
+    """Multiplexed SSH connection to a host.
+
+    Args:
+        destination (str): SSH destination, e.g. "root@bridge".
+        control_dir (str, optional): Directory of the ControlMaster socket.
+            Defaults to CONTROL_DIR.
+        persist (int, optional): Seconds the master stays open once idle.
+            Defaults to 600.
+        options (tuple, optional): Extra ssh options. Defaults to ().
+        pid_dir (str, optional): Directory of the pid files on the host.
+            Defaults to PID_DIR.
+    """
+    def __init__(self, destination, control_dir=CONTROL_DIR, persist=600, options=(),
+                 pid_dir=PID_DIR):
+        super().__init__(pid_dir)
+        self.destination = destination
+        self.control_dir = control_dir
+        self.persist = persist
+        self.options = list(options)
+
+    def _ssh(self, *args):
+        """ssh command line sharing the master connection."""
+        return ["ssh", "-o", f"ControlPath={self.control_dir}/%C", *self.options, *args]
+
+    def command(self, shell_cmd):
+        return self._ssh("-o", "ControlMaster=no", "-T", self.destination, shell_cmd)
+
+    def check(self):
+        return subprocess.run(self._ssh("-O", "check", self.destination),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              check=False).returncode == 0
+
+    def start(self, timeout=30):
+        """Opens the master connection, if not open yet.
+
+        Raises:
+            RuntimeError: The connection could not be established.
+        """
+        if self.check():
+            return
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        # The master goes to the background once authenticated
+        try:
+            master = subprocess.run(self._ssh("-M", "-N", "-f", "-o", "ControlMaster=yes",
+                                              "-o", f"ControlPersist={self.persist}",
+                                              self.destination),
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    timeout=timeout, check=False)
+        except subprocess.TimeoutExpired as exception:
+            raise RuntimeError(f"SSH master to {self.destination} timed out") from exception
+        if master.returncode != 0:
+            raise RuntimeError(f"SSH master to {self.destination} failed: "
+                               f"{master.stderr.decode(errors='replace').strip()}")
+
+    def stop(self):
+        subprocess.run(self._ssh("-O", "exit", self.destination),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+class RemoteProbe(ProcessProbe):
+    """Probe running a command over a transport of the pool, its remote
+    process group being killed when the probe stops.
+
+    The connection to the host is opened when the probe starts, so an
+    unreachable host fails the iteration (and its retries) rather than the
+    construction of the probes.
+
+    Args:
+        name (str): Unique name of the probe in the graph.
+        pool (RemotePool): Pool owning the connection.
+        destination (str): Host running the command.
+        cmd (str): Shell command to run on the host.
+        log_path (str): Path of the file collecting the command output.
+        cleanup (str, optional): Shell command run on the host after the
+            probe was killed, e.g. "pkill Xvfb". Defaults to None.
+        **kwargs: See `ProcessProbe`.
+    """
+    def __init__(self, name, pool, destination, cmd, log_path, cleanup=None, **kwargs):
+        start, self.kill_cmd, pid_file = pool.transport(destination, connect=False) \
+                                             .wrap(cmd, name, cleanup)
+        super().__init__(name, start, log_path, **kwargs)
+        self.pool = pool
+        self.destination = destination
+        self.key = (destination, pid_file)
+
+    async def start(self):
+        # Opening the master blocks on ssh, off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.transport,
+                                                         self.destination)
+        self.pool.pending[self.key] = self.kill_cmd
+        await super().start()
+
+    async def stop(self):
+        # Kill the remote process group first: the command terminates and its
+        # channel closes, flushing its output, then the local side is reaped
+        if self.started:
+            kill = await asyncio.create_subprocess_exec(*self.kill_cmd,
+                                stdout=asyncio.subprocess.DEVNULL,
+                                stderr=asyncio.subprocess.DEVNULL)
+            await kill.wait()
+        await super().stop()
+        self.pool.pending.pop(self.key, None)
+
+class RemotePool:
+    """One multiplexed connection per host, shared by the remote probes.
+
+    Args:
+        local (bool, optional): Whether every command runs on this host
+            (LocalTransport), for testing. Defaults to False.
+        control_dir (str, optional): Directory of the ControlMaster sockets.
+            Defaults to CONTROL_DIR.
+        persist (int, optional): Seconds a master stays open once idle.
+            Defaults to 600.
+    """
+    def __init__(self, local=False, control_dir=CONTROL_DIR, persist=600):
+        self.local = local
+        self.control_dir = control_dir
+        self.persist = persist
+        self.transports = {}
+        # Probes start concurrently: one lock per destination, so a single
+        # master is opened for each
+        self._lock = threading.Lock()
+        self._locks = {}
+        # Cleanup commands of the probes started and not stopped yet
+        self.pending = {}
+
+    def transport(self, destination, connect=True):
+        """Connection to a host, opened on first use.
+
+        Args:
+            destination (str): SSH destination, e.g. "root@bridge".
+            connect (bool, optional): Whether to open the connection, else it
+                is only used to build commands. Defaults to True.
+
+        Raises:
+            RuntimeError: The connection could not be established.
+
+        Returns:
+            Transport: Connection, open if `connect`.
+        """
+        with self._lock:
+            transport = self.transports.get(destination)
+            if transport is None:
+                transport = LocalTransport(destination) if self.local \
+                            else SshTransport(destination, self.control_dir, self.persist)
+                self.transports[destination] = transport
+            lock = self._locks.setdefault(destination, threading.Lock())
+        if connect:
+            with lock:
+                if not transport.check():
+                    transport.start()
+        return transport
+
+    def probe(self, name, destination, cmd, log_path, **kwargs):
+        """Builds a probe running `cmd` on `destination`.
+
+        Returns:
+            RemoteProbe: Probe for the orchestrator.
+        """
+        return RemoteProbe(name, self, destination, cmd, log_path, **kwargs)
+
+    def run(self, destination, cmd, timeout=30):
+        """Runs a short command on a host and waits for it.
+
+        Returns:
+            subprocess.CompletedProcess: Exit status and output.
+        """
+        return subprocess.run(self.transport(destination).command(cmd),
+                              capture_output=True, timeout=timeout, check=False)
+
+    def close(self):
+        """Kills the remote commands still running and closes the connections."""
+        for stop_cmd in list(self.pending.values()):
+            subprocess.run(stop_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           check=False)
+        self.pending.clear()
+        for transport in self.transports.values():
+            transport.stop()
+        self.transports.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
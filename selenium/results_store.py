@@ -0,0 +1,142 @@
+"""Columnar results store module
+
+Each run (an iteration of an experiment) is appended to a single compressed
+npz file as one typed column per metric, tagged with the experiment settings.
+Appending adds new members to the archive without rewriting the previous
+runs, and the loader returns NumPy arrays without parsing any text.
+"""
+import fcntl
+import os
+import zipfile
+import numpy as np
+
+TAGS_DTYPE = np.dtype([("experiment", "U16"),
+                       ("mode", "i4"),
+                       ("k_min", "i4"),
+                       ("iteration", "i4"),
+                       ("resolution", "U16"),
+                       ("client_id", "i4")])
+
+TAGS_MEMBER = "__tags__"
+
+class ResultsStore:
+    """Append-only store of experiment time series.
+
+    Members are named `r<run>.<metric>.npy`, `r<run>.__tags__.npy` holding the
+    tags of the run.
+
+    Args:
+        path (str): Path of the npz file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _lock(self):
+        """Opens and locks the lock file guarding concurrent appends.
+
+        Returns:
+            file: Locked file, unlocked when closed.
+        """
+        lock = open(f"{self.path}.lock", "w", encoding="utf8")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def append(self, series, experiment, mode, k_min, iteration,
+               resolution="", client_id=None):
+        """Appends the series of a run.
+
+        Args:
+            series (dict): Values of each metric, by name.
+            experiment (str): Experiment name, e.g. "throughput".
+            mode (int): Experiment mode (0 TorK, 1 Tor, 2 direct).
+            k_min (int): K_min of the run.
+            iteration (int): Iteration index.
+            resolution (str, optional): Video resolution of streaming runs,
+                synthetic client ("client_<n>") of load generator runs.
+                Defaults to "".
+            client_id (int, optional): Client slot. Defaults to None.
+
+        Returns:
+            int: Index of the run in the store.
+        """
+        tags = np.array([(experiment, mode, k_min, iteration, resolution,
+                          -1 if client_id is None else int(client_id))],
+                        dtype=TAGS_DTYPE)
+        with self._lock():
+            run = len(self._tagged_runs())
+            with zipfile.ZipFile(self.path, "a", zipfile.ZIP_DEFLATED) as archive:
+                for metric, values in series.items():
+                    self._write(archive, f"r{run:06d}.{metric}.npy", np.asarray(values))
+                self._write(archive, f"r{run:06d}.{TAGS_MEMBER}.npy", tags)
+        print(f"Saved run {run} ({experiment}, K {k_min}, # {iteration}) to {self.path}")
+        return run
+
+    @staticmethod
+    def _write(archive, name, array):
+        """Writes an array as a npy member of the archive."""
+        with archive.open(name, "w", force_zip64=True) as member:
+            np.lib.format.write_array(member, array, allow_pickle=False)
+
+    def _tagged_runs(self):
+        """Reads the tags of every run.
+
+        Returns:
+            list: (run, tags) tuples, tags being a record of TAGS_DTYPE.
+        """
+        if not os.path.exists(self.path):
+            return []
+        runs = []
+        with np.load(self.path) as archive:
+            for name in archive.files:
+                prefix, metric = name.split(".", 1)
+                if metric == TAGS_MEMBER:
+                    runs.append((int(prefix[1:]), archive[name][0]))
+        return sorted(runs, key=lambda run: run[0])
+
+    def runs(self, **tags):
+        """Lists the runs matching the given tags.
+
+        Args:
+            **tags: Required tag values, e.g. k_min=3.
+
+        Returns:
+            list: (run, tags) tuples of the matching runs.
+        """
+        for name in tags:
+            if name not in TAGS_DTYPE.names:
+                raise ValueError(f"Unknown tag {name}")
+        return [(run, record) for run, record in self._tagged_runs()
+                if all(record[name] == value for name, value in tags.items())]
+
+    def load(self, metrics=None, **tags):
+        """Loads the series of the runs matching the given tags.
+
+        Args:
+            metrics (tuple, optional): Metrics to load. Defaults to None (all).
+            **tags: Required tag values, e.g. mode=0, k_min=3.
+
+        Returns:
+            list: (tags, series) tuples, tags being a dict and series a dict of
+                arrays by metric name.
+        """
+        selected = self.runs(**tags)
+        if not selected:
+            return []
+        results = []
+        with np.load(self.path) as archive:
+            members = {}
+            for name in archive.files:
+                prefix, metric = name.split(".", 1)
+                members.setdefault(int(prefix[1:]), []).append(metric)
+            for run, record in selected:
+                series = {metric: archive[f"r{run:06d}.{metric}"]
+                          for metric in members[run]
+                          if metric != TAGS_MEMBER and
+                          (metrics is None or metric in metrics)}
+                results.append((dict(zip(TAGS_DTYPE.names, record.tolist())),
+                                series))
+        return results
+
+def load_results(path, metrics=None, **tags):
+    """Loads runs from a results store. See `ResultsStore.load`."""
+    return ResultsStore(path).load(metrics, **tags)
@@ -0,0 +1,140 @@
+"""Bounded-disk capture module
+
+Full-packet captures of every iteration fill the disks of the client, the
+bridge and the server, while the I/O statistics only need the headers. A ring
+capture records the first `snaplen` bytes of each packet (the link, IP and
+TCP headers) into a fixed ring of files (`tcpdump -s -C -W`), so its disk
+usage is bounded whatever the duration of the experiment.
+
+tcpdump runs a hook on every file it closes, which records its name. The
+closed files are aggregated into per-interval statistics right away (see
+PcapStats, which takes the lengths from the IP header), the file being
+written last is aggregated once the capture stops. A file reused by the ring
+before being aggregated is reported, the ring being too small for the
+capture rate.
+"""
+import os
+import stat
+from pcap_stats import PcapStats
+
+# Bytes kept of each packet: Linux cooked header (SLL2), IP and TCP headers
+DEFAULT_SNAPLEN = 128
+
+def ring_options(snaplen=DEFAULT_SNAPLEN, file_size=16, files=8):
+    """tcpdump options of a header-only ring capture.
+
+    Args:
+        snaplen (int, optional): Bytes kept of each packet.
+            Defaults to DEFAULT_SNAPLEN.
+        file_size (int, optional): Size of each file in millions of bytes.
+            Defaults to 16.
+        files (int, optional): Number of files of the ring. Defaults to 8.
+
+    Returns:
+        str: Options to add to the tcpdump command.
+    """
+    return f"-s {snaplen} -C {file_size} -W {files}"
+
+def ring_file(prefix, index, files):
+    """Name given by tcpdump to a file of the ring (numbered from 0, padded
+    to the digits of `-W`, e.g. 00 to 09 with 10 files)."""
+    return f"{prefix}{index:0{len(str(files))}d}"
+
+class RingCapture:
+    """Header-only ring capture aggregated file by file.
+
+    Args:
+        prefix (str): Path prefix of the ring files.
+        ports (dict): Ports to account, by name (see `PcapStats`).
+        interface (str, optional): Capture interface. Defaults to "any".
+        snaplen (int, optional): Bytes kept of each packet.
+            Defaults to DEFAULT_SNAPLEN.
+        file_size (int, optional): Size of each file in millions of bytes.
+            Defaults to 16.
+        files (int, optional): Number of files of the ring, at least 2.
+            Defaults to 8.
+        interval (float, optional): Bucket size in seconds. Defaults to 1.
+    """
+    def __init__(self, prefix, ports, interface="any", snaplen=DEFAULT_SNAPLEN,
+                 file_size=16, files=8, interval=1.0):
+        if files < 2:
+            raise ValueError("A ring capture needs at least 2 files")
+        self.prefix = prefix
+        self.interface = interface
+        self.snaplen = snaplen
+        self.file_size = file_size
+        self.files = files
+        self.stats = PcapStats(ports, interval)
+        # tcpdump looks the hook up in PATH unless its path is absolute
+        self.closed_list = os.path.abspath(f"{prefix}.closed")
+        self.hook = os.path.abspath(f"{prefix}.rotate.sh")
+        self.aggregated = 0
+        self.overwritten = 0
+
+    def command(self):
+        """tcpdump command of the capture, with the rotation hook.
+
+        Returns:
+            list: Command and arguments.
+        """
+        # tcpdump runs the hook with the name of the file it closed
+        with open(self.hook, "w", encoding="utf8") as hook:
+            hook.write(f"#!/bin/sh\necho \"$1\" >> {self.closed_list}\n")
+        os.chmod(self.hook, os.stat(self.hook).st_mode | stat.S_IXUSR | stat.S_IXGRP
+                 | stat.S_IXOTH)
+        for index in range(self.files):
+            if os.path.exists(ring_file(self.prefix, index, self.files)):
+                os.remove(ring_file(self.prefix, index, self.files))
+        if os.path.exists(self.closed_list):
+            os.remove(self.closed_list)
+        return ["tcpdump", "-i", self.interface, *ring_options(
+                    self.snaplen, self.file_size, self.files).split(" "),
+                "-z", self.hook, "-w", self.prefix]
+
+    def _aggregate(self, path):
+        """Adds a ring file to the statistics."""
+        if os.path.exists(path):
+            self.stats.read(path)
+            self.aggregated += 1
+
+    def follow(self, stop, poll=0.2):
+        """Aggregates every file as soon as tcpdump closes it, until `stop`
+        is set, then the file written last.
+
+        Args:
+            stop (threading.Event): Set once the capture has been stopped.
+            poll (float, optional): Polling period of the closed files in
+                seconds. Defaults to 0.2.
+        """
+        closed = 0
+        while True:
+            stopped = stop.is_set()
+            names = []
+            if os.path.exists(self.closed_list):
+                with open(self.closed_list, encoding="utf8") as closed_list:
+                    names = closed_list.read().splitlines()
+            for position in range(closed, len(names)):
+                # tcpdump reopened this file once `files - 1` more were closed
+                if len(names) - position >= self.files:
+                    self.overwritten += 1
+                    continue
+                self._aggregate(names[position])
+            closed = len(names)
+            if stopped:
+                break
+            stop.wait(poll)
+        self._aggregate(ring_file(self.prefix, closed % self.files, self.files))
+        if self.overwritten:
+            print(f"Ring capture {self.prefix}: {self.overwritten} files overwritten "
+                  "before being aggregated, the ring is too small")
+
+    def series(self):
+        """Per-interval series of the capture (see `PcapStats.series`)."""
+        return self.stats.series()
+
+    def cleanup(self):
+        """Removes the ring files and the rotation hook."""
+        for path in [ring_file(self.prefix, index, self.files)
+                     for index in range(self.files)] + [self.closed_list, self.hook]:
+            if os.path.exists(path):
+                os.remove(path)
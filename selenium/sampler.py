@@ -0,0 +1,77 @@
+"""High-resolution sampling module
+
+Samples are taken on a fixed schedule of the monotonic clock, so the time
+spent collecting a sample does not delay the following ones. Every sample is
+timestamped and ticks that could not be honoured are recorded as missed
+instead of silently stretching the series.
+"""
+import threading
+import time
+
+class Sampler:
+    """Calls a function on a fixed monotonic-clock schedule.
+
+    Tick `n` is due at `start + n * resolution`. When a sample takes longer
+    than the resolution, the ticks whose deadline already passed are recorded
+    in `missed` and sampling resumes on the next due tick.
+
+    Args:
+        func (callable): Function returning the value of a sample.
+        resolution (float, optional): Interval between ticks in seconds,
+            at least MIN_RESOLUTION. Defaults to 1.0.
+        duration (float, optional): Sampling time in seconds. Defaults to None
+            (until `samples` ticks elapsed or `stop` is called).
+        samples (int, optional): Number of ticks to run. Defaults to None.
+    """
+    MIN_RESOLUTION = 0.01
+
+    def __init__(self, func, resolution=1.0, duration=None, samples=None):
+        if resolution < self.MIN_RESOLUTION:
+            raise ValueError(f"Resolution below {self.MIN_RESOLUTION}s")
+        self.func = func
+        self.resolution = resolution
+        if duration is not None:
+            samples = int(round(duration / resolution))
+        self.samples = samples
+        # Monotonic time of each sample, relative to the first tick
+        self.timestamps = []
+        # Wall-clock time of each sample, to align with pcap and iperf
+        self.wall_times = []
+        self.ticks = []
+        self.values = []
+        self.missed = []
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stops the sampling after the current tick."""
+        self._stop.set()
+
+    def run(self):
+        """Runs the sampling loop until the number of ticks is reached or
+        `stop` is called.
+
+        Returns:
+            list: Sampled values.
+        """
+        start = time.monotonic()
+        tick = 0
+        while self.samples is None or tick < self.samples:
+            delay = start + tick * self.resolution - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            if self._stop.is_set():
+                break
+
+            now = time.monotonic()
+            self.ticks.append(tick)
+            self.timestamps.append(now - start)
+            self.wall_times.append(time.time())
+            self.values.append(self.func())
+
+            # Skip (and record) the ticks overrun by this sample
+            due = int((time.monotonic() - start) / self.resolution) + 1
+            if self.samples is not None:
+                due = min(due, self.samples)
+            self.missed.extend(range(tick + 1, due))
+            tick = max(tick + 1, due)
+        return self.values
@@ -0,0 +1,143 @@
+"""Sequential stopping module
+
+Decides after every iteration of a sweep point whether more iterations are
+needed: running estimates (Welford) of the key metrics are updated with the
+iteration results, and the point stops once the Student t confidence
+interval of the mean of every metric is narrower than a target fraction of
+the mean, between a minimum and a maximum number of iterations. Stable
+configurations stop after the minimum, noisy ones get up to the maximum.
+"""
+import math
+from statistics import NormalDist
+
+# Degrees of freedom up to which the t quantile is computed exactly
+EXACT_DOF = 30
+
+def _t_central(t, dof):
+    """Probability that |T| < t, T following a Student t distribution with an
+    integer number of degrees of freedom (closed form, Abramowitz & Stegun
+    26.7.3-4)."""
+    theta = math.atan(t / math.sqrt(dof))
+    cos2 = math.cos(theta) ** 2
+    if dof % 2:
+        term = total = math.cos(theta) if dof > 1 else 0.0
+        for k in range(2, (dof - 1) // 2 + 1):
+            term *= cos2 * (2 * k - 2) / (2 * k - 1)
+            total += term
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+    term, total = 1.0, 1.0
+    for k in range(1, dof // 2):
+        term *= cos2 * (2 * k - 1) / (2 * k)
+        total += term
+    return math.sin(theta) * total
+
+def t_quantile(probability, dof):
+    """Quantile of the Student t distribution: exact (bisection on the
+    closed-form distribution) up to EXACT_DOF degrees of freedom, else the
+    Cornish-Fisher expansion around the normal quantile (within 0.01%)."""
+    if dof <= EXACT_DOF:
+        central = abs(2 * probability - 1)
+        low, high = 0.0, 1.0
+        while _t_central(high, dof) < central:
+            high *= 2
+        for _ in range(100):
+            middle = (low + high) / 2
+            if _t_central(middle, dof) < central:
+                low = middle
+            else:
+                high = middle
+        return math.copysign((low + high) / 2, probability - 0.5)
+    z = NormalDist().inv_cdf(probability)
+    return (z + (z ** 3 + z) / (4 * dof)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * dof ** 3))
+
+class RunningStats:
+    """Running mean and variance of a metric (Welford)."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        """Adds a sample."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """Sample variance, NaN below 2 samples."""
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+class SequentialStopper:
+    """Stops the iterations of a point once its metrics are precise enough.
+
+    Args:
+        metrics (tuple, optional): Names of the metrics followed.
+            Defaults to ("goodput", "latency_p99").
+        min_iterations (int, optional): Iterations always run, at least 3.
+            Defaults to 3.
+        max_iterations (int, optional): Iterations never exceeded.
+            Defaults to 10.
+        width (float, optional): Target width of the confidence interval,
+            relative to the mean. Defaults to 0.1.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+    """
+    def __init__(self, metrics=("goodput", "latency_p99"), min_iterations=3,
+                 max_iterations=10, width=0.1, confidence=0.95):
+        self.min_iterations = max(min_iterations, 3)
+        self.max_iterations = max(max_iterations, self.min_iterations)
+        self.width = width
+        self.confidence = confidence
+        self.stats = {name: RunningStats() for name in metrics}
+
+    def add(self, **values):
+        """Adds the results of an iteration, missing (None or NaN) values of
+        a metric being ignored."""
+        for name, value in values.items():
+            if name in self.stats and value is not None and math.isfinite(value):
+                self.stats[name].add(float(value))
+
+    def interval(self, name):
+        """Confidence interval of the mean of a metric.
+
+        Returns:
+            dict: "count", "mean", "low", "high" and "width" (relative to
+                the mean, NaN below 2 samples).
+        """
+        stats = self.stats[name]
+        summary = {"count": stats.count, "mean": stats.mean if stats.count else math.nan,
+                   "low": math.nan, "high": math.nan, "width": math.nan}
+        if stats.count > 1:
+            half = t_quantile(1 - (1 - self.confidence) / 2, stats.count - 1) \
+                   * math.sqrt(stats.variance / stats.count)
+            summary.update(low=stats.mean - half, high=stats.mean + half,
+                           width=2 * half / abs(stats.mean) if stats.mean else math.inf)
+        return summary
+
+    def done(self, iterations):
+        """Whether to stop after `iterations` iterations.
+
+        Metrics without samples (e.g. the goodput measured by iperf) are not
+        considered; with no sample at all the maximum is run.
+
+        Returns:
+            bool: True once the maximum is reached, or past the minimum when
+                every measured metric is within the target width.
+        """
+        if iterations >= self.max_iterations:
+            return True
+        if iterations < self.min_iterations:
+            return False
+        widths = [self.interval(name)["width"] for name, stats in self.stats.items()
+                  if stats.count]
+        return bool(widths) and all(width <= self.width for width in widths)
+
+    def status(self):
+        """Current intervals, for the logs."""
+        return ", ".join(f"{name} {summary['mean']:.4g} ±{summary['width'] / 2:.1%}"
+                         for name, summary in ((name, self.interval(name))
+                                               for name in self.stats)
+                         if summary["count"] > 1)
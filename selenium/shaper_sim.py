@@ -0,0 +1,249 @@
+#!/bin/python3
+"""TorK traffic shaping simulator module
+
+Discrete-event model of the TorK frame scheduler, vectorized over thousands
+of parameter combinations (max_chunks, chunk, ts_min, ts_max, k_min,
+ch_active) to prune a sweep grid before running it on the cluster.
+
+At every TrafficShaper tick each client sends exactly one chunk: the next
+chunk of the data frame being sent, else the first chunk of a new data frame
+if bytes are waiting, else a chaff chunk. A data frame carries up to
+`max_chunks * chunk - DATA_FRAME_HEADER` bytes and takes as many chunks as
+its size needs. The bridge orders the same period to every client,
+`n_clients * ts_min` bounded by [ts_min, ts_max] (`ts_rate_update`).
+
+The offered load arrives as bursts of bytes (compound Poisson), calibrated
+from recorded `stats_bytes` series. Data frames are delivered to Tor once
+every client of the K-group sent a frame, which adds the expected maximum of
+the group arrival jitter, calibrated from `stats_frames` reception queues.
+
+For every combination the model predicts the goodput, the chaff overhead
+(no-data bytes per data byte, as in `stats_bytes`), the queueing delay
+(Little's law on the backlog, plus transmission and synchronization) and
+whether the load saturates the shaper.
+"""
+import json
+from argparse import ArgumentParser
+import numpy as np
+from sweep import grid_points
+from results_store import load_results
+
+# Size of the data frame header (chunks and size fields), see Frame.cc
+DATA_FRAME_HEADER = 6
+
+# Ctrl frames exchanged to activate a channel started inactive
+ACTIVATION_TICKS = 2
+
+PARAMETERS = ("max_chunks", "chunk", "ts_min", "ts_max", "k_min", "ch_active")
+
+DEFAULTS = {"max_chunks": 1, "chunk": 3125, "ts_min": 1667, "ts_max": 5001,
+            "k_min": 3, "ch_active": 1}
+
+def _simulate_group(columns, users, load, ticks, burst, exponential, rng):
+    """Simulates combinations sharing the same number of clients.
+
+    Returns:
+        dict: Raw totals of the group ("elapsed", "delivered", "data_chunks",
+            "backlog_mean", "backlog_end"), by combination.
+    """
+    count = len(columns["chunk"])
+    period = np.clip(users * columns["ts_min"], columns["ts_min"],
+                     columns["ts_max"]) * 1e-6
+    chunk = columns["chunk"][:, None]
+    capacity = np.maximum(columns["max_chunks"] * columns["chunk"] - DATA_FRAME_HEADER,
+                          1)[:, None]
+    # Channels started inactive only send data after the activation exchange
+    holdoff = np.where(columns["ch_active"] > 0, 0, ACTIVATION_TICKS)[:, None]
+
+    backlog = np.zeros((count, users), dtype=np.int64)
+    remaining = np.zeros((count, users), dtype=np.int64)
+    payload = np.zeros((count, users), dtype=np.int64)
+    delivered = np.zeros((count, users), dtype=np.int64)
+    data_chunks = np.zeros((count, users), dtype=np.int64)
+    backlog_total = np.zeros(count)
+    elapsed = np.zeros(count)
+    bursts = np.broadcast_to(((load / burst) * period)[:, None], (count, users))
+
+    for tick in range(ticks):
+        if exponential:
+            scale = 1 + rng.exponential(1 / 20, count)
+            elapsed += period * scale
+            arrivals = rng.poisson(bursts * scale[:, None])
+        else:
+            elapsed += period
+            arrivals = rng.poisson(bursts)
+        backlog += (arrivals * burst).astype(np.int64)
+        # Start a new data frame where none is in flight
+        start = (remaining == 0) & (backlog > 0) & (tick >= holdoff)
+        size = np.where(start, np.minimum(backlog, capacity), 0)
+        backlog -= size
+        payload = np.where(start, size, payload)
+        remaining = np.where(start, -(-(size + DATA_FRAME_HEADER) // chunk), remaining)
+        # One chunk per client and tick: data if a frame is in flight
+        sending = remaining > 0
+        remaining -= sending
+        data_chunks += sending
+        delivered += np.where(sending & (remaining == 0), payload, 0)
+        backlog_total += backlog.mean(axis=1)
+
+    return {"period": period, "elapsed": elapsed, "delivered": delivered.sum(axis=1),
+            "data_chunks": data_chunks.sum(axis=1), "backlog_mean": backlog_total / ticks,
+            "backlog_end": backlog.mean(axis=1)}
+
+def simulate(points, load, clients=None, ticks=2000, burst=512.0, jitter=0.0,
+             exponential=False, seed=0):
+    """Simulates the shaper for several parameter combinations at once.
+
+    Args:
+        points (list): Parameter combinations (dicts, see PARAMETERS),
+            missing parameters take the TorK defaults.
+        load (float): Offered load per client, in bytes/s.
+        clients (int, optional): Clients connected to the bridge. Defaults
+            to None (k_min of each combination).
+        ticks (int, optional): Simulated ticks. Defaults to 2000.
+        burst (float, optional): Mean size of the arrival bursts in bytes.
+            Defaults to 512.
+        jitter (float, optional): Mean arrival jitter of the frames of a
+            K-group at the bridge, in seconds. Defaults to 0.
+        exponential (bool, optional): Whether the shaper adds exponential
+            jitter to the period (TS_STRATEGY_EXPONENT). Defaults to False.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Parameter columns plus, by combination, the "period" (s),
+            "goodput" per client (bytes/s), "overhead", "delay" (s),
+            "utilization" (fraction of data chunks), "startup" (s until the
+            first data chunk) and "saturated".
+    """
+    rng = np.random.default_rng(seed)
+    columns = {name: np.array([point.get(name, DEFAULTS[name]) for point in points],
+                              dtype=np.int64) for name in PARAMETERS}
+    count = len(points)
+    users = columns["k_min"] if clients is None else np.full(count, clients)
+    raw = {name: np.zeros(count) for name in ("period", "elapsed", "delivered",
+                                               "data_chunks", "backlog_mean",
+                                               "backlog_end")}
+    # Combinations with the same number of clients share array shapes
+    for group in np.unique(users):
+        members = np.flatnonzero(users == group)
+        totals = _simulate_group({name: values[members] for name, values in columns.items()},
+                                 int(group), load, ticks, burst, exponential, rng)
+        for name, values in totals.items():
+            raw[name][members] = values
+
+    chunk = columns["chunk"]
+    capacity = np.maximum(columns["max_chunks"] * chunk - DATA_FRAME_HEADER, 1)
+    period = raw["period"]
+    delivered = raw["delivered"]
+    goodput = delivered / users / raw["elapsed"]
+    chaff = (ticks * users - raw["data_chunks"]) * chunk
+    overhead = np.divide(chaff, delivered, out=np.full(count, np.inf),
+                         where=delivered > 0)
+    chunks_per_frame = -(-(np.minimum(burst, capacity) + DATA_FRAME_HEADER) // chunk)
+    # Expected maximum of K exponential jitters, minus the mean one
+    harmonic = np.array([np.sum(1 / np.arange(1, k + 1)) for k in users])
+    delay = raw["backlog_mean"] / max(load, 1e-9) + chunks_per_frame * period \
+            + jitter * (harmonic - 1)
+    # The backlog kept growing: the load exceeds what the shaper can send
+    saturated = raw["backlog_end"] > 10 * capacity
+    holdoff = np.where(columns["ch_active"] > 0, 0, ACTIVATION_TICKS)
+    results = dict(columns)
+    results.update(period=period, goodput=goodput, overhead=overhead, delay=delay,
+                   utilization=raw["data_chunks"] / (ticks * users),
+                   startup=(holdoff + 1) * period, saturated=saturated)
+    return results
+
+def calibrate(stats, frames=None, period=None):
+    """Estimates the model inputs from recorded series.
+
+    Args:
+        stats (dict): `stats_bytes` series of a client (see
+            `Performance.collect_tork_insights`), with "timestamps" and the
+            "tor_bytes_received" from Tor since the previous sample (TorK
+            resets its counters on every read).
+        frames (dict, optional): Bridge `stats_frames` series (see
+            `FrameStatsCollector.series`). Defaults to None.
+        period (float, optional): Shaper period of the recording, in
+            seconds, to convert the reception backlog into jitter.
+
+    Returns:
+        dict: Offered "load" (bytes/s), mean "burst" size (bytes, the index
+            of dispersion of the per-sample arrivals) and "jitter" (s).
+    """
+    times = np.asarray(stats["timestamps"], dtype=np.float64)
+    # The first sample covers the time since an earlier read
+    received = np.asarray(stats["tor_bytes_received"], dtype=np.float64)[1:]
+    intervals = np.diff(times)
+    valid = (intervals > 0) & (received >= 0)
+    load = received[valid].sum() / intervals[valid].sum() if valid.any() else 0.0
+    mean = received[valid].mean() if valid.any() else 0.0
+    burst = received[valid].var() / mean if mean > 0 else 512.0
+    jitter = 0.0
+    if frames is not None and period:
+        depth = np.asarray(frames["reception_depth"], dtype=np.float64)
+        spread = np.nanmax(depth, axis=1) - np.nanmin(depth, axis=1)
+        jitter = float(np.nanmean(spread)) * period if np.isfinite(spread).any() else 0.0
+    return {"load": float(load), "burst": float(max(burst, 1.0)), "jitter": jitter}
+
+def prune(results, min_goodput=None, max_overhead=None, max_delay=None):
+    """Selects the combinations worth running.
+
+    Returns:
+        np.ndarray: Boolean mask of the combinations meeting every bound and
+            not saturated.
+    """
+    keep = ~results["saturated"]
+    if min_goodput is not None:
+        keep &= results["goodput"] >= min_goodput
+    if max_overhead is not None:
+        keep &= results["overhead"] <= max_overhead
+    if max_delay is not None:
+        keep &= results["delay"] <= max_delay
+    return keep
+
+def main():
+    """Parses the simulator arguments, simulates a grid and writes the
+    combinations worth running.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--grid", type=str, required=True)
+    parser.add_argument("--load", type=float, default=None)
+    parser.add_argument("--results", type=str, default=None)
+    parser.add_argument("--k_min", type=int, default=None)
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--min_goodput", type=float, default=None)
+    parser.add_argument("--max_overhead", type=float, default=None)
+    parser.add_argument("--max_delay", type=float, default=None)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    with open(args.grid, encoding="utf8") as grid:
+        points = grid_points(json.load(grid))
+    model = {"load": args.load or 0.0, "burst": 512.0, "jitter": 0.0}
+    if args.results:
+        runs = load_results(args.results, experiment="throughput", mode=0,
+                            **({"k_min": args.k_min} if args.k_min else {}))
+        frames = load_results(args.results, experiment="frames_bridge", mode=0)
+        if runs:
+            model = calibrate(runs[-1][1], frames[-1][1] if frames else None,
+                              DEFAULTS["ts_min"] * 1e-6)
+            if args.load:
+                model["load"] = args.load
+    print(f"Model: {model}")
+
+    results = simulate(points, model["load"], ticks=args.ticks, burst=model["burst"],
+                       jitter=model["jitter"])
+    keep = prune(results, args.min_goodput, args.max_overhead, args.max_delay)
+    print("max_chunks\tchunk\tts_min\tts_max\tk_min\tch_active\t"
+          "goodput (kB/s)\toverhead\tdelay (ms)")
+    for index in np.flatnonzero(keep):
+        print("\t".join(str(results[name][index]) for name in PARAMETERS) +
+              f"\t{results['goodput'][index] / 1000:.1f}"
+              f"\t{results['overhead'][index]:.2f}\t{results['delay'][index] * 1000:.1f}")
+    print(f"{keep.sum()} of {len(points)} combinations kept")
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output:
+            json.dump([points[index] for index in np.flatnonzero(keep)], output, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""SOCKS5 connection module
+
+Minimal SOCKS5 (RFC 1928) client used by the native workloads to open
+streams through the Tor/TorK SOCKS port, both for asyncio and blocking
+sockets. Only the no-authentication method and the CONNECT command with a
+domain name are used, so the name is resolved by Tor (as with socks5h).
+"""
+import asyncio
+import socket
+import struct
+import time
+
+SOCKS_VERSION = 5
+NO_AUTHENTICATION = 0
+CMD_CONNECT = 1
+ATYP_IPV4 = 1
+ATYP_DOMAIN = 3
+ATYP_IPV6 = 4
+
+REPLIES = {1: "general SOCKS server failure",
+           2: "connection not allowed by ruleset",
+           3: "network unreachable",
+           4: "host unreachable",
+           5: "connection refused",
+           6: "TTL expired",
+           7: "command not supported",
+           8: "address type not supported"}
+
+class SocksError(Exception):
+    """SOCKS5 negotiation failed
+
+    Args:
+        Exception (_type_):
+    """
+
+def _connect_request(host, port):
+    """Builds the CONNECT request of a destination."""
+    name = host.encode()
+    return struct.pack("!BBBBB", SOCKS_VERSION, CMD_CONNECT, 0, ATYP_DOMAIN,
+                       len(name)) + name + struct.pack("!H", int(port))
+
+def _check_method(reply):
+    """Validates the method selection reply."""
+    if reply[0] != SOCKS_VERSION or reply[1] != NO_AUTHENTICATION:
+        raise SocksError("SOCKS5 proxy refused the no-authentication method")
+
+def _bound_address_len(header):
+    """Validates a CONNECT reply header and returns the length of the bound
+    address and port following it."""
+    if header[1] != 0:
+        raise SocksError(REPLIES.get(header[1], f"SOCKS5 error {header[1]}"))
+    if header[3] == ATYP_IPV4:
+        return 4 + 2
+    if header[3] == ATYP_IPV6:
+        return 16 + 2
+    if header[3] == ATYP_DOMAIN:
+        return None
+    raise SocksError(f"Invalid SOCKS5 address type {header[3]}")
+
+class Timings:
+    """Setup timings of a stream, in seconds.
+
+    Attributes:
+        connect: TCP connect to the proxy (or the destination when direct).
+        handshake: SOCKS5 negotiation up to the CONNECT reply, which for Tor
+            includes the stream attach to a circuit.
+    """
+    def __init__(self):
+        self.connect = 0.0
+        self.handshake = 0.0
+
+async def open_connection(host, port, proxy=None, timeout=60, timings=None):
+    """Opens an asyncio stream to a destination, through a SOCKS5 proxy.
+
+    Args:
+        host (str): Destination hostname or IP address.
+        port (int): Destination port.
+        proxy (tuple, optional): (host, port) of the SOCKS5 proxy. Defaults to
+            None (direct connection).
+        timeout (int, optional): Setup timeout in seconds. Defaults to 60.
+        timings (Timings, optional): Filled with the setup timings.
+
+    Returns:
+        (StreamReader, StreamWriter): Stream to the destination.
+    """
+    timings = timings if timings is not None else Timings()
+    start = time.perf_counter()
+    if proxy is None:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port)), timeout)
+        timings.connect = time.perf_counter() - start
+        return reader, writer
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(proxy[0], int(proxy[1])), timeout)
+    timings.connect = time.perf_counter() - start
+    try:
+        writer.write(struct.pack("!BBB", SOCKS_VERSION, 1, NO_AUTHENTICATION))
+        _check_method(await asyncio.wait_for(reader.readexactly(2), timeout))
+        writer.write(_connect_request(host, port))
+        header = await asyncio.wait_for(reader.readexactly(4), timeout)
+        length = _bound_address_len(header)
+        if length is None:
+            length = (await reader.readexactly(1))[0] + 2
+        await reader.readexactly(length)
+    except BaseException:
+        writer.close()
+        raise
+    timings.handshake = time.perf_counter() - start - timings.connect
+    return reader, writer
+
+def _recv_exactly(sock, size):
+    """Receives exactly `size` bytes from a blocking socket."""
+    data = bytearray()
+    while len(data) < size:
+        part = sock.recv(size - len(data))
+        if not part:
+            raise SocksError("SOCKS5 proxy closed the connection")
+        data += part
+    return bytes(data)
+
+def create_connection(host, port, proxy=None, timeout=60, timings=None):
+    """Opens a blocking socket to a destination, through a SOCKS5 proxy.
+
+    Args:
+        host (str): Destination hostname or IP address.
+        port (int): Destination port.
+        proxy (tuple, optional): (host, port) of the SOCKS5 proxy. Defaults to
+            None (direct connection).
+        timeout (int, optional): Socket timeout in seconds. Defaults to 60.
+        timings (Timings, optional): Filled with the setup timings.
+
+    Returns:
+        socket.socket: Connected socket.
+    """
+    timings = timings if timings is not None else Timings()
+    start = time.perf_counter()
+    sock = socket.create_connection(proxy if proxy else (host, int(port)),
+                                    timeout=timeout)
+    timings.connect = time.perf_counter() - start
+    if proxy is None:
+        return sock
+    try:
+        sock.sendall(struct.pack("!BBB", SOCKS_VERSION, 1, NO_AUTHENTICATION))
+        _check_method(_recv_exactly(sock, 2))
+        sock.sendall(_connect_request(host, port))
+        header = _recv_exactly(sock, 4)
+        length = _bound_address_len(header)
+        if length is None:
+            length = _recv_exactly(sock, 1)[0] + 2
+        _recv_exactly(sock, length)
+    except BaseException:
+        sock.close()
+        raise
+    timings.handshake = time.perf_counter() - start - timings.connect
+    return sock
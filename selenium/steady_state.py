@@ -0,0 +1,188 @@
+"""Steady-state detection module
+
+Online detection of the warm-up and of the steady state of a rate series
+(e.g. the bytes delivered by TorK every sample), one sample at a time, so a
+measurement can end as soon as enough steady-state data was collected:
+
+* warm-up: it ends once the means of the last two windows of samples agree
+  within `tolerance` (the rate stopped ramping up while the shaper and the
+  K-group synchronize), with traffic above `min_level`;
+* steady state: a two-sided CUSUM on the samples, normalized by their
+  standard deviation, detects a shift of the rate. The samples since the
+  change started are labelled as a transient and the warm-up test starts
+  over from there;
+* the measurement is complete once the current steady segment has
+  `steady_samples` samples.
+
+Samples are labelled WARMUP, STEADY or TRANSIENT, so the averages can be
+computed on the steady state and the transients reported separately.
+"""
+import math
+import numpy as np
+
+WARMUP = 0
+STEADY = 1
+TRANSIENT = 2
+
+LABELS = {WARMUP: "warmup", STEADY: "steady", TRANSIENT: "transient"}
+
+class SteadyStateDetector:
+    """Labels the samples of a rate series as they arrive.
+
+    Args:
+        window (int, optional): Samples of each window compared to end a
+            warm-up. Defaults to 10.
+        tolerance (float, optional): Relative difference of the window means
+            ending a warm-up, and smallest relative shift of the steady
+            state detected. Defaults to 0.1.
+        steady_samples (int, optional): Steady samples completing the
+            measurement. Defaults to 100.
+        min_warmup (int, optional): Samples always labelled as warm-up.
+            Defaults to 0.
+        threshold (float, optional): CUSUM decision threshold, in standard
+            deviations. Defaults to 5.
+        min_level (float, optional): Window mean above which the rate can be
+            steady, so an idle start is not taken as steady. Defaults to 0.
+    """
+    def __init__(self, window=10, tolerance=0.1, steady_samples=100, min_warmup=0,
+                 threshold=5.0, min_level=0.0):
+        self.window = window
+        self.tolerance = tolerance
+        self.steady_samples = steady_samples
+        self.min_warmup = min_warmup
+        self.threshold = threshold
+        self.min_level = min_level
+        self.values = []
+        self.labels = []
+        self.changes = []
+        self.state = WARMUP
+        # First sample of the current segment (warm-up or transient)
+        self._segment = 0
+        self._reset_steady()
+
+    def _reset_steady(self):
+        """Clears the estimates of the steady segment."""
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._high = 0.0
+        self._low = 0.0
+        # Last sample where each CUSUM was zero, the change start estimate
+        self._high_start = 0
+        self._low_start = 0
+
+    def _estimate(self, value):
+        """Updates the mean and variance of the steady segment (Welford)."""
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+
+    @property
+    def steady_start(self):
+        """Index of the first sample of the current steady segment, None
+        outside the steady state."""
+        return len(self.values) - self._count if self.state == STEADY else None
+
+    @property
+    def finished(self):
+        """Whether the current steady segment has enough samples."""
+        return self.state == STEADY and self._count >= self.steady_samples
+
+    def add(self, value):
+        """Adds the next sample.
+
+        Returns:
+            int: State after the sample (WARMUP, STEADY or TRANSIENT).
+        """
+        index = len(self.values)
+        self.values.append(float(value))
+        if self.state != STEADY:
+            self.labels.append(self.state)
+            self._try_settle(index)
+            return self.state
+
+        self.labels.append(STEADY)
+        # Standardized deviation from the steady mean, the allowance being
+        # at least half the smallest shift of interest
+        deviation = math.sqrt(self._m2 / (self._count - 1)) if self._count > 1 else 0.0
+        scale = max(deviation, self.tolerance * abs(self._mean), 1e-12)
+        score = (value - self._mean) / scale
+        allowance = max(0.5, self.tolerance * abs(self._mean) / (2 * scale))
+        self._high = max(0.0, self._high + score - allowance)
+        self._low = max(0.0, self._low - score - allowance)
+        if self._high == 0.0:
+            self._high_start = index + 1
+        if self._low == 0.0:
+            self._low_start = index + 1
+        if max(self._high, self._low) > self.threshold:
+            start = self._high_start if self._high > self._low else self._low_start
+            for position in range(start, index + 1):
+                self.labels[position] = TRANSIENT
+            self.changes.append(start)
+            self.state = TRANSIENT
+            self._segment = start
+            self._reset_steady()
+            self._try_settle(index)
+            return self.state
+        self._estimate(value)
+        return self.state
+
+    def _try_settle(self, index):
+        """Ends the warm-up or transient when the last two windows agree."""
+        start = max(self._segment, self.min_warmup)
+        if index + 1 - start < 2 * self.window:
+            return
+        values = self.values[index + 1 - 2 * self.window:index + 1]
+        before = sum(values[:self.window]) / self.window
+        after = sum(values[self.window:]) / self.window
+        if after <= self.min_level or abs(after - before) > self.tolerance * abs(after):
+            return
+        # The last window is the start of the steady segment
+        self.state = STEADY
+        self._reset_steady()
+        first = index + 1 - self.window
+        self._high_start = self._low_start = index + 1
+        for position in range(first, index + 1):
+            self.labels[position] = STEADY
+            self._estimate(self.values[position])
+
+    def summary(self, interval=1.0):
+        """Summarizes the labelled series.
+
+        Args:
+            interval (float, optional): Time between samples in seconds.
+                Defaults to 1.
+
+        Returns:
+            dict: "warmup_time" (s, until the first steady sample, NaN if
+                never steady), mean rate ("<label>_rate") and count
+                ("<label>_samples") of the "warmup", "steady" and "transient"
+                samples, and the number of "changes" detected.
+        """
+        values = np.array(self.values)
+        labels = np.array(self.labels, dtype=np.int8)
+        steady = np.flatnonzero(labels == STEADY)
+        summary = {"warmup_time": float(steady[0] * interval) if len(steady) else np.nan,
+                   "changes": len(self.changes)}
+        for label, name in LABELS.items():
+            selected = values[labels == label]
+            summary[f"{name}_rate"] = float(selected.mean()) if len(selected) else np.nan
+            summary[f"{name}_samples"] = len(selected)
+        return summary
+
+def label_series(values, **kwargs):
+    """Labels a recorded series offline.
+
+    Args:
+        values (array-like): Rate samples.
+        **kwargs: See `SteadyStateDetector`.
+
+    Returns:
+        SteadyStateDetector: Detector fed with every sample, see `labels`
+            and `summary`.
+    """
+    detector = SteadyStateDetector(**kwargs)
+    for value in values:
+        detector.add(value)
+    return detector
@@ -0,0 +1,275 @@
+#!/bin/python3
+"""Streaming QoE benchmark module
+
+Native replacement of the VLC streaming experiment: the target HTTP server
+(see targets.py) sends a paced constant or variable bitrate stream of framed
+chunks, one every 100 ms of "video", and this receiver reads it through the
+SOCKS port without decoding anything. A player is modelled on the chunk
+arrival times:
+
+* playback starts once `startup` seconds of video are buffered (startup
+  delay, counted from the request);
+* a chunk arriving after its playback time stalls the playback until
+  `rebuffer` seconds of video are buffered again (stall count and duration);
+* the arrival jitter is the RFC 3550 interarrival jitter, from the send times
+  carried by the chunks, so the clocks of both ends need not be in sync.
+
+The bitrate profiles are equivalent to the 480p, 720p and 1080p samples of
+the VLC experiment.
+"""
+import socket
+import time
+from argparse import ArgumentParser
+import numpy as np
+import socks5
+from targets import HTTP_PORT, CHUNK_HEADER, STREAM_CHUNK_TIME
+
+# Mean video bitrate of each resolution, in bit/s
+PROFILES = {"480p": 1_000_000, "720p": 2_500_000, "1080p": 5_000_000}
+
+BUFFER_SIZE = 256 * 1024
+
+class StreamingTest:
+    """Receives a paced stream and measures the playback quality.
+
+    Args:
+        host (str): Target HTTP server hostname.
+        port (int, optional): Target HTTP server port. Defaults to HTTP_PORT.
+        profile (str, optional): Resolution of PROFILES. Defaults to "720p".
+        bitrate (int, optional): Bitrate in bit/s, overriding the profile.
+            Defaults to None.
+        duration (float, optional): Seconds of video. Defaults to 60.
+        vbr (float, optional): Log-normal spread of the chunk sizes, 0 for a
+            constant bitrate. Defaults to 0.
+        socks_port (int, optional): SOCKS port. Defaults to None (direct).
+        socks_host (str, optional): SOCKS host. Defaults to "127.0.0.1".
+        startup (float, optional): Seconds of video buffered before playback
+            starts. Defaults to 2.
+        rebuffer (float, optional): Seconds of video buffered before playback
+            resumes after a stall. Defaults to 1.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 30.
+    """
+    def __init__(self, host, port=HTTP_PORT, profile="720p", bitrate=None, duration=60,
+                 vbr=0.0, socks_port=None, socks_host="127.0.0.1", startup=2.0,
+                 rebuffer=1.0, timeout=30):
+        self.host = host
+        self.port = port
+        self.profile = profile
+        self.bitrate = bitrate or PROFILES[profile]
+        self.duration = duration
+        self.vbr = vbr
+        self.proxy = (socks_host, socks_port) if socks_port else None
+        self.startup = startup
+        self.rebuffer = rebuffer
+        self.timeout = timeout
+        chunks = int(np.ceil(duration / STREAM_CHUNK_TIME))
+        self.arrival = np.full(chunks, np.nan)
+        self.sent = np.full(chunks, np.nan)
+        self.size = np.zeros(chunks, dtype=np.int64)
+        self.received = 0
+        self.request_time = None
+        self.response_time = None
+        self.setup = None
+        self.errors = []
+        self._pending = bytearray()
+
+    def _recv_into(self, sock, view):
+        """Receives into `view`, the bytes read with the response header
+        first."""
+        if self._pending:
+            size = min(len(view), len(self._pending))
+            view[:size] = self._pending[:size]
+            del self._pending[:size]
+            return size
+        return sock.recv_into(view)
+
+    def _receive(self, sock):
+        """Reads the framed chunks, recording the arrival of their last byte."""
+        header = memoryview(bytearray(CHUNK_HEADER.size))
+        buffer = memoryview(bytearray(BUFFER_SIZE))
+        while True:
+            filled = 0
+            while filled < CHUNK_HEADER.size:
+                size = self._recv_into(sock, header[filled:])
+                if not size:
+                    return
+                filled += size
+            index, payload, sent = CHUNK_HEADER.unpack(header)
+            remaining = payload
+            while remaining > 0:
+                size = self._recv_into(sock, buffer[:min(remaining, BUFFER_SIZE)])
+                if not size:
+                    return
+                remaining -= size
+            if index < len(self.arrival):
+                self.arrival[index] = time.monotonic()
+                self.sent[index] = sent
+                self.size[index] = payload + CHUNK_HEADER.size
+                self.received += 1
+
+    def run(self):
+        """Requests the stream and receives it until its end.
+
+        Returns:
+            dict: See `report`.
+        """
+        sock = None
+        try:
+            timings = socks5.Timings()
+            sock = socks5.create_connection(self.host, self.port, proxy=self.proxy,
+                                            timeout=self.timeout, timings=timings)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SIZE)
+            self.setup = timings.connect + timings.handshake
+            self.request_time = time.monotonic()
+            sock.sendall(f"GET /stream/{self.bitrate}?duration={self.duration}"
+                         f"&vbr={self.vbr}&framed=1 HTTP/1.1\r\n"
+                         f"Host: {self.host}\r\n\r\n".encode())
+            response = b""
+            while b"\r\n\r\n" not in response:
+                part = sock.recv(4096)
+                if not part:
+                    raise ConnectionError("Stream closed before the response header")
+                response += part
+            self.response_time = time.monotonic()
+            header, _, leftover = response.partition(b"\r\n\r\n")
+            if not header.startswith(b"HTTP/1.1 200"):
+                raise ConnectionError(f"Stream refused: {header.splitlines()[0]!r}")
+            self._pending = bytearray(leftover)
+            self._receive(sock)
+        except (OSError, ValueError, socks5.SocksError) as exception:
+            self.errors.append(repr(exception))
+        finally:
+            if sock is not None:
+                sock.close()
+        return self.report()
+
+    def playback(self):
+        """Plays the received chunks back.
+
+        Returns:
+            dict: Playback "start" (monotonic time, NaN if it never started),
+                "stalls" (start times), "stall_durations" and the "buffer" of
+                video (seconds) left when each chunk arrived.
+        """
+        arrival = self.arrival
+        count = len(arrival)
+        startup = min(max(int(np.ceil(self.startup / STREAM_CHUNK_TIME)), 1), count)
+        rebuffer = max(int(np.ceil(self.rebuffer / STREAM_CHUNK_TIME)), 1)
+        # A chunk is playable once every previous chunk arrived
+        ready = np.fmax.accumulate(np.where(np.isnan(arrival), np.inf, arrival))
+        start = ready[startup - 1]
+        stalls, durations = [], []
+        # Playback time of each chunk
+        plays = np.full(count, np.inf)
+        if np.isfinite(start):
+            delay = 0.0
+            for index in range(count):
+                due = start + index * STREAM_CHUNK_TIME + delay
+                if ready[index] > due:
+                    resume = ready[min(index + rebuffer - 1, count - 1)]
+                    if not np.isfinite(resume):
+                        # The stream ended during the stall
+                        break
+                    stalls.append(due)
+                    durations.append(resume - due)
+                    delay += resume - due
+                    due = resume
+                plays[index] = due
+        # Video received but not played yet when each chunk arrived
+        played = np.searchsorted(plays, ready, side="right")
+        buffer = (np.arange(1, count + 1) - played) * STREAM_CHUNK_TIME
+        return {"start": start if np.isfinite(start) else np.nan,
+                "stalls": np.array(stalls), "stall_durations": np.array(durations),
+                "buffer": np.where(np.isfinite(ready), buffer, np.nan)}
+
+    def jitter(self):
+        """Interarrival jitter (RFC 3550) after each chunk, in seconds."""
+        valid = ~np.isnan(self.arrival)
+        transit = self.arrival[valid] - self.sent[valid]
+        jitter = np.zeros(len(transit))
+        for index in range(1, len(transit)):
+            deviation = abs(transit[index] - transit[index - 1])
+            jitter[index] = jitter[index - 1] + (deviation - jitter[index - 1]) / 16
+        series = np.full(len(self.arrival), np.nan)
+        series[valid] = jitter
+        return series
+
+    def report(self):
+        """Summarizes the playback quality.
+
+        Returns:
+            dict: "startup_delay" (request to playback start), "stalls",
+                "stall_time" (total seconds stalled), "jitter" (final RFC 3550
+                estimate) and "jitter_p99" (99th percentile of the transit
+                variation between consecutive chunks), "bitrate" (effective
+                bit/s), chunks "received" out of "expected", with the stream
+                setup time and errors.
+        """
+        playback = self.playback()
+        valid = ~np.isnan(self.arrival)
+        transit = self.arrival[valid] - self.sent[valid]
+        jitter = self.jitter()
+        first = self.response_time if self.response_time is not None else np.nan
+        span = np.nanmax(self.arrival) - first if valid.any() else np.nan
+        return {"profile": self.profile, "target_bitrate": self.bitrate,
+                "startup_delay": float(playback["start"] - self.request_time)
+                                 if self.request_time is not None else np.nan,
+                "stalls": len(playback["stalls"]),
+                "stall_time": float(playback["stall_durations"].sum()),
+                "jitter": float(jitter[valid][-1]) if valid.any() else np.nan,
+                "jitter_p99": float(np.percentile(np.abs(np.diff(transit)), 99))
+                              if len(transit) > 1 else np.nan,
+                "bitrate": float(self.size[valid].sum() * 8 / span)
+                           if valid.any() and span > 0 else 0.0,
+                "received": int(self.received), "expected": len(self.arrival),
+                "setup": self.setup, "errors": self.errors}
+
+    def series(self):
+        """Per chunk series.
+
+        Returns:
+            dict: "arrival" (seconds since the request), "sent" (seconds since
+                the start of the stream), "size" (bytes), "jitter", "buffer"
+                (seconds of video buffered) and the "stalls" start times
+                (since the request) with their "stall_durations".
+        """
+        origin = self.request_time or 0.0
+        playback = self.playback()
+        return {"arrival": self.arrival - origin, "sent": self.sent, "size": self.size,
+                "jitter": self.jitter(), "buffer": playback["buffer"],
+                "stalls": playback["stalls"] - origin,
+                "stall_durations": playback["stall_durations"]}
+
+def print_report(report):
+    """Prints a QoE report."""
+    print(f"{report['profile']} ({report['target_bitrate'] / 1000:.0f} kbit/s): "
+          f"startup {report['startup_delay']:.2f} s, {report['stalls']} stalls "
+          f"({report['stall_time']:.2f} s), jitter {report['jitter'] * 1000:.1f} ms "
+          f"(p99 {report['jitter_p99'] * 1000:.1f} ms), "
+          f"{report['bitrate'] / 1000:.0f} kbit/s, "
+          f"{report['received']}/{report['expected']} chunks")
+    for error in report["errors"]:
+        print(f"  error: {error}")
+
+def main():
+    """Parses the benchmark arguments and streams every profile.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, required=True)
+    parser.add_argument("--port", type=int, default=HTTP_PORT)
+    parser.add_argument("--socks_port", type=int, default=9050)
+    parser.add_argument("--profiles", type=str, nargs="+", default=list(PROFILES),
+                        choices=list(PROFILES))
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--vbr", type=float, default=0.0)
+    parser.add_argument("--startup", type=float, default=2.0)
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        test = StreamingTest(args.host, args.port, profile, duration=args.duration,
+                             vbr=args.vbr, socks_port=args.socks_port or None,
+                             startup=args.startup)
+        print_report(test.run())
+
+if __name__ == '__main__':
+    main()
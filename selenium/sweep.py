@@ -0,0 +1,323 @@
+"""Parameter sweep scheduler module
+
+Runs an experiment over the points of a parameter grid (mode, k_min, chunk,
+ts_min/ts_max, max_chunks, ch_active...) and records the progress in a
+checkpoint journal shared by every client slot:
+
+* Each event (point claimed, iteration done, point completed or failed) is
+  one JSON line appended under an exclusive lock and fsync'ed, so the journal
+  is never left half written: the torn line of a crashed slot is ignored, and
+  terminated by the next event so it cannot swallow it.
+* Replaying the journal gives the state of every point, so a restarted slot
+  resumes its own point at the first iteration not done yet.
+* Slots (TASK_SLOT) claim the next free point, so independent points run in
+  parallel. Points sharing a global resource (e.g. the number of vanilla Tor
+  clients scaled for mode 1) are never claimed by two slots at once.
+* A failed point is claimed again, resuming its iterations, up to a number
+  of retries; past that it stays failed and is reported at the end.
+"""
+import fcntl
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+PENDING = "pending"
+CLAIMED = "claimed"
+COMPLETED = "completed"
+FAILED = "failed"
+
+def grid_points(grid):
+    """Expands a parameter grid.
+
+    Args:
+        grid (dict): List of values of each parameter (scalars are taken as
+            a single value). A list of points is taken as is, e.g. a grid
+            pruned by shaper_sim.py.
+
+    Returns:
+        list: Points (dicts), the last parameter varying fastest.
+    """
+    if isinstance(grid, list):
+        return [dict(point) for point in grid]
+    names = list(grid)
+    values = [value if isinstance(value, (list, tuple, range)) else [value]
+              for value in grid.values()]
+    return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+def point_key(point):
+    """Canonical key of a point, independent of the parameter order."""
+    return ",".join(f"{name}={point[name]}" for name in sorted(point))
+
+class SweepJournal:
+    """Append-only journal of the sweep events.
+
+    Args:
+        path (str): Path of the journal (JSON lines).
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _lock(self):
+        """Opens and locks the lock file guarding the journal.
+
+        Returns:
+            file: Locked file, unlocked when closed.
+        """
+        lock = open(f"{self.path}.lock", "w", encoding="utf8")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _append(self, event):
+        """Appends an event, the caller holding the lock."""
+        event["time"] = time.time()
+        line = (json.dumps(event, sort_keys=True) + "\n").encode()
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # Terminate the torn line of a crashed slot, so the event is not
+            # joined onto it
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                line = b"\n" + line
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _events(self):
+        """Reads every complete event, the caller holding the lock."""
+        if not os.path.exists(self.path):
+            return []
+        events = []
+        with open(self.path, "rb") as journal:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    # Torn write of a crashed slot, not terminated yet
+                    break
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
+
+    @contextmanager
+    def transaction(self):
+        """Locks the journal for an atomic read-modify-write.
+
+        Yields:
+            (dict, callable): State of every point (see `state`) and a
+                function appending an event under the same lock.
+        """
+        with self._lock():
+            yield self._replay(self._events()), self._append
+
+    def append(self, event):
+        """Appends an event.
+
+        Args:
+            event (dict): Event, with at least "event" and "point" keys.
+        """
+        with self._lock():
+            self._append(event)
+
+    def state(self):
+        """Replays the journal.
+
+        Returns:
+            dict: By point key, its "status", owner "slot", set of
+                "iterations" done, time of the "last" event, number of
+                "failures" and "reason" of the last one.
+        """
+        with self._lock():
+            return self._replay(self._events())
+
+    @staticmethod
+    def _replay(events):
+        """Folds events into the state of every point."""
+        state = {}
+        for event in events:
+            point = state.setdefault(event["point"], {"status": PENDING, "slot": None,
+                                                      "iterations": set(), "last": 0,
+                                                      "failures": 0, "reason": ""})
+            point["last"] = event["time"]
+            if event["event"] == "claimed":
+                point["status"] = CLAIMED
+                point["slot"] = event["slot"]
+            elif event["event"] == "iteration":
+                point["iterations"].add(event["iteration"])
+            elif event["event"] == "completed":
+                point["status"] = COMPLETED
+            elif event["event"] == "failed":
+                point["status"] = FAILED
+                point["failures"] += 1
+                point["reason"] = event.get("reason", "")
+            elif event["event"] == "released":
+                point["status"] = PENDING
+                point["slot"] = None
+        return state
+
+class SweepScheduler:
+    """Hands the points of a grid to a client slot.
+
+    Args:
+        grid (dict): Parameter grid (see `grid_points`).
+        journal (str): Path of the checkpoint journal.
+        slot (int): Client slot running the points.
+        iterations (int, optional): Iterations of each point. Defaults to 10.
+        exclusive (callable, optional): Returns the global resource a point
+            needs (None if any), points needing the same resource never run
+            at the same time. Defaults to None.
+        lease (float, optional): Seconds without events after which a point
+            claimed by another slot is considered abandoned and can be taken
+            over. Defaults to None (never).
+        retries (int, optional): Times a failed point is run again before it
+            is given up. Defaults to 1.
+    """
+    def __init__(self, grid, journal, slot, iterations=10, exclusive=None, lease=None,
+                 retries=1):
+        self.points = grid_points(grid)
+        self.journal = SweepJournal(journal)
+        self.slot = slot
+        self.iterations = iterations
+        self.exclusive = exclusive or (lambda point: None)
+        self.lease = lease
+        self.retries = retries
+
+    def _given_up(self, status):
+        """Whether a point failed more times than retried."""
+        return status is not None and status["status"] == FAILED \
+            and status["failures"] > self.retries
+
+    def _available(self, status, now):
+        """Whether a point can be claimed by this slot."""
+        if status is None or status["status"] == PENDING:
+            return True
+        if status["status"] == FAILED:
+            return not self._given_up(status)
+        if status["status"] == CLAIMED:
+            return status["slot"] == self.slot or \
+                (self.lease is not None and now - status["last"] > self.lease)
+        return False
+
+    def claim(self):
+        """Claims the next point to run: the point this slot was running when
+        it stopped, if any, else the first available one.
+
+        Returns:
+            tuple: (point, iterations already done), or (None, None) when no
+                point is left for this slot.
+        """
+        with self.journal.transaction() as (state, append):
+            now = time.time()
+            busy = {self.exclusive(point) for point in self.points
+                    if state.get(point_key(point), {}).get("status") == CLAIMED
+                    and state[point_key(point)]["slot"] != self.slot}
+            busy.discard(None)
+            candidates = [point for point in self.points
+                          if self._available(state.get(point_key(point)), now)]
+            # Resume first
+            candidates.sort(key=lambda point: state.get(point_key(point), {}).get("slot")
+                            != self.slot)
+            for point in candidates:
+                key = point_key(point)
+                if self.exclusive(point) in busy:
+                    continue
+                status = state.get(key)
+                if status is None or status["slot"] != self.slot \
+                        or status["status"] != CLAIMED:
+                    append({"event": "claimed", "point": key, "params": point,
+                            "slot": self.slot})
+                done = status["iterations"] if status else set()
+                return point, done
+        return None, None
+
+    def pending(self):
+        """Number of points neither completed nor given up."""
+        state = self.journal.state()
+        return sum(1 for point in self.points
+                   if state.get(point_key(point), {}).get("status") != COMPLETED
+                   and not self._given_up(state.get(point_key(point))))
+
+    def failed_points(self):
+        """Points given up after failing every retry.
+
+        Returns:
+            list: (point, failures, reason of the last failure) tuples.
+        """
+        state = self.journal.state()
+        return [(point, state[point_key(point)]["failures"], state[point_key(point)]["reason"])
+                for point in self.points if self._given_up(state.get(point_key(point)))]
+
+    def _record(self, event, point, **fields):
+        """Appends an event of this slot about a point."""
+        self.journal.append(dict(event=event, point=point_key(point), slot=self.slot,
+                                 **fields))
+
+    def iteration_done(self, point, iteration):
+        """Checkpoints a finished iteration."""
+        self._record("iteration", point, iteration=iteration)
+
+    def completed(self, point):
+        """Marks a point as completed."""
+        self._record("completed", point)
+
+    def failed(self, point, reason=""):
+        """Marks a point as failed."""
+        self._record("failed", point, reason=str(reason))
+
+    def release(self, point):
+        """Gives a claimed point back, e.g. when the slot is stopped."""
+        self._record("released", point)
+
+    def run(self, func, wait=30):
+        """Runs the points of this slot until none is left.
+
+        Args:
+            func (callable): Called as `func(point, iterations, done, checkpoint)`
+                with the set of iterations already done and a callback to
+                checkpoint each finished iteration. Its result is ignored,
+                an exception marks the point as failed (see `retries`).
+            wait (int, optional): Seconds to wait before trying again when
+                every remaining point is held by another slot. Defaults to 30.
+
+        Returns:
+            int: Number of points run by this slot.
+        """
+        executed = 0
+        while True:
+            point, done = self.claim()
+            if point is None:
+                if not self.pending():
+                    failed = self.failed_points()
+                    print(f"Slot {self.slot}: sweep finished, {len(failed)} points failed")
+                    for failed_point, failures, reason in failed:
+                        print(f"  {point_key(failed_point)}: failed {failures} times, "
+                              f"last: {reason}")
+                    return executed
+                # Remaining points are running on other slots
+                time.sleep(wait)
+                continue
+            print(f"Slot {self.slot}: running {point_key(point)}"
+                  f" ({len(done)}/{self.iterations} iterations done)")
+            try:
+                func(point, self.iterations, done,
+                     lambda iteration, point=point: self.iteration_done(point, iteration))
+            except KeyboardInterrupt:
+                self.release(point)
+                raise
+            except Exception as exception:
+                print(f"Slot {self.slot}: {point_key(point)} failed: {exception!r}")
+                self.failed(point, repr(exception))
+            else:
+                self.completed(point)
+            executed += 1
+
+def load_grid(path):
+    """Loads a parameter grid from a JSON file.
+
+    Returns:
+        dict: Parameter grid (or list of points).
+    """
+    with open(path, encoding="utf8") as grid:
+        return json.load(grid)
@@ -0,0 +1,224 @@
+#!/bin/python3
+"""Local target servers module
+
+Stand-ins for the external endpoints used by the experiments, so that the
+throughput, latency and streaming experiments can run offline inside
+docker-compose with repeatable numbers:
+
+* HTTP server:
+    * `/tork/file_<n>` and `/bytes/<size>`: bulk transfer of a resource of
+      `size` bytes (file_<n> is `n` * 50 MB, like the dummy file).
+    * `/`: small page, for latency probes (GET and HEAD).
+    * `/stream/<bitrate>[?duration=<s>&vbr=<spread>&framed=1&seed=<n>]`:
+      paced "video" stream of `bitrate` bit/s, sent in chunks every 100 ms.
+      With `vbr`, the chunk sizes vary (log-normal, same mean bitrate); with
+      `framed`, every chunk starts with a CHUNK_HEADER (sequence number,
+      payload size and send time), for the streaming QoE benchmark.
+* Echo server: echoes every byte received, for latency probes.
+* Bulk TCP server: after a request line, sends data (`download <seconds>`),
+  discards it (`upload`) or both at the same time (`both <seconds>`), for
+  the native throughput tester.
+"""
+import asyncio
+import random
+import re
+import struct
+import time
+from argparse import ArgumentParser
+from urllib.parse import parse_qs, urlsplit
+
+HTTP_PORT = 8080
+ECHO_PORT = 7007
+BULK_PORT = 5202
+
+FILE_UNIT = 50 * 1024 * 1024
+BLOCK = 256 * 1024
+STREAM_CHUNK_TIME = 0.1
+
+# Header of a framed stream chunk: sequence number, payload size and send
+# time in seconds since the start of the stream
+CHUNK_HEADER = struct.Struct("!IId")
+
+# Payload shared by all transfers, sliced without copies
+PAYLOAD = memoryview(bytes(BLOCK))
+
+async def _send_bytes(writer, size):
+    """Sends `size` bytes of payload."""
+    while size > 0:
+        part = min(size, BLOCK)
+        writer.write(PAYLOAD[:part])
+        await writer.drain()
+        size -= part
+
+async def _send_for(writer, seconds):
+    """Sends payload as fast as possible for `seconds`."""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        writer.write(PAYLOAD)
+        await writer.drain()
+
+async def _send_paced(writer, bitrate, duration, vbr=0.0, framed=False, seed=0):
+    """Sends payload at a constant (or variable, with a log-normal spread
+    `vbr` of the chunk sizes) bitrate, in chunks every STREAM_CHUNK_TIME, for
+    `duration` seconds (forever if None). Framed chunks start with a
+    CHUNK_HEADER, counted in the chunk size."""
+    chunk = max(1, int(bitrate / 8 * STREAM_CHUNK_TIME))
+    sizes = random.Random(seed)
+    start = time.monotonic()
+    index = 0
+    while duration is None or index * STREAM_CHUNK_TIME < duration:
+        remaining = chunk
+        if vbr > 0:
+            # Log-normal factor of mean 1, so the mean bitrate is kept
+            remaining = int(chunk * sizes.lognormvariate(-vbr * vbr / 2, vbr))
+        if framed:
+            remaining = max(remaining - CHUNK_HEADER.size, 0)
+            writer.write(CHUNK_HEADER.pack(index, remaining, time.monotonic() - start))
+        while remaining > 0:
+            part = min(remaining, BLOCK)
+            writer.write(PAYLOAD[:part])
+            remaining -= part
+        await writer.drain()
+        index += 1
+        await asyncio.sleep(max(0, start + index * STREAM_CHUNK_TIME - time.monotonic()))
+
+def _header(status, length=None, extra=""):
+    """Builds an HTTP response header."""
+    header = f"HTTP/1.1 {status}\r\nServer: tork-targets\r\n{extra}"
+    if length is not None:
+        header += f"Content-Length: {length}\r\n"
+    return (header + "\r\n").encode()
+
+async def handle_http(reader, writer):
+    """Serves the HTTP requests of a connection."""
+    try:
+        while True:
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+            method, target = request.decode(errors="replace").split(" ", 2)[:2]
+            url = urlsplit(target)
+            head = method == "HEAD"
+
+            match = re.fullmatch(r"/(?:tork/file_(\d+)|bytes/(\d+))", url.path)
+            stream = re.fullmatch(r"/stream/(\d+)", url.path)
+            if match:
+                size = int(match.group(1)) * FILE_UNIT if match.group(1) \
+                       else int(match.group(2))
+                writer.write(_header("200 OK", size,
+                                     "Content-Type: application/octet-stream\r\n"))
+                if not head:
+                    await _send_bytes(writer, size)
+            elif stream:
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                writer.write(_header("200 OK", None,
+                                     "Content-Type: video/x-flv\r\nConnection: close\r\n"))
+                if not head:
+                    await _send_paced(writer, int(stream.group(1)),
+                                      float(query["duration"]) if "duration" in query else None,
+                                      vbr=float(query.get("vbr", 0)),
+                                      framed=query.get("framed") == "1",
+                                      seed=int(query.get("seed", 0)))
+                break
+            elif url.path == "/":
+                body = b"<html><body>TorK target</body></html>\n"
+                writer.write(_header("200 OK", len(body), "Content-Type: text/html\r\n"))
+                if not head:
+                    writer.write(body)
+            else:
+                writer.write(_header("404 Not Found", 0))
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def handle_echo(reader, writer):
+    """Echoes every byte received."""
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def _discard(reader):
+    """Reads and discards data until the connection is closed."""
+    while await reader.read(BLOCK):
+        pass
+
+async def handle_bulk(reader, writer):
+    """Serves a bulk transfer request."""
+    try:
+        command = (await reader.readline()).decode().split()
+        if not command:
+            return
+        if command[0] == "download":
+            await _send_for(writer, float(command[1]))
+        elif command[0] == "upload":
+            await _discard(reader)
+        elif command[0] == "both":
+            discard = asyncio.create_task(_discard(reader))
+            await _send_for(writer, float(command[1]))
+            discard.cancel()
+    except (ConnectionError, ValueError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+class TargetServers:
+    """Runs the local target servers.
+
+    Args:
+        host (str, optional): Address to listen on. Defaults to "0.0.0.0".
+        http_port (int, optional): HTTP server port. Defaults to HTTP_PORT.
+        echo_port (int, optional): Echo server port. Defaults to ECHO_PORT.
+        bulk_port (int, optional): Bulk TCP server port. Defaults to BULK_PORT.
+    """
+    def __init__(self, host="0.0.0.0", http_port=HTTP_PORT, echo_port=ECHO_PORT,
+                 bulk_port=BULK_PORT):
+        self.host = host
+        self.ports = {"http": http_port, "echo": echo_port, "bulk": bulk_port}
+        self.servers = []
+
+    async def start(self):
+        """Starts listening on every port."""
+        for name, handler in (("http", handle_http), ("echo", handle_echo),
+                              ("bulk", handle_bulk)):
+            server = await asyncio.start_server(handler, self.host, self.ports[name])
+            self.servers.append(server)
+            print(f"Target {name} server listening on {self.host}:{self.ports[name]}")
+
+    async def serve(self):
+        """Starts the servers and serves until cancelled."""
+        await self.start()
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def stop(self):
+        """Stops the servers."""
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+def main():
+    """Parses the arguments and runs the target servers.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--http_port", type=int, default=HTTP_PORT)
+    parser.add_argument("--echo_port", type=int, default=ECHO_PORT)
+    parser.add_argument("--bulk_port", type=int, default=BULK_PORT)
+    args = parser.parse_args()
+
+    servers = TargetServers(args.host, args.http_port, args.echo_port, args.bulk_port)
+    asyncio.run(servers.serve())
+
+if __name__ == '__main__':
+    main()
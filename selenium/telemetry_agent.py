@@ -0,0 +1,437 @@
+#!/bin/python3
+"""Telemetry agent module
+
+Lightweight replacement of the telemetry.sh and nethogs sessions opened over
+SSH at every iteration. The agent runs on each host and samples, at a fixed
+rate, the procfs counters of the monitored processes (tork, tor, iperf3...):
+
+* /proc/<pid>/stat: CPU ticks (user + system), threads and resident memory.
+* /proc/<pid>/status: voluntary and involuntary context switches.
+* /proc/<pid>/io: bytes read and written, including sockets (rchar/wchar),
+  and block I/O.
+
+plus the byte and packet counters of every interface from /proc/net/dev.
+Counters of processes with several instances are summed. The /proc files are
+kept open and re-read with pread, the process list is refreshed every second.
+
+Samples are streamed as fixed-size little-endian binary records over one
+persistent TCP connection per collector, each served by its own thread (the
+parallel sweep slots of a host connect at the same time): a JSON header
+describing the record layout is sent first, then one record per sample.
+The collector keeps the connection open for the whole session and cuts the
+stream per iteration, so CPU%, RSS, context switches and interface bytes can
+be aligned with the TorK stats.
+"""
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+from sampler import Sampler
+
+TELEMETRY_PORT = 7100
+
+MAGIC = b"TKTM"
+VERSION = 1
+
+DEFAULT_PROCESSES = ("tork", "tor", "iperf3")
+
+# Summed counters of the instances of a process
+PROCESS_FIELDS = ("instances", "cpu_ticks", "threads", "rss", "ctx_voluntary",
+                  "ctx_involuntary", "rchar", "wchar", "read_bytes", "write_bytes")
+INTERFACE_FIELDS = ("rx_bytes", "rx_packets", "tx_bytes", "tx_packets")
+
+RESCAN_INTERVAL = 1.0
+
+def record_dtype(processes, interfaces):
+    """NumPy dtype of a sample record.
+
+    Args:
+        processes (list): Monitored process names.
+        interfaces (list): Monitored interfaces.
+
+    Returns:
+        np.dtype: Packed little-endian record with the monotonic and wall
+            times of the sample followed by the process and interface counters.
+    """
+    fields = [("monotonic", "<f8"), ("wall", "<f8")]
+    fields += [(f"{process}_{field}", "<u8")
+               for process in processes for field in PROCESS_FIELDS]
+    fields += [(f"{interface}_{field}", "<u8")
+               for interface in interfaces for field in INTERFACE_FIELDS]
+    return np.dtype(fields)
+
+def _pread(fd, size=8192):
+    """Reads a whole procfs file from an open descriptor, until EOF: procfs
+    files are generated a page at a time, a short read is not the end."""
+    chunks = []
+    offset = 0
+    while True:
+        part = os.pread(fd, size, offset)
+        if not part:
+            return b"".join(chunks)
+        chunks.append(part)
+        offset += len(part)
+
+def read_net_dev(data):
+    """Parses /proc/net/dev.
+
+    Returns:
+        dict: (rx_bytes, rx_packets, tx_bytes, tx_packets) by interface.
+    """
+    counters = {}
+    for line in data.splitlines()[2:]:
+        name, _, values = line.partition(b":")
+        values = values.split()
+        counters[name.strip().decode()] = (int(values[0]), int(values[1]),
+                                           int(values[8]), int(values[9]))
+    return counters
+
+class TelemetryAgent:
+    """Samples the procfs counters of processes and interfaces.
+
+    Args:
+        processes (tuple, optional): Process names (as in /proc/<pid>/comm).
+            Defaults to DEFAULT_PROCESSES.
+        interfaces (tuple, optional): Interfaces. Defaults to None (every
+            interface present at start).
+        interval (float, optional): Sampling interval in seconds.
+            Defaults to 0.1.
+        proc (str, optional): procfs mount point. Defaults to "/proc".
+    """
+    def __init__(self, processes=DEFAULT_PROCESSES, interfaces=None, interval=0.1,
+                 proc="/proc"):
+        self.processes = list(processes)
+        self.interval = interval
+        self.proc = proc
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self._net_dev = os.open(f"{proc}/net/dev", os.O_RDONLY)
+        present = read_net_dev(_pread(self._net_dev))
+        self.interfaces = list(interfaces) if interfaces else sorted(present)
+        self.dtype = record_dtype(self.processes, self.interfaces)
+        # Open /proc/<pid>/{stat,status,io} descriptors by process name and pid
+        self._fds = {process: {} for process in self.processes}
+        self._scanned = -np.inf
+        # The descriptors are shared by the streams of every collector
+        self._lock = threading.Lock()
+
+    def header(self):
+        """Describes the record layout.
+
+        Returns:
+            dict: Processes, interfaces, fields, interval, record size and the
+                clock ticks per second and page size needed to convert the
+                counters.
+        """
+        return {"version": VERSION,
+                "hostname": socket.gethostname(),
+                "processes": self.processes,
+                "interfaces": self.interfaces,
+                "process_fields": PROCESS_FIELDS,
+                "interface_fields": INTERFACE_FIELDS,
+                "interval": self.interval,
+                "record_size": self.dtype.itemsize,
+                "clk_tck": os.sysconf("SC_CLK_TCK"),
+                "page_size": self.page_size}
+
+    def _open_pid(self, pid):
+        """Opens the procfs files of a process."""
+        fds = {}
+        try:
+            for name in ("stat", "status", "io"):
+                try:
+                    fds[name] = os.open(f"{self.proc}/{pid}/{name}", os.O_RDONLY)
+                except PermissionError:
+                    # io is only readable by the owner (or root)
+                    if name != "io":
+                        raise
+        except OSError:
+            self._close_pid(fds)
+            return None
+        return fds
+
+    @staticmethod
+    def _close_pid(fds):
+        """Closes the procfs files of a process."""
+        for fd in fds.values():
+            os.close(fd)
+
+    def rescan(self):
+        """Refreshes the pids of the monitored processes."""
+        found = {process: set() for process in self.processes}
+        for entry in os.listdir(self.proc):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"{self.proc}/{entry}/comm", "rb") as comm:
+                    name = comm.read().strip().decode(errors="replace")
+            except OSError:
+                continue
+            if name in found:
+                found[name].add(int(entry))
+        for process, pids in found.items():
+            opened = self._fds[process]
+            for pid in set(opened) - pids:
+                self._close_pid(opened.pop(pid))
+            for pid in pids - set(opened):
+                fds = self._open_pid(pid)
+                if fds is not None:
+                    opened[pid] = fds
+        self._scanned = time.monotonic()
+
+    def _read_pid(self, fds, counters):
+        """Adds the counters of a process to `counters`.
+
+        Returns:
+            bool: False if the process is gone.
+        """
+        try:
+            stat = _pread(fds["stat"])
+            status = _pread(fds["status"])
+            io = _pread(fds["io"]) if "io" in fds else b""
+        except OSError:
+            return False
+        if not stat:
+            return False
+        # The command name may contain spaces, fields start after it
+        fields = stat[stat.rindex(b")") + 2:].split()
+        counters["instances"] += 1
+        counters["cpu_ticks"] += int(fields[11]) + int(fields[12])
+        counters["threads"] += int(fields[17])
+        counters["rss"] += int(fields[21]) * self.page_size
+        for line in status.splitlines():
+            if line.startswith(b"voluntary_ctxt_switches"):
+                counters["ctx_voluntary"] += int(line.split()[1])
+            elif line.startswith(b"nonvoluntary_ctxt_switches"):
+                counters["ctx_involuntary"] += int(line.split()[1])
+        for line in io.splitlines():
+            name, _, value = line.partition(b":")
+            name = name.decode()
+            if name in counters:
+                counters[name] += int(value)
+        return True
+
+    def sample(self):
+        """Takes a sample.
+
+        Returns:
+            bytes: Binary record of the sample.
+        """
+        with self._lock:
+            return self._sample()
+
+    def _sample(self):
+        """Takes a sample, the caller holding the lock."""
+        if time.monotonic() - self._scanned >= RESCAN_INTERVAL:
+            self.rescan()
+        record = np.zeros((), dtype=self.dtype)
+        record["monotonic"] = time.monotonic()
+        record["wall"] = time.time()
+        for process, opened in self._fds.items():
+            counters = dict.fromkeys(PROCESS_FIELDS, 0)
+            for pid in list(opened):
+                if not self._read_pid(opened[pid], counters):
+                    self._close_pid(opened.pop(pid))
+            for field, value in counters.items():
+                record[f"{process}_{field}"] = value
+        net_dev = read_net_dev(_pread(self._net_dev))
+        for interface in self.interfaces:
+            for field, value in zip(INTERFACE_FIELDS, net_dev.get(interface, (0,) * 4)):
+                record[f"{interface}_{field}"] = value
+        return record.tobytes()
+
+    def stream(self, sock, stop=None):
+        """Streams samples to a connected socket until it is closed.
+
+        Args:
+            sock (socket.socket): Connected socket.
+            stop (threading.Event, optional): Stops the stream when set.
+        """
+        header = json.dumps(self.header()).encode()
+        sock.sendall(MAGIC + struct.pack("<HI", VERSION, len(header)) + header)
+        sampler = Sampler(lambda: sock.sendall(self.sample()), resolution=self.interval)
+        if stop is not None:
+            threading.Thread(target=lambda: (stop.wait(), sampler.stop()),
+                             daemon=True).start()
+        try:
+            sampler.run()
+        except OSError:
+            pass
+
+    def _handle(self, sock, address):
+        """Streams samples to a collector until it disconnects."""
+        print(f"Streaming telemetry to {address[0]}:{address[1]}")
+        with sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.stream(sock)
+        print(f"Telemetry collector {address[0]}:{address[1]} disconnected")
+
+    def serve(self, host="0.0.0.0", port=TELEMETRY_PORT):
+        """Accepts collectors and streams samples to each of them in its own
+        thread."""
+        with socket.create_server((host, port)) as server:
+            print(f"Telemetry agent listening on {host}:{port}")
+            while True:
+                sock, address = server.accept()
+                threading.Thread(target=self._handle, args=(sock, address),
+                                 daemon=True).start()
+
+class TelemetryCollector:
+    """Receives the samples of a telemetry agent over one persistent
+    connection.
+
+    Args:
+        host (str): Agent host.
+        port (int, optional): Agent port. Defaults to TELEMETRY_PORT.
+        timeout (float, optional): Connection timeout. Defaults to 10.
+    """
+    def __init__(self, host, port=TELEMETRY_PORT, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.header = None
+        self.dtype = None
+        self._chunks = []
+        self._count = 0
+        self._lock = threading.Lock()
+        self._sock = None
+        self._thread = None
+
+    def _recv_exactly(self, size):
+        """Receives exactly `size` bytes, b"" if the connection is closed."""
+        data = bytearray()
+        while len(data) < size:
+            part = self._sock.recv(size - len(data))
+            if not part:
+                return b""
+            data += part
+        return bytes(data)
+
+    def connect(self):
+        """Connects to the agent, reads the header and starts receiving."""
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        preamble = self._recv_exactly(len(MAGIC) + 6)
+        if preamble[:len(MAGIC)] != MAGIC:
+            self._sock.close()
+            raise ConnectionError(f"No telemetry agent at {self.host}:{self.port}")
+        _, length = struct.unpack("<HI", preamble[len(MAGIC):])
+        self.header = json.loads(self._recv_exactly(length))
+        self.dtype = record_dtype(self.header["processes"], self.header["interfaces"])
+        self._sock.settimeout(None)
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        """Receives records until the connection is closed."""
+        buffer = b""
+        size = self.dtype.itemsize
+        while True:
+            try:
+                data = self._sock.recv(max(65536, size))
+            except OSError:
+                break
+            if not data:
+                break
+            buffer += data
+            whole = len(buffer) // size * size
+            if whole:
+                records = np.frombuffer(buffer[:whole], dtype=self.dtype)
+                buffer = buffer[whole:]
+                with self._lock:
+                    self._chunks.append(records)
+                    self._count += len(records)
+
+    def connected(self):
+        """Whether records are still being received."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self):
+        """Closes the connection."""
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def mark(self):
+        """Index of the next record, to cut the stream at."""
+        with self._lock:
+            return self._count
+
+    def records(self, first=0, last=None):
+        """Raw records received between two marks.
+
+        Returns:
+            np.ndarray: Records of the agent's dtype.
+        """
+        with self._lock:
+            if self._chunks:
+                self._chunks = [np.concatenate(self._chunks)]
+                return self._chunks[0][first:last].copy()
+        return np.zeros(0, dtype=self.dtype)
+
+    def series(self, first=0, last=None):
+        """Derived time series of the records received between two marks.
+
+        Returns:
+            dict: "time" (relative monotonic time), "wall_times", and by
+                process its CPU usage in % of a core ("<process>_cpu"), RSS,
+                threads, instances, context switch and I/O byte rates (per
+                second), plus the byte and packet rates of every interface.
+                Rates are NaN on the first sample and on counter resets.
+        """
+        records = self.records(first, last)
+        times = records["monotonic"]
+        elapsed = np.diff(times, prepend=np.nan)
+
+        def rate(counter):
+            delta = np.diff(counter.astype(np.float64), prepend=np.nan)
+            delta[delta < 0] = np.nan
+            return delta / elapsed
+
+        series = {"time": times - times[0] if len(times) else times,
+                  "wall_times": records["wall"]}
+        for process in self.header["processes"]:
+            series[f"{process}_cpu"] = rate(records[f"{process}_cpu_ticks"]) \
+                                       / self.header["clk_tck"] * 100
+            for field in ("instances", "threads", "rss"):
+                series[f"{process}_{field}"] = records[f"{process}_{field}"]
+            for field in ("ctx_voluntary", "ctx_involuntary", "rchar", "wchar",
+                          "read_bytes", "write_bytes"):
+                series[f"{process}_{field}"] = rate(records[f"{process}_{field}"])
+        for interface in self.header["interfaces"]:
+            for field in INTERFACE_FIELDS:
+                series[f"{interface}_{field}"] = rate(records[f"{interface}_{field}"])
+        return series
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    """Parses the agent arguments and serves the samples.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=TELEMETRY_PORT)
+    parser.add_argument("--processes", type=str, default=",".join(DEFAULT_PROCESSES))
+    parser.add_argument("--interfaces", type=str, default="")
+    parser.add_argument("--interval", type=float, default=0.1)
+    args = parser.parse_args()
+
+    agent = TelemetryAgent(args.processes.split(","),
+                           args.interfaces.split(",") if args.interfaces else None,
+                           args.interval)
+    agent.serve(args.host, args.port)
+
+if __name__ == '__main__':
+    main()
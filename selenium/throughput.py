@@ -0,0 +1,267 @@
+#!/bin/python3
+"""Native throughput tester module
+
+Measures goodput through the TorK/Tor SOCKS port without proxychains or
+iperf: one or more streams are opened to the bulk TCP target server (see
+targets.py), which sends data (download), discards it (upload) or both at the
+same time (bidirectional). Data is received with `recv_into` in a single
+preallocated buffer per stream and accounted per 100 ms interval.
+
+With a steady-state detector (see steady_state.py), the aggregate goodput of
+every interval is fed to it as soon as the interval is over: the test ends
+once enough steady-state intervals were measured (`duration` being the
+maximum), and the summary covers the steady intervals instead of a fixed
+omitted start, the warm-up and transients being reported apart.
+"""
+import os
+import socket
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+import socks5
+from targets import BULK_PORT
+from steady_state import WARMUP, STEADY, TRANSIENT
+
+BUFFER_SIZE = 256 * 1024
+
+DIRECTIONS = ("download", "upload", "both")
+
+class ThroughputTest:
+    """Runs a multi-stream throughput test.
+
+    Args:
+        host (str): Bulk target server hostname.
+        port (int, optional): Bulk target server port. Defaults to BULK_PORT.
+        socks_port (int, optional): SOCKS port. Defaults to None (direct).
+        socks_host (str, optional): SOCKS host. Defaults to "127.0.0.1".
+        streams (int, optional): Number of parallel streams. Defaults to 1.
+        duration (float, optional): Measurement time in seconds.
+            Defaults to 30.
+        direction (str, optional): "download", "upload" or "both".
+            Defaults to "download".
+        interval (float, optional): Accounting interval in seconds.
+            Defaults to 0.1.
+        omit (float, optional): Seconds at the start left out of the
+            summary, like iperf's -O. Defaults to 1.
+        detector (SteadyStateDetector, optional): Detector fed with the
+            goodput of every interval, ending the test early and replacing
+            `omit`. Defaults to None.
+    """
+    def __init__(self, host, port=BULK_PORT, socks_port=None, socks_host="127.0.0.1",
+                 streams=1, duration=30, direction="download", interval=0.1, omit=1,
+                 detector=None):
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Invalid direction {direction}")
+        self.host = host
+        self.port = port
+        self.proxy = (socks_host, socks_port) if socks_port else None
+        self.streams = streams
+        self.duration = duration
+        self.direction = direction
+        self.interval = interval
+        self.omit = omit
+        self.detector = detector
+        intervals = int(np.ceil(duration / interval))
+        # Bytes received / sent by each stream in each interval
+        self.received = np.zeros((streams, intervals), dtype=np.int64)
+        self.sent = np.zeros((streams, intervals), dtype=np.int64)
+        self.setup = np.full(streams, np.nan)
+        self.errors = []
+        # Intervals measured, lowered once the steady state is long enough
+        self.end = intervals
+        self._start = None
+        # Measurements start once every stream is set up
+        self._ready = threading.Barrier(streams + 1, action=self._begin)
+
+    def _begin(self):
+        """Starts the measurement clock."""
+        self._start = time.monotonic()
+
+    def _bucket(self):
+        """Index of the current interval, None once the test is over."""
+        bucket = int((time.monotonic() - self._start) / self.interval)
+        return bucket if bucket < self.end else None
+
+    def _watch(self):
+        """Feeds the detector with the goodput (bit/s) of each interval,
+        half an interval after its end so late accounting is included."""
+        for bucket in range(self.end):
+            time.sleep(max(self._start + (bucket + 1.5) * self.interval
+                           - time.monotonic(), 0))
+            size = self.received[:, bucket].sum() + self.sent[:, bucket].sum()
+            self.detector.add(size * 8 / self.interval)
+            if self.detector.finished:
+                self.end = bucket + 1
+                break
+
+    def _receive(self, stream, sock):
+        """Receives into a preallocated buffer until the test is over."""
+        buffer = bytearray(BUFFER_SIZE)
+        view = memoryview(buffer)
+        received = self.received[stream]
+        while True:
+            size = sock.recv_into(view)
+            bucket = self._bucket()
+            if not size or bucket is None:
+                break
+            received[bucket] += size
+
+    def _send(self, stream, sock):
+        """Sends a preallocated buffer until the test is over."""
+        view = memoryview(os.urandom(BUFFER_SIZE))
+        sent = self.sent[stream]
+        while True:
+            size = sock.send(view)
+            bucket = self._bucket()
+            if bucket is None:
+                break
+            sent[bucket] += size
+
+    def _stream(self, stream):
+        """Runs a single stream."""
+        sock = None
+        try:
+            timings = socks5.Timings()
+            sock = socks5.create_connection(self.host, self.port, proxy=self.proxy,
+                                            timings=timings)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SIZE)
+            self.setup[stream] = timings.connect + timings.handshake
+            # The server sends for the whole test, plus a margin for the setup
+            # of the other streams
+            sock.sendall(f"{self.direction} {self.duration + 60}\n".encode())
+        except (OSError, socks5.SocksError) as exception:
+            self.errors.append(repr(exception))
+            if sock is not None:
+                sock.close()
+            sock = None
+        self._ready.wait()
+        if sock is None:
+            return
+        try:
+            if self.direction == "download":
+                self._receive(stream, sock)
+            elif self.direction == "upload":
+                self._send(stream, sock)
+            else:
+                sender = threading.Thread(target=self._send, args=(stream, sock))
+                sender.start()
+                self._receive(stream, sock)
+                sender.join()
+        except OSError as exception:
+            self.errors.append(repr(exception))
+        finally:
+            sock.close()
+
+    def run(self):
+        """Opens every stream, then measures all of them at the same time.
+
+        Returns:
+            dict: See `report`.
+        """
+        threads = [threading.Thread(target=self._stream, args=(stream,))
+                   for stream in range(self.streams)]
+        for thread in threads:
+            thread.start()
+        self._ready.wait()
+        if self.detector is not None:
+            self._watch()
+        for thread in threads:
+            thread.join()
+        return self.report()
+
+    def _labels(self):
+        """State of each measured interval (see steady_state.py), None
+        without detector."""
+        if self.detector is None:
+            return None
+        labels = np.zeros(self.end, dtype=np.int8)
+        fed = min(len(self.detector.labels), self.end)
+        labels[:fed] = self.detector.labels[:fed]
+        # Intervals never fed (test cut short) are left as warm-up
+        return labels
+
+    def _goodput(self, selected):
+        """Mean goodput in bit/s of the selected intervals."""
+        received = self.received[:, :self.end][:, selected]
+        sent = self.sent[:, :self.end][:, selected]
+        seconds = max(received.shape[1], 1) * self.interval
+        return {"rx": float(received.sum() * 8 / seconds),
+                "tx": float(sent.sum() * 8 / seconds),
+                "rx_streams": (received.sum(axis=1) * 8 / seconds).tolist(),
+                "tx_streams": (sent.sum(axis=1) * 8 / seconds).tolist()}
+
+    def report(self):
+        """Summarizes the measurements.
+
+        Returns:
+            dict: Mean goodput in bit/s after the omitted start, or of the
+                steady intervals with a detector, received ("rx") and sent
+                ("tx"), per stream and in total, with the stream setup times
+                and errors. With a detector, also whether the steady state
+                was reached ("steady", else the goodput is after the omitted
+                start), the "warmup" duration (s) and the mean goodput of the
+                warm-up ("warmup_rx", "warmup_tx") and of the transients
+                ("transient_rx", "transient_tx").
+        """
+        intervals = np.arange(self.end)
+        labels = self._labels()
+        selected = intervals >= int(self.omit / self.interval)
+        if labels is not None and (labels == STEADY).any():
+            selected = labels == STEADY
+        report = self._goodput(selected)
+        report.update(setup=self.setup.tolist(), errors=self.errors)
+        if labels is not None:
+            steady = np.flatnonzero(labels == STEADY)
+            report.update(steady=bool(len(steady)),
+                          warmup=float(steady[0] * self.interval) if len(steady) else np.nan)
+            for name, mask in (("warmup", labels == WARMUP), ("transient", labels == TRANSIENT)):
+                goodput = self._goodput(mask) if mask.any() else {"rx": np.nan, "tx": np.nan}
+                report.update({f"{name}_rx": goodput["rx"], f"{name}_tx": goodput["tx"]})
+        return report
+
+    def series(self):
+        """Aggregate goodput series in bit/s per interval, and per stream.
+
+        Returns:
+            dict: "time" (start of each interval), "rx" and "tx", plus the
+                per-stream 2D arrays "rx_streams" and "tx_streams", and the
+                "state" of each interval with a detector.
+        """
+        scale = 8 / self.interval
+        received = self.received[:, :self.end]
+        sent = self.sent[:, :self.end]
+        series = {"time": np.arange(self.end) * self.interval,
+                  "rx": received.sum(axis=0) * scale,
+                  "tx": sent.sum(axis=0) * scale,
+                  "rx_streams": received * scale,
+                  "tx_streams": sent * scale}
+        if self.detector is not None:
+            series["state"] = self._labels()
+        return series
+
+def main():
+    """Parses the throughput test arguments and runs it.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default=os.getenv("TARGET_HOST_IP"))
+    parser.add_argument("--port", type=int, default=BULK_PORT)
+    parser.add_argument("--socks_port", type=int, default=9050)
+    parser.add_argument("--streams", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--direction", type=str, default="download",
+                        choices=DIRECTIONS)
+    args = parser.parse_args()
+
+    test = ThroughputTest(args.host, args.port, socks_port=args.socks_port or None,
+                          streams=args.streams, duration=args.duration,
+                          direction=args.direction)
+    report = test.run()
+    print(f"rx: {report['rx'] / 1000:.1f} kbit/s\ttx: {report['tx'] / 1000:.1f} kbit/s")
+    for stream, (rx, tx) in enumerate(zip(report["rx_streams"], report["tx_streams"])):
+        print(f"  stream {stream}: rx {rx / 1000:.1f} kbit/s\ttx {tx / 1000:.1f} kbit/s")
+    for error in report["errors"]:
+        print(f"  error: {error}")
+
+if __name__ == '__main__':
+    main()
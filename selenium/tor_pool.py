@@ -0,0 +1,435 @@
+"""Warm Tor process pool module
+
+Bootstrapping Tor (consensus, descriptors, first circuit) is the largest
+share of the wall-clock time of a sweep point. The pool keeps Tor processes
+running between points and hands them out to the experiments instead of
+relaunching one per point:
+
+* Every instance has its own persistent DataDirectory, so even a process
+  launched from scratch (first use, or after a failed health check) starts
+  from the cached consensus and descriptors.
+* An idle instance launched with the same torrc is handed out as is. An idle
+  instance with another torrc (e.g. other TorK shaper parameters in the
+  ClientTransportPlugin line) is reconfigured with SETCONF, Tor restarting
+  the pluggable transport by itself, instead of being relaunched.
+* Instances are health-checked over the control port (bootstrap progress,
+  established circuits) before being handed out and when given back, and
+  are only relaunched when the check fails.
+
+Idle instances listen on their own SOCKS port; the instance handed out is
+moved to the SOCKS port of the requested torrc, so proxychains and the
+experiments keep using the port they are configured with. Every instance
+runs the TorK client (ClientTransportPlugin) on its own PT and CLI ports,
+the experiments reading the CLI port of the instance handed out (`cli_port`).
+Idle instances are parked with DisableNetwork, so their TorK clients leave
+the bridge and do not count in the K-groups of the points being measured.
+"""
+import os
+import threading
+import time
+import stem
+import stem.process
+from stem import Signal
+from stem.control import Controller
+
+# Options set by the pool for every instance
+INSTANCE_OPTIONS = ("socksport", "controlport", "datadirectory",
+                    "cookieauthentication", "disablenetwork")
+
+# Options of the TorK client command setting its PT and CLI ports
+TRANSPORT_PORT_OPTIONS = ("-p", "--port", "-t", "--cli_port")
+
+def normalize_config(config):
+    """Torrc options with lower case names and collapsed whitespace, so
+    equivalent configurations compare equal."""
+    return {name.lower(): " ".join(str(value).split()) for name, value in config.items()}
+
+def transport_ports(line, pt_port, cli_port):
+    """ClientTransportPlugin line running the TorK client on the given PT and
+    CLI ports, other transports being left as they are."""
+    tokens = line.split()
+    if "-m" not in tokens:
+        return line
+    kept, skip = [], False
+    for token in tokens:
+        if skip:
+            skip = False
+        elif token in TRANSPORT_PORT_OPTIONS:
+            skip = True
+        else:
+            kept.append(token)
+    return " ".join(kept + ["-p", str(pt_port), "--cli_port", str(cli_port)])
+
+def config_key(config):
+    """Canonical key of a torrc, without the options set per instance."""
+    options = normalize_config(config)
+    return "\n".join(f"{name}={options[name]}" for name in sorted(options)
+                     if name not in INSTANCE_OPTIONS)
+
+class TorInstance:
+    """Tor process of the pool.
+
+    Args:
+        index (int): Index of the instance in the pool.
+        data_directory (str): Persistent DataDirectory of the instance.
+        socks_port (int): SOCKS port while the instance is idle.
+        control_port (int): Control port of the instance.
+        password (str, optional): Control port password. Defaults to None
+            (cookie authentication).
+        pt_port (int, optional): Port of its TorK client. Defaults to 1088.
+        cli_port (int, optional): CLI port of its TorK client.
+            Defaults to 9091.
+    """
+    def __init__(self, index, data_directory, socks_port, control_port, password=None,
+                 pt_port=1088, cli_port=9091):
+        self.index = index
+        self.data_directory = data_directory
+        self.idle_socks_port = socks_port
+        self.socks_port = socks_port
+        self.control_port = control_port
+        self.pt_port = pt_port
+        self.cli_port = cli_port
+        self.password = password
+        self.process = None
+        self.config = {}
+        self.key = None
+        self.busy = False
+        self.launches = 0
+        self.warming = None
+
+    def options(self, config, socks_port=None):
+        """Torrc of the instance for a configuration, with the network
+        enabled."""
+        options = {name: value for name, value in normalize_config(config).items()
+                   if name not in INSTANCE_OPTIONS}
+        if "clienttransportplugin" in options:
+            options["clienttransportplugin"] = transport_ports(
+                options["clienttransportplugin"], self.pt_port, self.cli_port)
+        options.update(socksport=str(socks_port or self.idle_socks_port),
+                       controlport=str(self.control_port),
+                       datadirectory=self.data_directory,
+                       cookieauthentication="1",
+                       disablenetwork="0")
+        return options
+
+    def launch(self, config, tor_cmd, timeout=270, socks_port=None):
+        """Launches the Tor process and waits for its bootstrap.
+
+        Args:
+            config (dict): Torrc options.
+            tor_cmd (str): Path of the Tor binary.
+            timeout (int, optional): Bootstrap timeout in seconds.
+                Defaults to 270.
+            socks_port (int, optional): SOCKS port to listen on. Defaults to
+                None (idle SOCKS port).
+        """
+        self.stop()
+        os.makedirs(self.data_directory, mode=0o700, exist_ok=True)
+        print(f"Tor pool: launching instance {self.index}")
+        self.process = stem.process.launch_tor_with_config(
+                    config=self.options(config, socks_port),
+                    tor_cmd=tor_cmd,
+                    init_msg_handler=print,
+                    timeout=timeout,
+                    take_ownership=True)
+        self.socks_port = socks_port or self.idle_socks_port
+        self.config = dict(config)
+        self.key = config_key(config)
+        self.launches += 1
+
+    def alive(self):
+        """Whether the Tor process is running."""
+        return self.process is not None and self.process.poll() is None
+
+    def controller(self):
+        """Opens an authenticated connection to the control port.
+
+        Returns:
+            Controller: Connection, to be closed by the caller.
+        """
+        controller = Controller.from_port(port=self.control_port)
+        try:
+            controller.authenticate(password=self.password)
+        except Exception:
+            controller.close()
+            raise
+        return controller
+
+    def health(self):
+        """Checks the instance over the control port.
+
+        Returns:
+            dict: Bootstrap "progress" (%) and whether a "circuit" is
+                established, None if the process or its control port is
+                down.
+        """
+        if not self.alive():
+            return None
+        try:
+            with self.controller() as controller:
+                phase = controller.get_info("status/bootstrap-phase")
+                circuit = controller.get_info("status/circuit-established")
+        except (stem.ControllerError, stem.SocketError, OSError) as exception:
+            print(f"Tor pool: instance {self.index} control port error: {exception!r}")
+            return None
+        progress = 0
+        for field in phase.split():
+            if field.startswith("PROGRESS="):
+                progress = int(field.split("=", 1)[1])
+        return {"progress": progress, "circuit": circuit == "1"}
+
+    def healthy(self):
+        """Whether the instance is bootstrapped with an established circuit."""
+        health = self.health()
+        return health is not None and health["progress"] == 100 and health["circuit"]
+
+    def wait_ready(self, timeout=120, interval=1.0):
+        """Waits until the instance is healthy.
+
+        Returns:
+            bool: False if it did not become healthy within `timeout` seconds
+                or its process exited.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.healthy():
+                return True
+            if not self.alive():
+                return False
+            time.sleep(interval)
+        return False
+
+    def reconfigure(self, config, socks_port=None):
+        """Applies another torrc to the running process (SETCONF), resetting
+        the options the new configuration does not set.
+
+        Args:
+            config (dict): Torrc options.
+            socks_port (int, optional): SOCKS port to listen on. Defaults to
+                None (idle SOCKS port).
+        """
+        # DataDirectory and the control options cannot change while running
+        options = {name: value for name, value in self.options(config, socks_port).items()
+                   if name in ("socksport", "disablenetwork")
+                   or name not in INSTANCE_OPTIONS}
+        removed = [name for name in normalize_config(self.config)
+                   if name not in options and name not in INSTANCE_OPTIONS]
+        with self.controller() as controller:
+            if removed:
+                controller.reset_conf(*removed)
+            controller.set_options(options)
+        self.config = dict(config)
+        self.key = config_key(config)
+        self.socks_port = socks_port or self.idle_socks_port
+
+    def activate(self, socks_port):
+        """Enables the network of a parked instance and moves its SOCKS
+        listener to the requested port.
+
+        Args:
+            socks_port (int): SOCKS port, None for the idle SOCKS port.
+        """
+        socks_port = socks_port or self.idle_socks_port
+        with self.controller() as controller:
+            controller.set_options({"SocksPort": str(socks_port), "DisableNetwork": "0"})
+        self.socks_port = socks_port
+
+    def park(self):
+        """Moves the instance back to its idle SOCKS port and disables its
+        network: Tor keeps its consensus and descriptors, while its TorK
+        client leaves the bridge."""
+        with self.controller() as controller:
+            controller.set_options({"SocksPort": str(self.idle_socks_port),
+                                    "DisableNetwork": "1"})
+        self.socks_port = self.idle_socks_port
+
+    def new_circuits(self):
+        """Makes new streams use new circuits, as after a relaunch."""
+        with self.controller() as controller:
+            controller.signal(Signal.NEWNYM)
+
+    def stop(self):
+        """Stops the Tor process."""
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.key = None
+
+    def kill(self):
+        """Same as `stop`, as the process returned by stem."""
+        self.stop()
+
+class TorPool:
+    """Pool of pre-bootstrapped Tor processes.
+
+    Args:
+        directory (str): Directory of the persistent DataDirectories.
+        size (int, optional): Maximum number of Tor processes. Defaults to 1.
+        tor_cmd (str, optional): Path of the Tor binary.
+            Defaults to "/usr/local/bin/tor".
+        socks_port (int, optional): Idle SOCKS port of the first instance,
+            the next ones use the following ports. Defaults to 19050.
+        control_port (int, optional): Control port of the first instance.
+            Defaults to 19150.
+        timeout (int, optional): Bootstrap timeout of a launch in seconds.
+            Defaults to 270.
+        ready_timeout (int, optional): Seconds given to a reconfigured
+            instance to build a circuit before it is relaunched.
+            Defaults to 120.
+        password (str, optional): Control port password. Defaults to None
+            (cookie authentication).
+        pt_port (int, optional): TorK client port of the first instance.
+            Defaults to 1088.
+        cli_port (int, optional): TorK CLI port of the first instance.
+            Defaults to 9091.
+    """
+    def __init__(self, directory, size=1, tor_cmd="/usr/local/bin/tor", socks_port=19050,
+                 control_port=19150, timeout=270, ready_timeout=120, password=None,
+                 pt_port=1088, cli_port=9091):
+        self.tor_cmd = tor_cmd
+        self.timeout = timeout
+        self.ready_timeout = ready_timeout
+        self.instances = [TorInstance(index, os.path.join(directory, f"tor_{index}"),
+                                      socks_port + index, control_port + index, password,
+                                      pt_port + index, cli_port + index)
+                          for index in range(size)]
+        self.stats = {"launches": 0, "reuses": 0, "reconfigurations": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def _launch(self, instance, config, socks_port=None):
+        """Launches an instance, accounting it."""
+        instance.launch(config, self.tor_cmd, self.timeout, socks_port)
+        self.stats["launches"] += 1
+
+    def warm(self, config, count=None):
+        """Launches idle instances in the background, ready to be handed out.
+        Each one is parked once bootstrapped.
+
+        Args:
+            config (dict): Torrc options.
+            count (int, optional): Instances to warm up. Defaults to None
+                (every stopped instance).
+
+        Returns:
+            int: Number of instances being launched.
+        """
+        launched = 0
+        with self._lock:
+            for instance in self.instances:
+                if count is not None and launched >= count:
+                    break
+                if instance.busy or instance.warming or instance.alive():
+                    continue
+
+                def warm_up(instance=instance):
+                    try:
+                        self._launch(instance, config)
+                        instance.park()
+                    except (stem.ControllerError, stem.SocketError, OSError) as exception:
+                        print(f"Tor pool: warming instance {instance.index} failed:"
+                              f" {exception!r}")
+                        instance.stop()
+                    finally:
+                        instance.warming = None
+
+                instance.warming = threading.Thread(target=warm_up, daemon=True)
+                instance.warming.start()
+                launched += 1
+        return launched
+
+    def _choose(self, key):
+        """Picks the idle instance to hand out for a configuration, the
+        caller holding the lock: a running instance with the same torrc, else
+        any running one, else a stopped one."""
+        idle = [instance for instance in self.instances if not instance.busy]
+        for matches in (lambda instance: instance.key == key,
+                        lambda instance: instance.alive() or instance.warming,
+                        lambda instance: True):
+            for instance in idle:
+                if matches(instance):
+                    return instance
+        return None
+
+    def acquire(self, config):
+        """Hands out a bootstrapped Tor instance running `config`.
+
+        Args:
+            config (dict): Torrc options, its SocksPort is the port the
+                instance listens on while handed out.
+
+        Raises:
+            RuntimeError: Every instance is in use.
+
+        Returns:
+            TorInstance: Instance, to be given back with `release`.
+        """
+        key = config_key(config)
+        socks_port = int(normalize_config(config).get("socksport", 0)) or None
+        with self._lock:
+            instance = self._choose(key)
+            if instance is None:
+                raise RuntimeError("Every Tor instance of the pool is in use")
+            instance.busy = True
+        try:
+            warming = instance.warming
+            if warming is not None:
+                warming.join()
+            if instance.alive() and instance.health() is not None:
+                # Parked instances rejoin the network, reconnecting to the
+                # bridge from their cached consensus
+                if instance.key == key:
+                    print(f"Tor pool: reusing instance {instance.index}")
+                    instance.activate(socks_port)
+                    counter = "reuses"
+                else:
+                    print(f"Tor pool: reconfiguring instance {instance.index}")
+                    instance.reconfigure(config, socks_port)
+                    counter = "reconfigurations"
+                instance.new_circuits()
+                if instance.wait_ready(self.ready_timeout):
+                    self.stats[counter] += 1
+                    return instance
+                print(f"Tor pool: instance {instance.index} not ready after {counter[:-1]}")
+            if instance.alive():
+                self.stats["failures"] += 1
+            self._launch(instance, config, socks_port)
+            return instance
+        except BaseException:
+            instance.stop()
+            instance.busy = False
+            raise
+
+    def release(self, instance):
+        """Gives an instance back to the pool, parked, stopping it if it is
+        no longer healthy.
+
+        Args:
+            instance (TorInstance): Instance returned by `acquire`.
+        """
+        try:
+            if instance.healthy():
+                instance.park()
+            else:
+                print(f"Tor pool: instance {instance.index} unhealthy, stopping it")
+                self.stats["failures"] += 1
+                instance.stop()
+        except (stem.ControllerError, stem.SocketError, OSError) as exception:
+            print(f"Tor pool: releasing instance {instance.index} failed: {exception!r}")
+            instance.stop()
+        finally:
+            instance.busy = False
+
+    def close(self):
+        """Stops every instance, keeping their DataDirectories."""
+        for instance in self.instances:
+            warming = instance.warming
+            if warming is not None:
+                warming.join()
+            instance.stop()
+        print(f"Tor pool: {self.stats}")
@@ -0,0 +1,259 @@
+"""TorK CLI client module
+
+Keeps a single connection to the CLI interface of a TorK client or bridge,
+frames every reply and pipelines several commands in one round trip.
+"""
+import socket
+import time
+
+# CLI port of the bridge (clients default to 9091, see `--cli_port`)
+BRIDGE_CLI_PORT = 9095
+
+# Fields of a `stats_bytes` reply, in order. Clients append their state while
+# bridges append the number of connected clients and the client slots. Every
+# read resets the byte counters: a reply holds the bytes since the previous
+# `stats_bytes`, whoever sent it.
+STATS_BYTES_FIELDS = ("time",
+                      "data_bytes_received",
+                      "data_bytes_sent",
+                      "tor_bytes_received",
+                      "tor_bytes_sent",
+                      "other_bytes_received",
+                      "other_bytes_sent")
+
+# Fields of each `stats_frames` line (one line per client on the bridge). The
+# frame fields are the current depths of the client queues, not totals.
+STATS_FRAMES_FIELDS = ("time", "fd", "ctrl_frames", "data_frames",
+                       "reception_frames", "reception_mark")
+
+# Fields of a `stats_fp` reply: frames in use, frames free in the pool and
+# current pool size (the pool doubles when it runs dry, see FramePool.cc)
+STATS_FP_FIELDS = ("allocated", "unallocated", "total")
+
+# Commands whose reply spans several lines. They are followed by an empty
+# request, whose reply is an empty line marking the end of the reply.
+MULTILINE_COMMANDS = ("stats_frames", "stats_clients_detail", "stats_time", "s")
+
+# Commands whose reply resets what it reports: if the connection is lost after
+# they were sent, their reply may be lost with the counters, so they are
+# never replayed.
+RESET_ON_READ_COMMANDS = ("stats_bytes", "json")
+
+def parse_stats_bytes(reply):
+    """Parses a `stats_bytes` reply.
+
+    Args:
+        reply (str): Reply of the command.
+
+    Returns:
+        dict: Counters by name (see STATS_BYTES_FIELDS), plus "extra" with the
+            trailing state fields.
+    """
+    values = [int(value) for value in reply.split("\t")]
+    stats = dict(zip(STATS_BYTES_FIELDS, values))
+    stats["extra"] = values[len(STATS_BYTES_FIELDS):]
+    return stats
+
+def parse_stats_fp(reply):
+    """Parses a `stats_fp` reply.
+
+    Args:
+        reply (str): Reply of the command.
+
+    Returns:
+        dict: Frame counts by name (see STATS_FP_FIELDS).
+    """
+    return dict(zip(STATS_FP_FIELDS, (int(value) for value in reply.split("\t"))))
+
+def parse_stats_frames(reply):
+    """Parses a `stats_frames` reply.
+
+    Args:
+        reply (str): Reply of the command.
+
+    Returns:
+        list: One tuple per client with the values of STATS_FRAMES_FIELDS.
+    """
+    return [tuple(int(value) for value in line.split("\t"))
+            for line in reply.splitlines() if line]
+
+def parse_clients_detail(reply):
+    """Parses a `stats_clients_detail` reply.
+
+    Args:
+        reply (str): Reply of the command.
+
+    Returns:
+        dict: By client fd, its paired fd, state and K_min.
+    """
+    clients = {}
+    for line in reply.splitlines():
+        if not line:
+            continue
+        fds, state, k_min = line.split("\t")
+        fd0, fd1 = fds.split(" <-> ")
+        clients[int(fd0)] = {"fd1": int(fd1), "state": int(state.split(":")[1]),
+                             "k_min": int(k_min.split(":")[1])}
+    return clients
+
+class TorkCliClient:
+    """Persistent, pipelined client of the TorK CLI interface.
+
+    Args:
+        host (str, optional): CLI host. Defaults to "127.0.0.1".
+        port (int, optional): CLI TCP port. Defaults to 9091.
+        path (str, optional): Path of a UNIX CLI socket, used instead of the
+            TCP port when provided. Defaults to None.
+        timeout (int, optional): Socket timeout in seconds. Defaults to 15.
+        retries (int, optional): Reconnection attempts before giving up on a
+            request. Defaults to 3.
+    """
+    def __init__(self, host="127.0.0.1", port=9091, path=None, timeout=15,
+                 retries=3):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.retries = retries
+        self.sock = None
+        self._buffer = bytearray()
+
+    def connect(self):
+        """Opens the connection to the CLI interface."""
+        self.close()
+        if self.path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.path
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (self.host, self.port)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(address)
+
+    def close(self):
+        """Closes the connection, if open."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._buffer.clear()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _readline(self):
+        """Reads a line of the reply stream.
+
+        Raises:
+            ConnectionError: the CLI closed the connection.
+
+        Returns:
+            str: Line without the trailing newline.
+        """
+        while True:
+            newline = self._buffer.find(b"\n")
+            if newline >= 0:
+                line = self._buffer[:newline].decode()
+                del self._buffer[:newline + 1]
+                return line
+            part = self.sock.recv(65536)
+            if not part:
+                raise ConnectionError("TorK CLI closed the connection")
+            self._buffer += part
+
+    def _read_reply(self, command):
+        """Reads the full reply of a command.
+
+        Args:
+            command (str): Command whose reply is expected next.
+
+        Returns:
+            str: Reply without the trailing newline.
+        """
+        name = command.split()[0]
+        if name not in MULTILINE_COMMANDS:
+            return self._readline()
+
+        lines = []
+        while True:
+            line = self._readline()
+            # stats_time separates the CTRL, DATA and CHAFF sections with
+            # empty lines, only the one after CHAFF ends the reply
+            if not line and (name != "stats_time" or not lines or
+                             lines[0] != "CTRL:" or "CHAFF:" in lines):
+                return "\n".join(lines)
+            lines.append(line)
+
+    def execute(self, *commands):
+        """Sends several commands in a single write and reads their replies.
+
+        If the batch fails, the connection is reopened and the commands not
+        answered yet are sent again, unless one of them resets what it reads
+        (see RESET_ON_READ_COMMANDS).
+
+        Args:
+            *commands (str): Commands to execute, e.g. "stats_bytes".
+
+        Raises:
+            ConnectionError: all reconnection attempts failed, or the reply of
+                a reset-on-read command was lost.
+
+        Returns:
+            list: Reply of each command, in order.
+        """
+        replies = []
+        for attempt in range(self.retries + 1):
+            pending = commands[len(replies):]
+            sent = False
+            try:
+                if self.sock is None:
+                    self.connect()
+                sent = True
+                self.sock.sendall("".join(
+                    f"{command}\n\n" if command.split()[0] in MULTILINE_COMMANDS
+                    else f"{command}\n" for command in pending).encode())
+                for command in pending:
+                    replies.append(self._read_reply(command))
+                return replies
+            except OSError as exception:
+                print(f"TorK CLI error: {exception}, attempt: {attempt}")
+                self.close()
+                lost = [command for command in pending
+                        if command.split()[0] in RESET_ON_READ_COMMANDS]
+                if sent and lost:
+                    raise ConnectionError(f"TorK CLI connection lost, the reply of "
+                                          f"{lost[0]!r} may have reset its counters") \
+                        from exception
+                time.sleep(min(0.1 * 2 ** attempt, 1))
+        raise ConnectionError("Unable to reach the TorK CLI")
+
+    def query(self, command):
+        """Executes a single command.
+
+        Args:
+            command (str): Command to execute.
+
+        Returns:
+            str: Reply of the command.
+        """
+        return self.execute(command)[0]
+
+    def stats_bytes(self):
+        """Fetches the byte counters.
+
+        Returns:
+            dict: See `parse_stats_bytes`.
+        """
+        return parse_stats_bytes(self.query("stats_bytes"))
+
+    def stats_fp(self):
+        """Fetches the frame pool occupancy.
+
+        Returns:
+            dict: See `parse_stats_fp`.
+        """
+        return parse_stats_fp(self.query("stats_fp"))
@@ -0,0 +1,295 @@
+#!/bin/python3
+"""TrafficShaper rate auto-tuner module
+
+Closed-loop controller of the bridge TrafficShaper rate, through the CLI
+commands `ts` (current rate and state), `ts_rate <rate>` (sets the rate of
+the bridge shaper and orders it to the clients) and `stats_bytes` (data and
+no-data bytes, and number of clients).
+
+The rate is the period between frames, in microseconds, bounded by the
+`--ts_min` and `--ts_max` of the bridge: a shorter period gives the clients
+more goodput, but every frame without data is chaff. At each step the tuner
+measures the chaff/data overhead and, optionally, the latency through the
+tunnel, then:
+
+* slows down (longer period) when the overhead is above its cap, unless the
+  latency is above its cap;
+* speeds up (shorter period) when the latency is above its cap, or when the
+  overhead is below the cap by more than the hysteresis margin.
+
+The tuner keeps the rate it commanded, read once from `ts` at start. Unless
+started with `--disable_dynamic_rate`, the bridge resets the rate whenever a
+client joins or leaves, so the commanded rate is ordered again when the
+number of clients changes.
+
+Every step is appended to a JSON lines log (observation, rate before and
+after, reason), so a run can be replayed: `replay` orders the same rates on
+the same schedule, e.g. to compare a tuned run with a static one.
+"""
+import json
+import time
+from argparse import ArgumentParser
+import socks5
+from sampler import Sampler
+from tork_cli import TorkCliClient, BRIDGE_CLI_PORT, parse_stats_bytes
+from targets import ECHO_PORT
+
+class EchoLatency:
+    """Round-trip time of a small message through the tunnel, on a
+    persistent connection to the echo target server.
+
+    Args:
+        host (str): Echo server host.
+        port (int, optional): Echo server port. Defaults to ECHO_PORT.
+        socks_port (int, optional): SOCKS port. Defaults to None (direct).
+        socks_host (str, optional): SOCKS host. Defaults to "127.0.0.1".
+        timeout (int, optional): Timeout in seconds. Defaults to 10.
+    """
+    def __init__(self, host, port=ECHO_PORT, socks_port=None, socks_host="127.0.0.1",
+                 timeout=10):
+        self.target = (host, port)
+        self.proxy = (socks_host, socks_port) if socks_port else None
+        self.timeout = timeout
+        self.sock = None
+
+    def __call__(self):
+        """Measures a round trip.
+
+        Returns:
+            float: Round-trip time in seconds, None if it failed.
+        """
+        try:
+            if self.sock is None:
+                self.sock = socks5.create_connection(*self.target, proxy=self.proxy,
+                                                     timeout=self.timeout)
+            start = time.perf_counter()
+            self.sock.sendall(b"ping\n")
+            received = b""
+            while len(received) < 5:
+                part = self.sock.recv(64)
+                if not part:
+                    raise ConnectionError("Echo connection closed")
+                received += part
+            return time.perf_counter() - start
+        except (OSError, socks5.SocksError) as exception:
+            print(f"Echo latency error: {exception!r}")
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return None
+
+class TsTuner:
+    """Adjusts the TrafficShaper rate of a bridge online.
+
+    Args:
+        cli (TorkCliClient): Client of the bridge CLI.
+        ts_min (int): Shortest period allowed by the bridge (microseconds).
+        ts_max (int): Longest period allowed by the bridge (microseconds).
+        max_overhead (float, optional): Cap of the chaff/data byte ratio.
+            Defaults to 1.0.
+        max_latency (float, optional): Cap of the latency in seconds.
+            Defaults to None (no latency constraint).
+        latency (callable, optional): Returns the current latency in seconds
+            (or None). Defaults to None.
+        step (float, optional): Relative change of the period per step.
+            Defaults to 0.1.
+        hysteresis (float, optional): Relative margin below the overhead cap
+            within which the rate is kept. Defaults to 0.2.
+        interval (float, optional): Control period in seconds. Defaults to 1.
+        log (str, optional): Path of the JSON lines log. Defaults to None.
+    """
+    def __init__(self, cli, ts_min, ts_max, max_overhead=1.0, max_latency=None,
+                 latency=None, step=0.1, hysteresis=0.2, interval=1.0, log=None):
+        self.cli = cli
+        self.ts_min = ts_min
+        self.ts_max = ts_max
+        self.max_overhead = max_overhead
+        self.max_latency = max_latency
+        self.latency = latency
+        self.step = step
+        self.hysteresis = hysteresis
+        self.interval = interval
+        self.log = log
+        self.steps = []
+        self._rate = None
+        self._clients = None
+        self._previous = None
+        self._sampler = None
+
+    def observe(self):
+        """Reads the rate and byte counters in one round trip.
+
+        Returns:
+            dict: Commanded rate, rate and shaper state reported by the
+                bridge, number of clients, data and chaff byte rates since the
+                previous observation (None on the first one), overhead and
+                latency.
+        """
+        ts, stats = self.cli.execute("ts", "stats_bytes")
+        ts = [int(value) for value in ts.split("\t")]
+        stats = parse_stats_bytes(stats)
+        now = time.monotonic()
+        data = stats["data_bytes_received"] + stats["data_bytes_sent"]
+        chaff = stats["other_bytes_received"] + stats["other_bytes_sent"]
+        if self._rate is None:
+            self._rate = ts[0]
+        # The bridge appends the connected clients and the client slots, the
+        # latter driving its dynamic rate
+        observation = {"monotonic": now, "time": time.time(), "rate": self._rate,
+                       "bridge_rate": ts[0], "state": ts[1] if len(ts) > 1 else None,
+                       "clients": stats["extra"][-1] if stats["extra"] else None,
+                       "data_rate": None, "chaff_rate": None, "overhead": None,
+                       "latency": self.latency() if self.latency else None}
+        # The counters hold the bytes since the previous read, the first
+        # read covers an unknown period
+        if self._previous is not None:
+            elapsed = now - self._previous
+            data_rate = data / elapsed
+            chaff_rate = chaff / elapsed
+            observation.update(data_rate=data_rate, chaff_rate=chaff_rate,
+                               overhead=chaff_rate / data_rate if data_rate > 0
+                               else float("inf"))
+        self._previous = now
+        return observation
+
+    def decide(self, observation):
+        """Computes the next rate from an observation.
+
+        Args:
+            observation (dict): See `observe`.
+
+        Returns:
+            (int, str): Next rate, within [ts_min, ts_max], and the reason.
+        """
+        rate = observation["rate"]
+        latency = observation["latency"]
+        overhead = observation["overhead"]
+        slow = self.max_latency is not None and latency is not None \
+               and latency > self.max_latency
+        if overhead is None:
+            target, reason = rate, "warmup"
+        elif slow:
+            target, reason = rate * (1 - self.step), "latency"
+        elif overhead > self.max_overhead:
+            target, reason = rate * (1 + self.step), "overhead"
+        elif overhead < self.max_overhead * (1 - self.hysteresis):
+            target, reason = rate * (1 - self.step), "headroom"
+        else:
+            target, reason = rate, "hold"
+        return int(round(min(max(target, self.ts_min), self.ts_max))), reason
+
+    def tune(self):
+        """Runs one control step.
+
+        Returns:
+            dict: The observation with the new rate ("next_rate") and the
+                reason of the decision.
+        """
+        observation = self.observe()
+        next_rate, reason = self.decide(observation)
+        # A client joined or left: the bridge reset the rate
+        reset = self._clients is not None and observation["clients"] != self._clients
+        self._clients = observation["clients"]
+        if reset and next_rate == observation["rate"]:
+            reason = "clients"
+        if next_rate != observation["rate"] or reset:
+            reply = self.cli.query(f"ts_rate {next_rate}")
+            if reply != "OK":
+                print(f"ts_rate {next_rate} refused: {reply}")
+                next_rate, reason = observation["rate"], f"refused: {reply}"
+        self._rate = next_rate
+        observation.update(next_rate=next_rate, reason=reason)
+        self.steps.append(observation)
+        if self.log:
+            with open(self.log, "a", encoding="utf8") as log:
+                log.write(json.dumps(observation) + "\n")
+        return observation
+
+    def stop(self):
+        """Stops `run` after the current step."""
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def run(self, duration=None):
+        """Runs the control loop.
+
+        Args:
+            duration (float, optional): Seconds to run. Defaults to None
+                (until `stop` is called).
+
+        Returns:
+            list: Every step (see `tune`).
+        """
+        self._sampler = Sampler(self.tune, resolution=self.interval, duration=duration)
+        self._sampler.run()
+        return self.steps
+
+def load_log(path):
+    """Loads the steps of a tuner log.
+
+    Returns:
+        list: Steps, in order.
+    """
+    with open(path, encoding="utf8") as log:
+        return [json.loads(line) for line in log if line.strip()]
+
+def replay(path, cli, speed=1.0):
+    """Orders the rates of a tuner log again, on the same schedule.
+
+    Args:
+        path (str): Path of the tuner log.
+        cli (TorkCliClient): Client of the bridge CLI.
+        speed (float, optional): Time scale of the replay. Defaults to 1.0.
+
+    Returns:
+        int: Number of rate changes ordered.
+    """
+    steps = load_log(path)
+    if not steps:
+        return 0
+    origin = steps[0]["monotonic"]
+    start = time.monotonic()
+    changes = 0
+    for step in steps:
+        if step["next_rate"] == step["rate"] and step["reason"] != "clients":
+            continue
+        time.sleep(max(0, start + (step["monotonic"] - origin) / speed - time.monotonic()))
+        cli.query(f"ts_rate {step['next_rate']}")
+        changes += 1
+    return changes
+
+def main():
+    """Parses the tuner arguments and runs the control loop (or a replay).
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="bridge")
+    parser.add_argument("--port", type=int, default=BRIDGE_CLI_PORT)
+    parser.add_argument("--ts_min", type=int, required=True)
+    parser.add_argument("--ts_max", type=int, required=True)
+    parser.add_argument("--max_overhead", type=float, default=1.0)
+    parser.add_argument("--max_latency", type=float, default=None)
+    parser.add_argument("--echo_host", type=str, default=None)
+    parser.add_argument("--socks_port", type=int, default=9050)
+    parser.add_argument("--step", type=float, default=0.1)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument("--log", type=str, default="/results/ts_tuner.jsonl")
+    parser.add_argument("--replay", type=str, default=None)
+    args = parser.parse_args()
+
+    with TorkCliClient(args.host, args.port) as cli:
+        if args.replay:
+            print(f"Replayed {replay(args.replay, cli)} rate changes")
+            return
+        latency = EchoLatency(args.echo_host, socks_port=args.socks_port or None) \
+                  if args.echo_host else None
+        tuner = TsTuner(cli, args.ts_min, args.ts_max, max_overhead=args.max_overhead,
+                        max_latency=args.max_latency, latency=latency, step=args.step,
+                        interval=args.interval, log=args.log)
+        try:
+            tuner.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
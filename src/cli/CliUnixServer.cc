@@ -207,22 +207,35 @@ bool CliUnixServer::handle(int client)
     // get a request
     std::string request = get_request(client);
     // break if client is done or an error occurred
-
-    if (_controller != NULL) {
-        _controller->handleCliRequest(request, response);
+    if (request.empty()) {
+        _pending.erase(client);
+        return false;
     }
 
-    // send response
-    return send_response(client, response);   
-    
+    // serve every request of the client, including the ones pipelined in
+    // the same read
+    do {
+        if (_controller != NULL) {
+            _controller->handleCliRequest(request, response);
+        }
+
+        // send response
+        if (!send_response(client, response)) {
+            _pending.erase(client);
+            return false;
+        }
+        request = next_request(client);
+    } while (!request.empty());
+
+    return true;
 }
 
 
 std::string CliUnixServer::get_request(int client)
 {
-    std::string request = "";
+    std::string &pending = _pending[client];
     // read until we get a newline
-    while (request.find("\n") == std::string::npos) {
+    while (pending.find("\n") == std::string::npos) {
         int nread = recv(client, _buf, 1024, 0);
         if (nread < 0) {
             if (errno == EINTR)
@@ -236,10 +249,23 @@ std::string CliUnixServer::get_request(int client)
             return "";
         }
         // be sure to use append in case we have binary data
-        request.append(_buf, nread);
+        pending.append(_buf, nread);
+    }
+    return next_request(client);
+}
+
+
+std::string CliUnixServer::next_request(int client)
+{
+    std::string &pending = _pending[client];
+    size_t newline = pending.find("\n");
+
+    if (newline == std::string::npos) {
+        return "";
     }
-    // a better server would cut off anything after the newline and
-    // save it in a cache
+    // cut off anything after the newline and keep it for the next request
+    std::string request = pending.substr(0, newline + 1);
+    pending.erase(0, newline + 1);
     return request;
 }
 
@@ -9,6 +9,7 @@
 #include <sys/un.h>
 #include <unistd.h>
 #include <signal.h>
+#include <map>
 #include <set>
 #include <queue>
 #include <thread>
@@ -42,6 +43,8 @@ class CliUnixServer {
         bool handle(int);
     
         std::string get_request(int);
+
+        std::string next_request(int);
     
         bool send_response(int, std::string);
 
@@ -51,6 +54,9 @@ class CliUnixServer {
     
         char* _buf;
 
+        // Bytes received from each client after its last complete request
+        std::map<int, std::string> _pending;
+
     private:
 
         Controller *_controller;
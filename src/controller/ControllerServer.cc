@@ -466,7 +466,12 @@ void ControllerServer::handleCliRequest(std::string &request, std::string &respo
         if (params.size() != 2) {
             response = "Invalid value\nUsage: ts_rate <TS RATE>\n";
         } else {
-            order_TS_RATE(std::stoi(params[1]));
+            unsigned int rate = std::stoi(params[1]);
+            //send ctrl frame for clients change their TS rate
+            order_TS_RATE(rate);
+
+            //change bridge TS rate
+            _ts->setRate(rate);
 
             response = "OK\n";
         }